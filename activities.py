@@ -1,6 +1,8 @@
 from typing import Dict, List, Set, Optional, Tuple
 import re
 
+from keyword_matcher import KEYWORDS, KeywordHits
+
 ACTIVITIES = {
     'winter_sports': {
         'keywords': [
@@ -108,34 +110,41 @@ ACTIVITIES = {
     }
 }
 
+def _register_keywords():
+    for name, data in ACTIVITIES.items():
+        KEYWORDS.add_group((name, 'keywords'), data['keywords'])
+        for facility_type, keywords in data['required_facilities'].items():
+            KEYWORDS.add_group((name, 'facility', facility_type), keywords)
+        for condition_type, keywords in data.get('required_conditions', {}).items():
+            KEYWORDS.add_group((name, 'condition', condition_type), keywords)
+        KEYWORDS.add_group((name, 'incompatible'), data.get('incompatible_features', []))
+        KEYWORDS.add_group((name, 'required'), data.get('required_keywords', []))
+
+_register_keywords()
+
 class ActivityMatcher:
     def __init__(self, llm_service=None):
         self.llm_service = llm_service
 
-    def _rule_based_extract(self, text: str) -> List[Tuple[str, float]]:
-        """Extract activities using rule-based matching with confidence scores"""
-        text = text.lower()
+    def rule_based_activities(self, text: str, hits: Optional[KeywordHits] = None) -> List[Tuple[str, float]]:
+        """Activities found by keyword matching, as (activity, confidence) sorted by confidence.
+
+        `hits` is a keyword scan of `text` the caller already has; without it the text is scanned.
+        """
+        hits = hits or KEYWORDS.scan(text)
         matches = []
         
         for activity_name, activity_data in ACTIVITIES.items():
-            confidence = 0.0
-            keyword_matches = 0
+            # Keywords
+            confidence = hits.count((activity_name, 'keywords')) / len(activity_data['keywords'])
             
-            # Check keywords
-            for keyword in activity_data['keywords']:
-                if keyword in text:
-                    keyword_matches += 1
-                    confidence += 1.0 / len(activity_data['keywords'])
-            
-            # Check required facilities
-            facilities_matched = 0
+            # Required facilities
             total_facilities = sum(len(keywords) for keywords in activity_data['required_facilities'].values())
-            
-            for facility_type, keywords in activity_data['required_facilities'].items():
-                for keyword in keywords:
-                    if keyword in text:
-                        facilities_matched += 1
-                        confidence += 0.5 / total_facilities
+            facilities_matched = sum(
+                hits.count((activity_name, 'facility', facility_type))
+                for facility_type in activity_data['required_facilities']
+            )
+            confidence += 0.5 * facilities_matched / total_facilities
             
             # Only include activities with significant confidence
             if confidence > 0.2:  # At least 20% confidence
@@ -170,14 +179,28 @@ class ActivityMatcher:
     async def get_activities(self, text: str) -> List[Tuple[str, float]]:
         """Get activities with confidence scores using both rule-based and LLM methods"""
         # First try rule-based extraction
-        rule_based_matches = self._rule_based_extract(text)
+        rule_based_matches = self.rule_based_activities(text)
         
         # If we have high confidence matches, return them
         if rule_based_matches and rule_based_matches[0][1] > 0.6:
             return rule_based_matches
         
         # Try LLM as fallback
-        llm_activity = await self.extract_activity_llm(text)
+        return self._merge_llm_activity(rule_based_matches, await self.extract_activity_llm(text))
+
+    def get_activities_with_llm_hint(
+        self,
+        text: str,
+        llm_activity: Optional[str],
+        hits: Optional[KeywordHits] = None
+    ) -> List[Tuple[str, float]]:
+        """Same as get_activities, with the LLM's answer already known (e.g. from structured extraction)"""
+        rule_based_matches = self.rule_based_activities(text, hits)
+        if rule_based_matches and rule_based_matches[0][1] > 0.6:
+            return rule_based_matches
+        return self._merge_llm_activity(rule_based_matches, llm_activity if llm_activity in ACTIVITIES else None)
+
+    def _merge_llm_activity(self, rule_based_matches: List[Tuple[str, float]], llm_activity: Optional[str]) -> List[Tuple[str, float]]:
         if llm_activity:
             # Combine LLM result with rule-based matches
             llm_confidence = 0.8  # High confidence in LLM result
@@ -194,33 +217,35 @@ class ActivityMatcher:
         
         return rule_based_matches
 
-    def get_activity_score(self, city_text: str, activity: str) -> float:
-        """Calculate how well a city matches an activity's requirements"""
+    def get_activity_score(self, city_text: str, activity: str, hits: Optional[KeywordHits] = None) -> float:
+        """Calculate how well a city matches an activity's requirements
+
+        Pass `hits` (KEYWORDS.scan of the text) when scoring the same text for several activities.
+        """
         if activity not in ACTIVITIES:
             return 0.0
             
         activity_data = ACTIVITIES[activity]
         base_score = 0.0
-        city_text = city_text.lower()
+        hits = hits or KEYWORDS.scan(city_text)
         
         # Check incompatible features first
-        if 'incompatible_features' in activity_data:
-            if any(feature in city_text for feature in activity_data['incompatible_features']):
-                return 0.0
+        if hits.any((activity, 'incompatible')):
+            return 0.0
         
         # For activities with strict matching, require at least one keyword match
         if activity_data.get('strict_matching', False):
             if 'required_keywords' in activity_data:
-                if not any(keyword in city_text for keyword in activity_data['required_keywords']):
+                if not hits.any((activity, 'required')):
                     return 0.0
-            elif not any(keyword in city_text for keyword in activity_data['keywords']):
+            elif not hits.any((activity, 'keywords')):
                 return 0.0
         
         # Calculate facility score
         facilities_score = 0.0
         facilities_found = 0
         for facility_type, keywords in activity_data['required_facilities'].items():
-            facility_matches = sum(1 for keyword in keywords if keyword in city_text)
+            facility_matches = hits.count((activity, 'facility', facility_type))
             if facility_matches > 0:
                 facilities_found += 1
                 facilities_score += facility_matches / len(keywords)
@@ -235,7 +260,7 @@ class ActivityMatcher:
         if 'required_conditions' in activity_data:
             conditions_score = 0.0
             for condition_type, keywords in activity_data['required_conditions'].items():
-                condition_matches = sum(1 for keyword in keywords if keyword in city_text)
+                condition_matches = hits.count((activity, 'condition', condition_type))
                 conditions_score += condition_matches / len(keywords)
             base_score += conditions_score / len(activity_data['required_conditions'])
         
@@ -1,65 +1,192 @@
 from wiki import WikiService
 from embeddings import EmbeddingService
 from llm import LLMService
-from seasons import SEASONS
+from seasons import SEASONS, get_season_from_text
 from activities import ActivityMatcher
-from temperature import normalize_temperature_text, is_temperature_in_range
 from config import Config
+from city_index import load_or_build_index
+from climate import season_temperature
+from vector_ops import normalize_rows, top_k_indices
+from ann_index import IVFIndex
+from fact_matrix import FactMatrix
+from keyword_matcher import KEYWORDS
 import re
-import json
 import asyncio
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+# Keyword lists for the user's preferences, matched in the same pass as the activity
+# and season keywords (the city-side lists are in city_index.py)
+KEYWORDS.add_groups({
+    # Preferences -> location type, checked in this order
+    ('location', 'море'): ['пляж', 'море', 'песок', 'пляжный отдых'],
+    ('location', 'горы'): ['горы', 'лыж', 'горнолыж'],
+    ('location', 'spa'): ['спа', 'санатори', 'оздоровительн', 'лечебн', 'массаж'],
+    ('location', 'город'): ['музей', 'культур', 'город', 'архитектур'],
+    # Preferences that turn on extra city checks
+    ('wants', 'spa'): ['спа', 'массаж'],
+    ('wants', 'aquapark'): ['аквапарк'],
+    ('wants', 'ski'): ['горнолыж'],
+    ('wants', 'beach'): ['пляж'],
+    ('wants', 'kids_entertainment'): ['развлечения для детей'],
+})
 
 class TravelAdvisor:
-    def __init__(self, model_context_length: int = 10000):
+    def __init__(self, model_context_length: int = 10000, prefork: bool = False):
+        """Load every service and index.
+
+        With `prefork` the advisor is built once in a server's master process and
+        inherited by forked workers (see gunicorn.conf.py): the model is loaded up
+        front so its weights are shared copy-on-write, and the embedding cache turns
+        read-only because workers must not append to the same files concurrently.
+        """
         print("Initializing TravelAdvisor")
         self.wiki_service = WikiService()
-        self.embedding_service = EmbeddingService()
+        self.embedding_service = EmbeddingService(
+            server_address=Config.EMBEDDING_SERVER if Config.USE_EMBEDDING_SERVER else None
+        )
         self.llm_service = LLMService(model_context_length)
         self.context_manager = self.llm_service.context_manager
         self.activity_matcher = ActivityMatcher(self.llm_service)
+
+        # Precomputed per-city summaries, scores and embeddings for the current wiki corpus
+        self.city_index = load_or_build_index(self.wiki_service, self.embedding_service)
+        # Filter features are computed once here and carried by the shared wiki content
+        for city, content in self.wiki_service.contents.items():
+            if city in self.city_index:
+                content.features = self.city_index.features(city)
         
-        # Load tourist facts
-        with open('tourist_facts.json', 'r', encoding='utf-8') as f:
-            self.tourist_facts = json.load(f)
-        
-        # Calculate embeddings for all facts using batching
-        from tqdm import tqdm
-        self.fact_embeddings = {}
-        
-        # Count total facts for progress bar
-        total_facts = sum(
-            len(facts) 
-            for categories in self.tourist_facts.values() 
-            for facts in categories.values()
+        # Fact embeddings as one prebuilt matrix keyed by the content hash of tourist_facts.json
+        self.facts = FactMatrix.load(self.embedding_service)
+        print(f"Loaded {len(self.facts)} fact embeddings")
+        # The ANN index only serves search_facts, it is opened or built on its first call
+        self._fact_index = None
+        self._fact_index_lock = threading.Lock()
+
+        # Embedding lookups may run the model, so they run off the event loop on a
+        # long-lived pool instead of blocking every other request
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="advisor")
+
+        if prefork and self.embedding_service.client is None:
+            # Load now so the workers inherit the weights instead of loading their own copy
+            self.embedding_service.load_model()
+            self.embedding_service.cache.read_only = True
+
+    async def start(self):
+        """Open connection pools that live as long as the event loop (ASGI lifespan startup)."""
+        await self.wiki_service.osm_service.start()
+
+    async def aclose(self):
+        """Close connection pools and worker threads (ASGI lifespan shutdown)."""
+        await self.wiki_service.osm_service.close()
+        await self.llm_service.aclose()
+        self.executor.shutdown(wait=False)
+
+    @property
+    def fact_index(self) -> Optional[IVFIndex]:
+        """The ANN fact index, None without facts."""
+        if self._fact_index is None and len(self.facts):
+            with self._fact_index_lock:
+                if self._fact_index is None:
+                    self._fact_index = self._load_fact_index()
+        return self._fact_index
+
+    def _load_fact_index(self) -> IVFIndex:
+        """Open the ANN fact index stored next to the embedding cache, rebuilding it when the facts changed."""
+        path = f"{self.embedding_service.cache_file}.facts_ivf"
+        index = IVFIndex.load(path)
+        if index is None or index.key != self.facts.content_hash:
+            print("Building ANN fact index...")
+            index = IVFIndex.build(
+                self.facts.matrix, self.facts.cities, self.facts.categories, key=self.facts.content_hash
+            )
+            index.save(path)
+        return index
+
+    def search_facts(
+        self,
+        preferences_embedding,
+        top_k: int = 15,
+        cities: Optional[List[str]] = None,
+        categories: Optional[List[str]] = None,
+        nprobe: int = 8
+    ) -> List[Tuple[str, str, str, float]]:
+        """Approximate top facts across all cities (or a city/category subset) as (city, category, fact, score)."""
+        if self.fact_index is None:
+            return []
+        return [
+            (self.facts.cities[i], self.facts.categories[i], self.facts.texts[i], score)
+            for i, score in self.fact_index.search(preferences_embedding, top_k, nprobe, cities, categories)
+        ]
+
+    def get_top_facts(self, preferences_embedding, cities: List[str], top_k: int = 15) -> Dict[str, List[Tuple[str, float]]]:
+        """Most relevant facts for every city, scored with a single matrix multiply."""
+        ranges = [(city, self.facts.city_ranges[city]) for city in cities if city in self.facts.city_ranges]
+        if not ranges:
+            return {}
+
+        rows = np.concatenate([np.arange(start, end) for _, (start, end) in ranges])
+        scores = self.facts.matrix[rows] @ normalize_rows(preferences_embedding.reshape(-1))
+
+        top_facts = {}
+        offset = 0
+        for city, (start, end) in ranges:
+            city_scores = scores[offset:offset + end - start]
+            offset += end - start
+            if len(city_scores):
+                top_facts[city] = [
+                    (self.facts.texts[start + i], float(city_scores[i]))
+                    for i in top_k_indices(city_scores, top_k)
+                ]
+        return top_facts
+
+    async def _extract_request(self, user_input: str) -> Tuple[str, List[Tuple[str, float]], Optional[str], Optional[float]]:
+        """(preferences, activities, season, preferred temperature) for a user request.
+
+        With Config.STRUCTURED_EXTRACTION everything comes from one JSON-schema constrained
+        LLM call, seeded with the rule-based extractors; otherwise (or when that call fails)
+        preferences, activity and season are extracted one after another.
+        """
+        if Config.STRUCTURED_EXTRACTION:
+            try:
+                return await self._extract_request_structured(user_input)
+            except Exception as e:
+                print(f"Structured extraction failed, falling back to separate calls: {e}")
+
+        preferences = await self.llm_service.get_preferences(user_input)
+        activities = await self.activity_matcher.get_activities(user_input + "\n" + preferences)
+        season = await self.llm_service.get_season(user_input + "\n" + preferences)
+        return preferences, activities, season, None
+
+    async def _extract_request_structured(self, user_input: str) -> Tuple[str, List[Tuple[str, float]], Optional[str], Optional[float]]:
+        # Zero-latency pre-pass over the raw request, passed to the model as hints
+        hits = KEYWORDS.scan(user_input)
+        rule_activities = self.activity_matcher.rule_based_activities(user_input, hits)
+        profile = await self.llm_service.extract_request_profile(
+            user_input,
+            activity_hint=rule_activities[0][0] if rule_activities else None,
+            season_hint=get_season_from_text(user_input, hits)
         )
-        print(f"Found {total_facts} facts to process")
-        
-        # Collect all facts with progress bar
-        all_facts = []
-        fact_to_city_category = {}
-        with tqdm(total=total_facts, desc="Collecting facts") as pbar:
-            for city, categories in self.tourist_facts.items():
-                for category, facts in categories.items():
-                    for fact in facts:
-                        all_facts.append(fact)
-                        fact_to_city_category[fact] = (city, category)
-                        pbar.update(1)
-        
-        # Get embeddings in batches
-        print("Computing embeddings...")
-        fact_embeddings = self.embedding_service.get_embeddings_batch(all_facts)
-        
-        # Organize embeddings back into structure
-        print("Organizing results...")
-        for fact, embedding in fact_embeddings.items():
-            city, category = fact_to_city_category[fact]
-            if city not in self.fact_embeddings:
-                self.fact_embeddings[city] = {}
-            if category not in self.fact_embeddings[city]:
-                self.fact_embeddings[city][category] = []
-            self.fact_embeddings[city][category].append((fact, embedding))
-        
-    def _filter_cities_by_season(self, cities_content: dict, season: str, preferences: str = "") -> dict:
+        if profile.budget is not None:
+            print(f"💰 Detected budget: {profile.budget:.0f}")
+
+        # Same precedence as the serial path: confident rules first, the LLM's answer as fallback
+        text = user_input + "\n" + profile.preferences
+        hits = KEYWORDS.scan(text)
+        activities = self.activity_matcher.get_activities_with_llm_hint(text, profile.activity, hits)
+        season = get_season_from_text(text, hits) or profile.season
+        return profile.preferences, activities, season, profile.temperature
+
+    def _filter_cities_by_season(
+        self,
+        cities_content: dict,
+        season: str,
+        preferences: str = "",
+        temperature: Optional[float] = None
+    ) -> dict:
         """Filter cities based on seasonal criteria and preferences"""
         if not season:
             return cities_content
@@ -68,67 +195,55 @@ class TravelAdvisor:
         season_data = SEASONS[season]
         
         # Extract temperature preference if specified
-        temp_pref = None
-        if "температура:" in preferences.lower():
+        temp_pref = temperature
+        if temp_pref is None and "температура:" in preferences.lower():
             temp_match = re.search(r'температура:.*?(\d+)', preferences.lower())
             if temp_match:
                 temp_pref = int(temp_match.group(1))
         
+        wants = KEYWORDS.scan(preferences)
         for city, content in cities_content.items():
-            city_text = content.summary.lower()
+            features = content.features
+            # Seasonal temperature range from the (mean, max) of the climate table's season months,
+            # or of the temperatures mentioned in the summary when the table does not cover the season
             matches_season = False
-            city_temps = []
-            
-            # Extract all temperatures
-            temp_matches = re.finditer(r'температура.*?(-?\d+)', city_text)
-            for match in temp_matches:
-                temp = int(match.group(1))
-                city_temps.append(temp)
-            
-            # Check seasonal temperature ranges
-            if city_temps:
-                avg_temp = sum(city_temps) / len(city_temps)
-                if season_data['temp_range'][0] <= avg_temp <= season_data['temp_range'][1]:
-                    matches_season = True
-                    
+            season_temps = season_temperature(features.climate, season) if features.climate is not None else None
+            season_temps = season_temps or features.mentioned_temps
+            if season_temps is not None:
+                avg_temp, max_temp = season_temps
+                matches_season = season_data['temp_range'][0] <= avg_temp <= season_data['temp_range'][1]
+                if temp_pref and max_temp > temp_pref:
                     # Apply temperature preference if specified
-                    if temp_pref and any(temp > temp_pref for temp in city_temps):
-                        matches_season = False
+                    matches_season = False
             
             # Check for required infrastructure based on preferences, but be more lenient for beach cities
             if city not in Config.RESORT_CITIES.get('море', []):  # Only apply strict checks for non-beach cities
-                if 'спа' in preferences.lower() or 'массаж' in preferences.lower():
-                    if not any(kw in city_text.lower() for kw in ['спа', 'массаж', 'велнес', 'wellness', 'санатори']):
+                if wants.any(('wants', 'spa')):
+                    if not features.has_spa:
                         continue
                         
-                if 'аквапарк' in preferences.lower():
-                    if not any(kw in city_text.lower() for kw in ['аквапарк', 'водные аттракцион', 'развлечения']):
+                if wants.any(('wants', 'aquapark')):
+                    if not features.has_aquapark:
                         continue
                     
             # Check for seasonal activities and infrastructure
-            if any(keyword in city_text for keyword in season_data['keywords']):
+            if features.season_keyword_counts[season]:
                 matches_season = True
                 
             # Additional winter sports check with expanded keywords
-            if season == 'winter' and 'горнолыж' in preferences.lower():
-                if not any(kw in city_text.lower() for kw in [
-                    'горнолыж', 'лыж', 'подъемник', 'трасс', 'склон', 
-                    'катани', 'сноуборд', 'горнолыжный курорт'
-                ]):
+            if season == 'winter' and wants.any(('wants', 'ski')):
+                if not features.has_ski:
                     matches_season = False
                     
             # Additional summer beach check with expanded criteria   
-            if season == 'summer' and 'пляж' in preferences.lower():
+            if season == 'summer' and wants.any(('wants', 'beach')):
                 # For beach cities, be more lenient with seasonal matching
                 if city in Config.RESORT_CITIES.get('море', []):
                     matches_season = True
                 else:
-                    beach_keywords = ['пляж', 'море', 'песч', 'курорт', 'набережн', 'побереж', 'залив', 'бухт']
-                    infra_keywords = ['развлечен', 'аквапарк', 'атракцион', 'детская площадка', 'отдых']
-                    
-                    has_beach = any(kw in city_text.lower() for kw in beach_keywords)
-                    has_infrastructure = 'развлечения для детей' not in preferences.lower() or \
-                                       any(kw in city_text.lower() for kw in infra_keywords)
+                    has_beach = features.has_beach
+                    has_infrastructure = not wants.any(('wants', 'kids_entertainment')) or \
+                                       features.has_kids_infrastructure
                     
                     if has_beach:  # Only require beach presence for summer season
                         matches_season = True
@@ -140,25 +255,73 @@ class TravelAdvisor:
         if not filtered_cities:
             # Try matching just keywords without temperature
             for city, content in cities_content.items():
-                if any(keyword in content.summary.lower() for keyword in season_data['keywords']):
+                if content.features.season_keyword_counts[season]:
                     filtered_cities[city] = content
                     
         return filtered_cities if filtered_cities else cities_content
 
+    def climates(self, cities) -> Dict[str, np.ndarray]:
+        """The climate tables of those cities that have one."""
+        contents = self.wiki_service.contents
+        return {
+            city: contents[city].features.climate
+            for city in cities
+            if city in contents and contents[city].features is not None and contents[city].features.climate is not None
+        }
+
+    def admit(self):
+        """Raise LLMOverloaded when the LLM queue is too deep to take another request.
+
+        Called by the web apps before any work starts, so a shed request is answered
+        with 503 instead of waiting behind the queue.
+        """
+        self.llm_service.scheduler.admit(self.llm_service.priority)
+
+    def stats(self) -> dict:
+        return {
+            'llm_scheduler': self.llm_service.scheduler.stats(),
+            'llm_cache': self.llm_service.response_cache.stats()
+        }
+
     async def process_request(self, user_input: str):
+        """Run the whole pipeline and return (cities_chunks, top_cities, preferences, available_tokens, summarized_facts)."""
+        preferences = cities_chunks = top_cities = available_tokens = None
+        summarized_facts = {}
+        async for event in self.process_request_stream(user_input):
+            if event["type"] == "preferences":
+                preferences = event["preferences"]
+            elif event["type"] == "cities":
+                top_cities = event["top_cities"]
+                cities_chunks = event["cities_chunks"]
+                available_tokens = event["available_tokens"]
+            elif event["type"] == "facts":
+                summarized_facts[event["city"]] = event["facts"]
+
+        if top_cities is None:
+            return None, None, None, None, None
+        summarized_facts = {city: summarized_facts[city] for city, _ in top_cities if city in summarized_facts}
+        return cities_chunks, top_cities, preferences, available_tokens, summarized_facts
+
+    async def process_request_stream(self, user_input: str) -> AsyncIterator[dict]:
+        """Run the pipeline, yielding results as soon as each stage produces them.
+
+        Events, in order:
+        - {"type": "preferences", "preferences", "activities", "season"}
+        - {"type": "cities", "top_cities", "cities_chunks", "climates", "available_tokens"}
+        - {"type": "facts_delta", "city", "text"} for every generated piece of a city's summary
+        - {"type": "facts", "city", "facts"} once per city when its summary is complete
+        The stream ends after the preferences when no city content is available.
+        """
+        pipelines = []
         try:
-            # Extract preferences and season
-            preferences = await self.llm_service.get_preferences(user_input)
+            # Extract preferences, activities and season
+            preferences, activities, season, temperature = await self._extract_request(user_input)
             print(f"Extracted preferences: {preferences}")
-            
-            # Extract activities and season
-            activities = await self.activity_matcher.get_activities(user_input + "\n" + preferences)
             if activities:
                 print(f"🎯 Detected activities: {', '.join(f'{act}({conf:.2f})' for act, conf in activities)}")
-            
-            season = await self.llm_service.get_season(user_input + "\n" + preferences)
             if season:
                 print(f"🌍 Detected season: {season}")
+            yield {"type": "preferences", "preferences": preferences, "activities": activities, "season": season}
                 
             # Store primary activity for ranking
             primary_activity = activities[0][0] if activities else None
@@ -169,20 +332,13 @@ class TravelAdvisor:
 
             # Determine location type from preferences and activities
             location_type = None
-            pref_text = preferences.lower()
+            pref_hits = KEYWORDS.scan(preferences)
             
-            # Check for beach/sea indicators
-            if any(word in pref_text for word in ['пляж', 'море', 'песок', 'пляжный отдых']):
-                location_type = 'море'
-            # Check for mountain/skiing indicators    
-            elif any(word in pref_text for word in ['горы', 'лыж', 'горнолыж']):
-                location_type = 'горы'
-            # Check for spa/wellness indicators
-            elif any(word in pref_text for word in ['спа', 'санатори', 'оздоровительн', 'лечебн', 'массаж']):
-                location_type = 'spa'
-            # Check for city/cultural indicators
-            elif any(word in pref_text for word in ['музей', 'культур', 'город', 'архитектур']):
-                location_type = 'город'
+            # Beach/sea, mountain/skiing, spa/wellness and city/cultural indicators, in that order
+            for candidate in ['море', 'горы', 'spa', 'город']:
+                if pref_hits.any(('location', candidate)):
+                    location_type = candidate
+                    break
             
             # Also check activities
             if activities:
@@ -199,21 +355,22 @@ class TravelAdvisor:
             
             if not cities_content:
                 print("No cities content found")
-                return None, None, None, None, None
+                return
 
-            # Normalize temperature data
-            normalized_cities = {}
-            for city, content in cities_content.items():
-                content.summary = normalize_temperature_text(content.summary)
-                normalized_cities[city] = content
-            cities_content = normalized_cities
+            # Use the temperature-normalized summaries from the city index. Copy so the
+            # shared corpus content is not modified in place
+            cities_content = {
+                city: replace(content, summary=self.city_index.summary(city))
+                for city, content in cities_content.items()
+                if city in self.city_index
+            }
             
             # Enhanced activity filtering with infrastructure requirements
             if primary_activity:
                 filtered_cities = {}
                 for city, content in cities_content.items():
-                    activity_score = self.activity_matcher.get_activity_score(content.summary, primary_activity)
-                    city_text = content.summary.lower()
+                    activity_score = content.features.activity_score(primary_activity)
+                    has_infrastructure = content.features.activity_infrastructure.get(primary_activity, False)
                     
                     # Use a lower threshold for beach_vacation to be more inclusive
                     min_score = 0.1 if primary_activity == 'beach_vacation' else 0.2
@@ -221,26 +378,22 @@ class TravelAdvisor:
                     if activity_score >= min_score:
                         # For beach_vacation, check if it's in the море category or has beach-related keywords
                         if primary_activity == 'beach_vacation':
-                            beach_keywords = ['пляж', 'море', 'побереж', 'залив', 'бухт', 'курорт']
-                            if city in Config.RESORT_CITIES.get('море', []) or any(kw in city_text for kw in beach_keywords):
+                            if city in Config.RESORT_CITIES.get('море', []) or has_infrastructure:
                                 filtered_cities[city] = content
                                 
                         # For other activities, use activity-specific checks
                         elif primary_activity == 'spa_wellness':
-                            spa_keywords = ['спа', 'массаж', 'велнес', 'wellness', 'санатори', 'оздоровит', 
-                                          'лечебн', 'курорт', 'отдых', 'процедур', 'релакс', 'термальн',
-                                          'источник', 'грязелечени', 'минеральн', 'нарзан', 'бювет']
-                            if any(kw in city_text for kw in spa_keywords) or \
+                            if has_infrastructure or \
                                city in Config.RESORT_CITIES.get('spa', []) or \
                                city in ['Кисловодск', 'Пятигорск', 'Ессентуки', 'Железноводск']:
                                 filtered_cities[city] = content
                                 
                         elif primary_activity == 'winter_sports':
-                            if any(kw in city_text for kw in ['горнолыж', 'лыж', 'подъемник', 'трасс', 'склон', 'зимн']):
+                            if has_infrastructure:
                                 filtered_cities[city] = content
                                 
                         elif primary_activity == 'cultural_tourism':
-                            if any(kw in city_text for kw in ['музе', 'памятник', 'достопримечательност', 'истори', 'культур']):
+                            if has_infrastructure:
                                 filtered_cities[city] = content
                                 
                         else:  # Default case for other activities
@@ -251,34 +404,25 @@ class TravelAdvisor:
                     print(f"Found {len(cities_content)} cities matching activity and infrastructure criteria")
             
             # Apply seasonal filtering with preferences
-            cities_content = self._filter_cities_by_season(cities_content, season, preferences)
+            cities_content = self._filter_cities_by_season(cities_content, season, preferences, temperature)
             print(f"Found {len(cities_content)} cities matching all criteria")
 
-            # Prepare embeddings
-            summaries = [content.summary for content in cities_content.values()]
-            summaries.append(preferences)
-            print(f"Total summaries to embed: {len(summaries)}")
-
-            # Get embeddings
-            all_embeddings = self.embedding_service.get_embeddings_batch(summaries)
-
-            # Separate embeddings
-            preferences_embedding = all_embeddings[preferences]
-            cities_embeddings = {
-                city: all_embeddings[content.summary]
-                for city, content in cities_content.items()
-            }
+            # Only the preferences need embedding, city summaries are in the index
+            preferences_embedding = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.embedding_service.get_embedding, preferences
+            )
 
             print("Finding top cities")
-            top_cities = self.embedding_service.get_top_cities(
+            candidate_cities = list(cities_content)
+            rows = self.city_index.rows(candidate_cities)
+            top_cities = self.embedding_service.rank_cities(
                 preferences_embedding,
-                cities_embeddings,
-                {k: v.summary for k, v in cities_content.items()},
-                top_n=3,
-                season=season,
-                activity=primary_activity,
-                activity_matcher=self.activity_matcher
+                self.city_index.unit_embeddings[rows],
+                candidate_cities,
+                self.city_index.ranking_multipliers(rows, season, primary_activity),
+                top_n=3
             )
+            print(f"Selected top cities: {[city for city, _ in top_cities]}")
 
             selected_cities = [city for city, _ in top_cities]
             cities_chunks = {
@@ -286,37 +430,31 @@ class TravelAdvisor:
                 for city in selected_cities 
                 if city in cities_content
             }
+            yield {
+                "type": "cities",
+                "top_cities": top_cities,
+                "cities_chunks": cities_chunks,
+                "climates": self.climates(selected_cities),
+                "available_tokens": available_tokens
+            }
 
             # Find relevant facts for all cities at once
-            relevant_facts = {}
             all_city_facts = []
             
-            # First collect top facts for all cities
-            for city in selected_cities:
-                if city in self.fact_embeddings:
-                    city_facts = []
-                    for category, facts in self.fact_embeddings[city].items():
-                        for fact, fact_embedding in facts:
-                            similarity = self.embedding_service.cosine_similarity(
-                                preferences_embedding.reshape(1, -1),
-                                fact_embedding.reshape(1, -1)
-                            )[0][0]
-                            city_facts.append((fact, similarity))
-                    
-                    # Sort facts by relevance and take top 15
-                    city_facts.sort(key=lambda x: x[1], reverse=True)
-                    top_facts = city_facts[:15]
-                    facts_text = "\n".join([fact for fact, _ in top_facts])
-                    all_city_facts.append({
-                        "city": city,
-                        "facts": facts_text
-                    })
+            # Collect top 15 facts for all cities with one matrix multiply
+            for city, top_facts in self.get_top_facts(preferences_embedding, selected_cities).items():
+                facts_text = "\n".join([fact for fact, _ in top_facts])
+                all_city_facts.append({
+                    "city": city,
+                    "facts": facts_text
+                })
             
-            if all_city_facts:
-                # Process each city's facts in parallel
-                async def summarize_city_facts(city_data):
-                    messages = [
-                        {"role": "system", "content": f"""На основе предпочтений пользователя и фактов о городе, выберите и перефразируйте 5-7 самых релевантных фактов.
+            # Each city runs its own pipeline: the second-stage summary starts as soon
+            # as that city's first-stage facts are ready. The LLM service caps the
+            # number of requests in flight across all concurrent users.
+            async def summarize_city_facts(facts_text: str) -> List[Tuple[str, float]]:
+                messages = [
+                    {"role": "system", "content": f"""На основе предпочтений пользователя и фактов о городе, выберите и перефразируйте 5-7 самых релевантных фактов.
 Предпочтения пользователя: {preferences}
 
 Правила:
@@ -325,34 +463,18 @@ class TravelAdvisor:
 3. Удаляйте избыточную информацию
 4. Формулируйте факты кратко и четко
 5. Сохраняйте только практически полезную информацию для планирования поездки"""},
-                        {"role": "user", "content": city_data["facts"]}
-                    ]
-                    
-                    response = await self.llm_service.client.chat.completions.create(
-                        model=Config.LLM_MODEL,
-                        messages=messages,
-                        temperature=0.0,
-                        max_tokens=512
-                    )
-                    
-                    return city_data["city"], [
-                        (fact.strip(), 1.0) 
-                        for fact in response.choices[0].message.content.split('\n')
-                        if fact.strip()
-                    ]
-                
-                # Create tasks for all cities
-                tasks = [summarize_city_facts(city_data) for city_data in all_city_facts]
+                    {"role": "user", "content": facts_text}
+                ]
                 
-                # Run all tasks in parallel
-                results = await asyncio.gather(*tasks)
+                response = await self.llm_service.complete(messages, 512)
                 
-                # Organize results
-                relevant_facts = {city: facts for city, facts in results}
+                return [
+                    (fact.strip(), 1.0) 
+                    for fact in response.split('\n')
+                    if fact.strip()
+                ]
 
-            # Final LLM summarization of recommendations
-            summarized_facts = {}
-            for city, facts in relevant_facts.items():
+            async def summarize_city(city: str, facts: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
                 messages = [
                     {"role": "system", "content": f"""Создайте краткое описание города, включая только релевантную информацию для запроса:
 
@@ -388,18 +510,41 @@ class TravelAdvisor:
                     {"role": "user", "content": "\n".join([fact for fact, _ in facts])}
                 ]
                 
-                response = await self.llm_service.client.chat.completions.create(
-                    model=Config.LLM_MODEL,
-                    messages=messages,
-                    temperature=0.0,
-                    max_tokens=256
-                )
+                # Forward the summary token by token; a full queue (slow client) pauses the stream
+                parts = []
+                async for delta in self.llm_service.complete_stream(messages, 256):
+                    parts.append(delta)
+                    await events.put({"type": "facts_delta", "city": city, "text": delta})
+                response = "".join(parts)
                 
-                summarized_facts[city] = [(fact.strip(), 1.0) for fact in response.choices[0].message.content.split('\n') if fact.strip()]
+                return [(fact.strip(), 1.0) for fact in response.split('\n') if fact.strip()]
+
+            async def city_pipeline(city_data: dict):
+                try:
+                    facts = await summarize_city_facts(city_data["facts"])
+                    facts = await summarize_city(city_data["city"], facts)
+                    await events.put({"type": "facts", "city": city_data["city"], "facts": facts})
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await events.put({"type": "pipeline_error", "error": e})
 
-            return cities_chunks, top_cities, preferences, available_tokens, summarized_facts
+            events = asyncio.Queue(maxsize=Config.STREAM_QUEUE_SIZE)
+            pipelines = [asyncio.create_task(city_pipeline(city_data)) for city_data in all_city_facts]
+            remaining = len(pipelines)
+            while remaining:
+                event = await events.get()
+                if event["type"] == "pipeline_error":
+                    raise event["error"]
+                if event["type"] == "facts":
+                    remaining -= 1
+                yield event
 
         except Exception as e:
             print(f"Error occurred in process_request: {str(e)}")
             print(f"Error type: {type(e)}")
             raise
+        finally:
+            # Stop the remaining LLM calls when the consumer goes away early or a pipeline failed
+            for pipeline in pipelines:
+                pipeline.cancel()
@@ -0,0 +1,252 @@
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from vector_ops import normalize_rows, top_k_indices
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+    """Cluster unit-length vectors by cosine similarity, returning unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = assign_lists(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+
+        # Re-seed empty clusters with random points so every list gets used
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """Index of the most similar centroid for every vector, computed in chunks."""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        assignment[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return assignment
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index for cosine similarity.
+
+    Vectors are clustered into `nlist` lists around k-means centroids and stored
+    list by list, so a query only scores the vectors of the `nprobe` lists whose
+    centroids are closest to it. Every vector carries a city and a category code
+    that searches can be filtered on; results are row ids of the original vectors,
+    so their texts stay with the caller (FactMatrix.texts for the fact index).
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        vectors: np.ndarray,
+        ids: np.ndarray,
+        city_codes: np.ndarray,
+        category_codes: np.ndarray,
+        cities: List[str],
+        categories: List[str],
+        key: str = ''
+    ):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.ids = ids
+        self.city_codes = city_codes
+        self.category_codes = category_codes
+        self.cities = cities
+        self.categories = categories
+        self.key = key
+        self.city_lookup = {city: i for i, city in enumerate(cities)}
+        self.category_lookup = {category: i for i, category in enumerate(categories)}
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        cities: List[str],
+        categories: List[str],
+        nlist: Optional[int] = None,
+        n_iter: int = 20,
+        seed: int = 0,
+        key: str = ''
+    ) -> 'IVFIndex':
+        """Build an index; `cities` and `categories` describe each row of `vectors`."""
+        vectors = normalize_rows(vectors)
+        nlist = min(nlist or max(1, int(4 * np.sqrt(len(vectors)))), len(vectors))
+        centroids = spherical_kmeans(vectors, nlist, n_iter, seed)
+
+        assignment = assign_lists(vectors, centroids)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+
+        city_names = list(dict.fromkeys(cities))
+        category_names = list(dict.fromkeys(categories))
+        city_lookup = {city: i for i, city in enumerate(city_names)}
+        category_lookup = {category: i for i, category in enumerate(category_names)}
+        city_codes = np.array([city_lookup[city] for city in cities], dtype=np.int32)
+        category_codes = np.array([category_lookup[category] for category in categories], dtype=np.int32)
+
+        return cls(
+            centroids, offsets, np.ascontiguousarray(vectors[order]), order.astype(np.int64),
+            city_codes[order], category_codes[order], city_names, category_names, key
+        )
+
+    def save(self, path: str):
+        """Write `<path>.npz` with the arrays and `<path>.json` with the city and category names."""
+        np.savez(
+            f"{path}.npz",
+            centroids=self.centroids, offsets=self.offsets, vectors=self.vectors, ids=self.ids,
+            city_codes=self.city_codes, category_codes=self.category_codes
+        )
+        with open(f"{path}.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                'key': self.key,
+                'cities': self.cities,
+                'categories': self.categories
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['IVFIndex']:
+        if not Path(f"{path}.npz").exists() or not Path(f"{path}.json").exists():
+            return None
+        arrays = np.load(f"{path}.npz")
+        with open(f"{path}.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(
+            arrays['centroids'], arrays['offsets'], arrays['vectors'], arrays['ids'],
+            arrays['city_codes'], arrays['category_codes'],
+            meta['cities'], meta['categories'], meta['key']
+        )
+
+    def _filter_mask(self, cities: Optional[List[str]], categories: Optional[List[str]]) -> Optional[np.ndarray]:
+        """Boolean mask over all stored vectors, or None when there is no filter."""
+        mask = None
+        if cities is not None:
+            codes = [self.city_lookup[city] for city in cities if city in self.city_lookup]
+            mask = np.isin(self.city_codes, codes)
+        if categories is not None:
+            codes = [self.category_lookup[category] for category in categories if category in self.category_lookup]
+            category_mask = np.isin(self.category_codes, codes)
+            mask = category_mask if mask is None else mask & category_mask
+        return mask
+
+    def _score_rows(self, query: np.ndarray, rows: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        scores = self.vectors[rows] @ query
+        top = top_k_indices(scores, k)
+        return [(int(self.ids[row]), float(score)) for row, score in zip(rows[top], scores[top])]
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        nprobe: int = 8,
+        cities: Optional[Iterable[str]] = None,
+        categories: Optional[Iterable[str]] = None,
+        exact_threshold: int = 4096
+    ) -> List[Tuple[int, float]]:
+        """Approximate top-k as (original row id, cosine similarity) pairs, best first.
+
+        A selective filter (at most `exact_threshold` matching vectors, or fewer than
+        the probed lists would scan) is answered exactly over the matching vectors.
+        Otherwise the filter is applied inside the probed lists, probing more lists
+        until k matches were scored. `exact_threshold=0` always takes the list path.
+        """
+        query = normalize_rows(query.reshape(-1))
+        mask = self._filter_mask(
+            list(cities) if cities is not None else None,
+            list(categories) if categories is not None else None
+        )
+        nprobe = min(nprobe, self.nlist)
+
+        if mask is not None:
+            matching = np.flatnonzero(mask)
+            if exact_threshold and len(matching) <= max(exact_threshold, nprobe * len(self.vectors) / self.nlist):
+                return self._score_rows(query, matching, k)
+
+        list_order = np.argsort(-(self.centroids @ query))
+        while True:
+            rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in list_order[:nprobe]])
+            if mask is not None:
+                rows = rows[mask[rows]]
+            if len(rows) >= k or nprobe >= self.nlist:
+                return self._score_rows(query, rows, k)
+            nprobe = min(nprobe * 2, self.nlist)
+
+    def exact_search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        cities: Optional[Iterable[str]] = None,
+        categories: Optional[Iterable[str]] = None
+    ) -> List[Tuple[int, float]]:
+        """Brute-force top-k over every vector, for reference and benchmarking."""
+        query = normalize_rows(query.reshape(-1))
+        mask = self._filter_mask(
+            list(cities) if cities is not None else None,
+            list(categories) if categories is not None else None
+        )
+        rows = np.flatnonzero(mask) if mask is not None else np.arange(len(self.vectors))
+        return self._score_rows(query, rows, k)
+
+def benchmark(index: IVFIndex, n_queries: int = 200, k: int = 15, nprobes=(1, 2, 4, 8, 16, 32), seed: int = 0):
+    """Print recall@k and mean latency of approximate vs exact search.
+
+    Queries are stored vectors with gaussian noise added, searched
+    - over all cities
+    - filtered to the query's city, as served: small enough for the exact shortcut
+    - filtered to the query's city with exact_threshold=0, forcing the filtered list scan
+    - filtered to the query's category, which takes the list path by itself once a
+      category holds more than exact_threshold vectors
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(index.vectors), min(n_queries, len(index.vectors)), replace=False)
+    queries = index.vectors[sample] + rng.normal(scale=0.02, size=(len(sample), index.vectors.shape[1])).astype(np.float32)
+    query_cities = [{'cities': [index.cities[index.city_codes[row]]]} for row in sample]
+    query_categories = [{'categories': [index.categories[index.category_codes[row]]]} for row in sample]
+
+    print(f"Index: {len(index.vectors)} vectors, {index.nlist} lists, {len(sample)} queries, k={k}")
+    cases = (
+        ('all cities', [{}] * len(sample), {}),
+        ('one city', query_cities, {}),
+        ('one city, list scan', query_cities, {'exact_threshold': 0}),
+        ('one category', query_categories, {})
+    )
+    for label, filters, options in cases:
+        start = time.perf_counter()
+        exact = [index.exact_search(q, k, **f) for q, f in zip(queries, filters)]
+        exact_ms = (time.perf_counter() - start) * 1000 / len(sample)
+        print(f"\n[{label}] exact: {exact_ms:.3f} ms/query")
+
+        for nprobe in nprobes:
+            if nprobe > index.nlist:
+                break
+            start = time.perf_counter()
+            approx = [index.search(q, k, nprobe=nprobe, **f, **options) for q, f in zip(queries, filters)]
+            approx_ms = (time.perf_counter() - start) * 1000 / len(sample)
+            recall = np.mean([
+                len({i for i, _ in a} & {i for i, _ in e}) / max(len(e), 1)
+                for a, e in zip(approx, exact)
+            ])
+            print(f"[{label}] nprobe={nprobe:3d}: recall@{k}={recall:.3f}, {approx_ms:.3f} ms/query")
+
+if __name__ == "__main__":
+    # Usage: python ann_index.py [index path]
+    path = sys.argv[1] if len(sys.argv) > 1 else "emb_service_cache.facts_ivf"
+    index = IVFIndex.load(path)
+    if index is None:
+        print(f"No index at {path}.npz, start TravelAdvisor once to build it")
+        sys.exit(1)
+    benchmark(index)
@@ -1,12 +1,89 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import asyncio
+import json
+import queue
+import threading
+import time
 from advisor import TravelAdvisor
+from config import Config
+from llm import LLMOverloaded
+from formatting import format_event, format_response
 from asgiref.sync import async_to_sync
 
 app = Flask(__name__)
 # Initialize advisor
 advisor = TravelAdvisor()
 
+def overloaded(e: LLMOverloaded):
+    response = jsonify({'error': f'Сервис перегружен, попробуйте позже ({e})'})
+    response.headers['Retry-After'] = str(Config.LLM_RETRY_AFTER)
+    return response, 503
+
+def iterate_in_thread(agen_factory, max_buffered: int = Config.STREAM_QUEUE_SIZE):
+    """Drive an async generator on its own event loop in a worker thread and yield its items.
+
+    At most `max_buffered` items wait for the client; beyond that the pipeline
+    waits, in a thread so the worker loop keeps running and the LLM streams already
+    in progress still finish and free their scheduler slots. A client that reads
+    nothing for Config.STREAM_STALL_TIMEOUT seconds is treated as gone. Closing this
+    generator (the client disconnected) cancels the async side.
+    """
+    items = queue.Queue(maxsize=max_buffered)
+    done = object()
+    closed = threading.Event()
+    state = {}
+
+    def put(item):
+        deadline = time.monotonic() + Config.STREAM_STALL_TIMEOUT
+        while not closed.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    closed.set()
+
+    async def consume():
+        state['task'] = asyncio.current_task()
+        try:
+            async for item in agen_factory():
+                await asyncio.to_thread(put, item)
+                if closed.is_set():
+                    break
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            await asyncio.to_thread(put, e)
+        finally:
+            put(done)
+
+    def run():
+        loop = asyncio.new_event_loop()
+        state['loop'] = loop
+        try:
+            loop.run_until_complete(consume())
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        closed.set()
+        loop, task = state.get('loop'), state.get('task')
+        if task is not None and not task.done():
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # The loop already finished
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -18,60 +95,55 @@ async def ask():
         if not query:
             return jsonify({'error': 'No message provided'}), 400
 
+        advisor.admit()
         # Process the query using TravelAdvisor
         cities_chunks, top_cities, preferences, available_tokens, relevant_facts = await advisor.process_request(query)
-        
-        if not cities_chunks:
-            return jsonify({
-                'preferences': 'Не удалось обработать запрос',
-                'recommendations': []
-            })
-
-        # Format preferences for display
-        preferences_html = f"<h3>📋 Анализ запроса:</h3><p>{preferences}</p>"
-
-        # Format recommendations
-        recommendations = []
-        for city, score in top_cities:
-            details = []
-            
-            # Add score
-            details.append(f"Релевантность: {score:.3f}")
-            
-            # Add relevant facts
-            if city in relevant_facts and relevant_facts[city]:
-                facts_text = "📚 Интересные факты:"
-                for fact, _ in relevant_facts[city]:
-                    facts_text += f"<br>• {fact}"
-                details.append(facts_text)
-            
-            # Add climate information if available
-            if city in cities_chunks:
-                all_text = " ".join(cities_chunks[city])
-                if 'температура' in all_text.lower() or any(month in all_text.lower() for month in ['январ', 'феврал', 'март', 'апрел', 'май', 'июн', 'июл', 'август', 'сентябр', 'октябр', 'ноябр', 'декабр']):
-                    climate_info = "🌡️ "
-                    for sentence in all_text.split('.'):
-                        if any(month in sentence.lower() for month in ['январ', 'феврал', 'март', 'апрел', 'май', 'июн', 'июл', 'август', 'сентябр', 'октябр', 'ноябр', 'декабр']) and ('температура' in sentence.lower() or 'градус' in sentence.lower()):
-                            climate_info += sentence.strip() + ". "
-                            break
-                    if climate_info != "🌡️ ":
-                        details.append(climate_info.strip().replace(",", "."))
-
-            recommendations.append({
-                'name': city,
-                'details': details
-            })
 
-        return jsonify({
-            'preferences': preferences_html,
-            'recommendations': recommendations
-        })
+        climates = advisor.climates(city for city, _ in top_cities or [])
+        return jsonify(format_response(cities_chunks, top_cities, preferences, relevant_facts, climates))
 
+    except LLMOverloaded as e:
+        return overloaded(e)
     except Exception as e:
         return jsonify({
             'preferences': f'Произошла ошибка: {str(e)}',
             'recommendations': []
         }), 500
 
+@app.route('/ask/stream', methods=['POST'])
+def ask_stream():
+    """Same pipeline as /ask, streamed as NDJSON events while each stage completes."""
+    query = (request.json or {}).get('message')
+    if not query:
+        return jsonify({'error': 'No message provided'}), 400
+    try:
+        advisor.admit()
+    except LLMOverloaded as e:
+        return overloaded(e)
+
+    def events():
+        try:
+            for event in iterate_in_thread(lambda: advisor.process_request_stream(query)):
+                event = format_event(event)
+                if event is not None:
+                    yield event
+            yield {'type': 'done'}
+        except Exception as e:
+            yield {'type': 'error', 'message': f'Произошла ошибка: {str(e)}'}
+
+    def lines():
+        for event in events():
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return Response(
+        stream_with_context(lines()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/stats')
+def stats():
+    return jsonify(advisor.stats())
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,138 @@
+import asyncio
+import contextlib
+import gc
+import json
+
+from jinja2 import pass_context
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+
+from advisor import TravelAdvisor
+from config import Config
+from formatting import format_event, format_response
+from llm import LLMOverloaded
+
+templates = Jinja2Templates(directory='templates')
+
+@pass_context
+def url_for(context, name: str, filename: str = None, **path_params):
+    """Flask-style url_for(name, filename=...) so the template works under both apps."""
+    if filename is not None:
+        path_params['path'] = filename
+    return str(context['request'].url_for(name, **path_params))
+
+templates.env.globals['url_for'] = url_for
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    # TravelAdvisor is built once, so the OpenAI client, the OSM session and the
+    # advisor's worker pool keep their connections and threads across requests.
+    # A pre-fork server built the advisor in the master process already (create_preloaded_app);
+    # otherwise build it here, off the loop since loading the indexes is blocking work
+    advisor = getattr(app.state, 'advisor', None)
+    if advisor is None:
+        advisor = await asyncio.get_running_loop().run_in_executor(None, TravelAdvisor)
+    await advisor.start()
+    app.state.advisor = advisor
+    try:
+        yield
+    finally:
+        await advisor.aclose()
+
+async def read_query(request: Request):
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return None
+    return body.get('message') if isinstance(body, dict) else None
+
+def overloaded(e: LLMOverloaded) -> JSONResponse:
+    return JSONResponse(
+        {'error': f'Сервис перегружен, попробуйте позже ({e})'},
+        status_code=503,
+        headers={'Retry-After': str(Config.LLM_RETRY_AFTER)}
+    )
+
+async def index(request: Request):
+    return templates.TemplateResponse(request, 'index.html')
+
+async def ask(request: Request):
+    query = await read_query(request)
+    if not query:
+        return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+    try:
+        request.app.state.advisor.admit()
+        cities_chunks, top_cities, preferences, available_tokens, relevant_facts = \
+            await request.app.state.advisor.process_request(query)
+        climates = request.app.state.advisor.climates(city for city, _ in top_cities or [])
+        return JSONResponse(format_response(cities_chunks, top_cities, preferences, relevant_facts, climates))
+    except LLMOverloaded as e:
+        return overloaded(e)
+    except Exception as e:
+        return JSONResponse({
+            'preferences': f'Произошла ошибка: {str(e)}',
+            'recommendations': []
+        }, status_code=500)
+
+async def ask_stream(request: Request):
+    """Same pipeline as /ask, streamed as NDJSON events while each stage completes.
+
+    When the client disconnects the response task is cancelled, which cancels the
+    city pipelines and closes their upstream LLM streams.
+    """
+    query = await read_query(request)
+    if not query:
+        return JSONResponse({'error': 'No message provided'}, status_code=400)
+    try:
+        request.app.state.advisor.admit()
+    except LLMOverloaded as e:
+        return overloaded(e)
+
+    async def lines():
+        try:
+            async for event in request.app.state.advisor.process_request_stream(query):
+                event = format_event(event)
+                if event is not None:
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+            yield json.dumps({'type': 'done'}) + "\n"
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'message': f'Произошла ошибка: {str(e)}'}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def stats(request: Request):
+    return JSONResponse(request.app.state.advisor.stats())
+
+# ASGI counterpart of app.py with one long-lived event loop shared by all requests:
+# uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/ask', ask, methods=['POST']),
+        Route('/ask/stream', ask_stream, methods=['POST']),
+        Route('/stats', stats),
+        Mount('/static', StaticFiles(directory='static'), name='static'),
+    ],
+    lifespan=lifespan
+)
+
+def create_preloaded_app() -> Starlette:
+    """The app with TravelAdvisor built in the calling process, for pre-fork servers.
+
+    Workers forked afterwards share the loaded model, indexes and POI data
+    copy-on-write. Freezing the heap keeps the garbage collector from touching
+    (and so copying) those objects in every worker.
+    """
+    app.state.advisor = TravelAdvisor(prefork=True)
+    gc.collect()
+    gc.freeze()
+    return app
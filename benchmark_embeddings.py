@@ -0,0 +1,101 @@
+import json
+import random
+import sys
+import time
+from typing import List
+
+import numpy as np
+
+from config import Config
+from embeddings import BACKENDS, EmbeddingService
+
+def load_facts(n_texts: int, seed: int = 0) -> List[str]:
+    """A random sample of facts from tourist_facts.json."""
+    with open(Config.FACTS_FILE, 'r', encoding='utf-8') as f:
+        tourist_facts = json.load(f)
+    facts = list(dict.fromkeys(
+        fact
+        for categories in tourist_facts.values()
+        for facts in categories.values()
+        for fact in facts
+    ))
+    random.Random(seed).shuffle(facts)
+    return facts[:n_texts]
+
+def fixed_batches(service: EmbeddingService, texts: List[str], batch_size: int = 128) -> np.ndarray:
+    """The previous strategy: pad everything to the longest text, fixed batch size."""
+    encoded = service.tokenizer(texts, padding=True, truncation=True, max_length=512, return_tensors='pt')
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        embeddings.append(service._embed_batch({
+            'input_ids': encoded['input_ids'][i:i + batch_size].to(service.device),
+            'attention_mask': encoded['attention_mask'][i:i + batch_size].to(service.device)
+        }))
+    return np.concatenate(embeddings)
+
+def padded_tokens(service: EmbeddingService, texts: List[str], batch_size: int = 128) -> tuple:
+    """(real tokens, padded tokens for fixed batches, padded tokens for bucketed batches)"""
+    lengths = [len(ids) for ids in service.tokenizer(texts, truncation=True, max_length=512)['input_ids']]
+    fixed = max(lengths) * len(lengths)
+    bucketed = sum(lengths[batch[0]] * len(batch) for batch in service._plan_batches(lengths))
+    return sum(lengths), fixed, bucketed
+
+def run(name: str, embed, texts: List[str], real_tokens: int, padded: int) -> np.ndarray:
+    start = time.perf_counter()
+    embeddings = embed(texts)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>11}: {elapsed:7.2f} s, {len(texts) / elapsed:7.1f} texts/s, "
+          f"{real_tokens / elapsed:8.0f} tokens/s, {real_tokens / padded:.0%} of computed tokens are real")
+    return embeddings
+
+def cosine_drift(reference: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+    """Row-wise cosine similarity between embeddings and the fp32 reference."""
+    return np.sum(reference * embeddings, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(embeddings, axis=1)
+    )
+
+def compare_batching(texts: List[str], num_threads: int = None):
+    service = EmbeddingService(device='cpu', num_threads=num_threads)
+    real_tokens, fixed_padded, bucketed_padded = padded_tokens(service, texts)
+
+    # Warm up so model loading and first-call allocation are not timed
+    service.compute_embeddings(texts[:16])
+
+    fixed = run('fixed', lambda t: fixed_batches(service, t), texts, real_tokens, fixed_padded)
+    bucketed = run('bucketed', service.compute_embeddings, texts, real_tokens, bucketed_padded)
+
+    # Padding is masked out by mean pooling, so both strategies must agree
+    print(f"min cosine between strategies: {cosine_drift(fixed, bucketed).min():.6f}")
+
+def compare_backends(texts: List[str], backends: List[str], num_threads: int = None):
+    reference = None
+    for backend in ['fp32'] + [b for b in backends if b != 'fp32']:
+        try:
+            service = EmbeddingService(device='cpu', backend=backend, num_threads=num_threads)
+            service.compute_embeddings(texts[:16])
+        except ImportError as e:
+            print(f"{backend:>11}: skipped ({e})")
+            continue
+        real_tokens, _, bucketed_padded = padded_tokens(service, texts)
+        embeddings = run(backend, service.compute_embeddings, texts, real_tokens, bucketed_padded)
+
+        if reference is None:
+            reference = embeddings
+        else:
+            # Ranking only needs the direction of the vectors to survive
+            drift = cosine_drift(reference, embeddings)
+            print(f"{'':>11}  cosine vs fp32: mean {drift.mean():.5f}, min {drift.min():.5f}")
+
+if __name__ == "__main__":
+    # Usage: python benchmark_embeddings.py [batching|backends] [n_texts] [num_threads] [backend,...]
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'batching'
+    n_texts = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    num_threads = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    backends = sys.argv[4].split(',') if len(sys.argv) > 4 else list(BACKENDS)
+    texts = load_facts(n_texts)
+    print(f"{len(texts)} facts")
+
+    if mode == 'backends':
+        compare_backends(texts, backends, num_threads)
+    else:
+        compare_batching(texts, num_threads)
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import List, Optional
+
+import aiohttp
+from aiohttp import web
+
+QUERIES = [
+    "Хочу поехать на море в августе, чтобы было тепло около 25-30 градусов и песчаный пляж. Бюджет до 100000 рублей.",
+    "Горнолыжный курорт в феврале для катания на сноуборде",
+    "Культурный отдых в мае: музеи, архитектура, исторический центр",
+    "Семейный отдых с детьми летом, нужен аквапарк и развлечения",
+    "Оздоровительный отдых в санатории с минеральными водами осенью",
+]
+
+# What the stub endpoint answers: schema-constrained calls get a profile, others filler text
+STUB_PROFILE = {'preferences': "🎯 Главные требования:\n• пляжный отдых", 'activity': 'beach_vacation',
+                'season': 'summer', 'temperature': 27, 'budget': 100000}
+STUB_WORD = "текст "
+
+def stub_llm_app(first_token: float, tokens_per_second: float, max_tokens: int) -> web.Application:
+    """An OpenAI-compatible /v1/chat/completions with a fixed time to first token and generation rate.
+
+    Lets the Flask and the ASGI app be loaded without a GPU, so the numbers show the
+    serving overhead and the scheduler rather than the model.
+    """
+    async def completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if body.get('response_format'):
+            pieces = [json.dumps(STUB_PROFILE, ensure_ascii=False)]
+        else:
+            pieces = [STUB_WORD] * min(max_tokens, body.get('max_tokens') or max_tokens)
+        await asyncio.sleep(first_token)
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None, **fields) -> dict:
+            return {'id': 'stub', 'created': 0, 'model': body.get('model', 'stub'), **fields,
+                    'choices': [{'index': 0, 'delta': delta, 'message': delta, 'finish_reason': finish_reason}]}
+
+        if not body.get('stream'):
+            await asyncio.sleep((len(pieces) - 1) / tokens_per_second)
+            message = {'role': 'assistant', 'content': ''.join(pieces)}
+            return web.json_response(chunk(message, 'stop', object='chat.completion'))
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(1 / tokens_per_second)
+            data = chunk({'role': 'assistant', 'content': piece}, object='chat.completion.chunk')
+            await response.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+        data = chunk({}, 'stop', object='chat.completion.chunk')
+        await response.write(f"data: {json.dumps(data)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        return response
+
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', completions)
+    return app
+
+async def one_request(session: aiohttp.ClientSession, url: str, query: str, stream: bool) -> dict:
+    """Latency of one /ask (or /ask/stream) call; for streams also the time to the first event."""
+    start = time.perf_counter()
+    first_event = None
+    try:
+        async with session.post(url, json={'message': query}) as response:
+            if stream:
+                async for line in response.content:
+                    if first_event is None and line.strip():
+                        first_event = time.perf_counter() - start
+                    if line.strip() and json.loads(line).get('type') == 'error':
+                        return {'ok': False, 'latency': time.perf_counter() - start, 'first_event': first_event}
+            else:
+                await response.read()
+            return {
+                'ok': response.status == 200,
+                'shed': response.status == 503,
+                'latency': time.perf_counter() - start,
+                'first_event': first_event
+            }
+    except aiohttp.ClientError:
+        return {'ok': False, 'latency': time.perf_counter() - start, 'first_event': first_event}
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run(base_url: str, concurrency: int, total: int, stream: bool, timeout: float, seed: int = 0) -> dict:
+    url = base_url.rstrip('/') + ('/ask/stream' if stream else '/ask')
+    rng = random.Random(seed)
+    queries = [rng.choice(QUERIES) for _ in range(total)]
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def worker(query: str):
+        async with semaphore:
+            results.append(await one_request(session, url, query, stream))
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(query) for query in queries])
+        elapsed = time.perf_counter() - start
+
+    latencies = [r['latency'] for r in results if r['ok']]
+    first_events = [r['first_event'] for r in results if r['ok'] and r['first_event'] is not None]
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': sum(1 for r in results if not r['ok']),
+        'shed': sum(1 for r in results if r.get('shed')),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else None,
+        'p95': percentile(latencies, 0.95) if latencies else None,
+        'first_event_p50': statistics.median(first_events) if first_events else None,
+    }
+
+def print_result(result: dict, label: Optional[str] = None):
+    def seconds(value):
+        return f"{value:6.2f}s" if value is not None else "     -"
+    print(f"{label or result['url']:>28} c={result['concurrency']:<3} "
+          f"{result['throughput']:6.2f} req/s  p50 {seconds(result['p50'])}  p95 {seconds(result['p95'])}  "
+          f"first event p50 {seconds(result['first_event_p50'])}  errors {result['errors']}/{result['requests']} (503: {result['shed']})")
+
+if __name__ == "__main__":
+    # Compare the Flask and the ASGI app under the same concurrent load. Without a model
+    # server, point Config.ENDPOINT at the stub first (it defaults to :8000, the ASGI app
+    # moves to :8001), e.g.
+    #   python benchmark_load.py --stub-llm 8000         (stub LLM on :8000)
+    #   python app.py                                    (Flask on :5000)
+    #   uvicorn asgi_app:app --port 8001                 (ASGI on :8001)
+    #   python benchmark_load.py http://localhost:5000 http://localhost:8001 --concurrency 1 8 32
+    # With the stub, set LLM_CACHE_FILE to a scratch path so stub answers are not cached
+    # for the real model.
+    parser = argparse.ArgumentParser(description="Concurrent request throughput of the /ask endpoints")
+    parser.add_argument('base_urls', nargs='*')
+    parser.add_argument('--stub-llm', type=int, metavar='PORT', help="serve the stub LLM endpoint instead")
+    parser.add_argument('--stub-first-token', type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument('--stub-tokens-per-second', type=float, default=50)
+    parser.add_argument('--stub-max-tokens', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests-per-level', type=int, default=None, help="default: 4 x concurrency")
+    parser.add_argument('--stream', action='store_true', help="use /ask/stream instead of /ask")
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    if args.stub_llm:
+        stub = stub_llm_app(args.stub_first_token, args.stub_tokens_per_second, args.stub_max_tokens)
+        web.run_app(stub, port=args.stub_llm)
+        raise SystemExit
+    if not args.base_urls:
+        parser.error("give the base URLs to load, or --stub-llm PORT")
+
+    for concurrency in args.concurrency:
+        total = args.requests_per_level or 4 * concurrency
+        for base_url in args.base_urls:
+            print_result(asyncio.run(run(base_url, concurrency, total, args.stream, args.timeout)), base_url)
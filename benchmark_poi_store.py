@@ -0,0 +1,49 @@
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+from config import Config
+from osm_service import CityPOIs, POIData
+from poi_store import CATEGORIES, POIStore
+from wiki_store import configured_cities
+
+def legacy_load(cache_file: str = Config.POI_CACHE_FILE) -> Dict[str, CityPOIs]:
+    """The previous OSMService._load_cache: parse the JSON and build every POIData."""
+    with open(cache_file, 'r', encoding='utf-8') as f:
+        cache_data = json.load(f)
+    return {
+        city: CityPOIs(**{category: [POIData(**poi_data) for poi_data in data[category]] for category in CATEGORIES})
+        for city, data in cache_data.items()
+    }
+
+def materialize_configured(store: POIStore) -> int:
+    """What WikiService does at startup: the CityPOIs of every configured city."""
+    return sum(1 for city in configured_cities() if store.get(city) is not None)
+
+def timed(name: str, function: Callable[[], object], repeat: int) -> object:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:>34}: {elapsed * 1000:8.2f} ms")
+    return result
+
+if __name__ == "__main__":
+    # Usage: python benchmark_poi_store.py [repeat]
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(Config.POI_CACHE_FILE, 'r', encoding='utf-8') as f:
+        poi_cache = json.load(f)
+    with tempfile.TemporaryDirectory() as store_dir:
+        timed('convert JSON to store (one-time)', lambda: POIStore._build(poi_cache, Path(store_dir), 'benchmark'), 1)
+
+    legacy = timed('legacy JSON load', legacy_load, repeat)
+    store = timed('store open', POIStore.load, repeat)
+    timed('store open + configured cities', lambda: materialize_configured(POIStore.load()), repeat)
+    POIStore.shared()
+    timed('shared store, later OSMService', POIStore.shared, repeat)
+
+    mismatches = [city for city in legacy if legacy[city] != store[city]]
+    print(f"{len(store)} cities, {len(store.records)} POIs; cities differing from the JSON: {len(mismatches)}")
@@ -0,0 +1,72 @@
+import re
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+from temperature import extract_and_normalize_temperature, normalize_temp_value, normalize_temperature_text
+from wiki_store import WikiCorpusStore, configured_cities
+
+def load_summaries(store: WikiCorpusStore) -> List[str]:
+    """The summaries of every configured city in the local wiki corpus."""
+    entries = [store.get(city) for city in configured_cities()]
+    return [entry.summary for entry in entries if entry is not None]
+
+def legacy_extract_and_normalize_temperature(text: str) -> Optional[Tuple[float, float]]:
+    """The previous extractor: eight patterns, compiled on use and scanned one after another."""
+    text = text.lower()
+    patterns = [
+        r'от\s*(-?\d+[.,]?\d*)\s*до\s*(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
+        r'(?:январ|феврал|март|апрел|май|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*\s*[-—]?\s*(?:плюс\s*)?(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
+        r'(-?\d+[.,]?\d*)\.\.\.(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
+        r'средн[а-я]*\s*температур[а-я]*\s*[-—]?\s*(?:плюс\s*)?(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
+        r'температур[а-я]*\s*[-—]?\s*(?:плюс\s*)?(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
+        r'(?:январ|феврал|март|апрел|май|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*\s*[-—]\s*(?:плюс\s*)?(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
+        r'плюс\s*(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
+        r'минус\s*(\d+[.,]?\d*)\s*(?:°|градус|c°|°c)'
+    ]
+    for pattern in patterns:
+        temps = []
+        for match in re.finditer(pattern, text):
+            for temp_str in match.groups():
+                if temp_str:
+                    temp = normalize_temp_value(temp_str)
+                    if temp is not None:
+                        temps.append(temp)
+        if temps:
+            return min(temps), max(temps)
+    return None
+
+def legacy_normalize_temperature_text(text: str) -> str:
+    """The previous normalization, which left the unit's tail behind ("25°CC", "25°Cов")."""
+    def normalize_temp(match):
+        temp = normalize_temp_value(match.group(1))
+        return f"{int(temp)}°C" if temp is not None else "N/A°C"
+    return re.sub(r'(-?\d+)\s*(?:°|градус|c°|°c)', normalize_temp, text)
+
+def timed(name: str, function: Callable[[str], object], summaries: List[str], repeat: int) -> list:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [function(summary) for summary in summaries]
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:>28}: {elapsed * 1000:8.2f} ms per corpus, {elapsed / len(summaries) * 1e6:7.1f} µs per summary")
+    return results
+
+if __name__ == "__main__":
+    # Usage: python benchmark_temperature.py [repeat]
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    summaries = load_summaries(WikiCorpusStore())
+    print(f"{len(summaries)} summaries, {sum(map(len, summaries))} characters")
+
+    legacy_normalized = timed('legacy normalize', legacy_normalize_temperature_text, summaries, repeat)
+    normalized = timed('normalize', normalize_temperature_text, summaries, repeat)
+    legacy_ranges = timed('legacy extract', legacy_extract_and_normalize_temperature, normalized, repeat)
+    ranges = timed('precompiled extract', extract_and_normalize_temperature, normalized, repeat)
+
+    leftovers = sum(len(re.findall(r'°C[CcСса-яё]', text)) for text in legacy_normalized)
+    print(f"unit leftovers after legacy normalize: {leftovers}, after normalize: "
+          f"{sum(len(re.findall(r'°C[CcСса-яё]', text)) for text in normalized)}")
+    # The current extractor reads "минус 5 градусов" as -5, the legacy one as +5
+    differing = [(old, new) for old, new in zip(legacy_ranges, ranges) if old != new]
+    print(f"ranges differing from the legacy extractor: {len(differing)} of {len(summaries)}")
+    for old, new in differing[:10]:
+        print(f"  {old} -> {new}")
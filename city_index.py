@@ -0,0 +1,277 @@
+import json
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from activities import ACTIVITIES, ActivityMatcher
+from climate import CLIMATE_COLUMNS, extract_climate, season_temperature
+from config import Config
+from keyword_matcher import KEYWORDS, KeywordHits
+from seasons import SEASONS
+from temperature import normalize_temperature_text
+from wiki import CityFeatures
+
+# Bump when the layout or the meaning of a precomputed column changes
+INDEX_FORMAT = 5
+
+# A value following the word "температура", see mentioned_temperatures
+MENTIONED_TEMPERATURE = re.compile(r'температура.*?(-?\d+)')
+
+# Infrastructure the advisor's filters look for in a city summary (see CityFeatures)
+KEYWORDS.add_groups({
+    # Facilities, the has_* flags
+    ('city', 'spa'): ['спа', 'массаж', 'велнес', 'wellness', 'санатори'],
+    ('city', 'aquapark'): ['аквапарк', 'водные аттракцион', 'развлечения'],
+    ('city', 'ski'): ['горнолыж', 'лыж', 'подъемник', 'трасс', 'склон', 'катани', 'сноуборд', 'горнолыжный курорт'],
+    ('city', 'beach'): ['пляж', 'море', 'песч', 'курорт', 'набережн', 'побереж', 'залив', 'бухт'],
+    ('city', 'kids_infrastructure'): ['развлечен', 'аквапарк', 'атракцион', 'детская площадка', 'отдых'],
+    # City infrastructure for the primary activity
+    ('activity_filter', 'beach_vacation'): ['пляж', 'море', 'побереж', 'залив', 'бухт', 'курорт'],
+    ('activity_filter', 'spa_wellness'): [
+        'спа', 'массаж', 'велнес', 'wellness', 'санатори', 'оздоровит',
+        'лечебн', 'курорт', 'отдых', 'процедур', 'релакс', 'термальн',
+        'источник', 'грязелечени', 'минеральн', 'нарзан', 'бювет'
+    ],
+    ('activity_filter', 'winter_sports'): ['горнолыж', 'лыж', 'подъемник', 'трасс', 'склон', 'зимн'],
+    ('activity_filter', 'cultural_tourism'): ['музе', 'памятник', 'достопримечательност', 'истори', 'культур'],
+})
+
+def season_boost(
+    city_text: str,
+    season: str,
+    hits: Optional[KeywordHits] = None,
+    temps: Optional[List[int]] = None,
+    climate: Optional[np.ndarray] = None
+) -> float:
+    """Seasonal ranking boost for a lowercased city summary.
+
+    The temperature part uses the city's climate table when it covers the season,
+    otherwise the temperatures mentioned in the summary.
+    """
+    season_data = SEASONS[season]
+    low, high = season_data['temp_range']
+    hits = hits or KEYWORDS.scan(city_text)
+    boost = 0.05 * hits.count(('season', season))
+    season_temps = season_temperature(climate, season) if climate is not None else None
+    if season_temps is not None:
+        if low <= season_temps[0] <= high:
+            boost += 0.1
+        return boost
+    temps = mentioned_temperatures(city_text) if temps is None else temps
+    if any(low <= temp <= high for temp in temps):
+        boost += 0.1
+    return boost
+
+def ranking_multipliers(
+    n: int,
+    season_boosts: Optional[np.ndarray] = None,
+    activity_scores: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Per-city factors applied to the cosine similarity when ranking cities."""
+    multipliers = np.ones(n, dtype=np.float32)
+    if season_boosts is not None:
+        multipliers *= 1 + season_boosts
+    if activity_scores is not None:
+        # Reward cities that support the activity, halve the ones that do not
+        multipliers *= np.where(activity_scores > 0, 1 + 0.5 * activity_scores, 0.5)
+    return multipliers
+
+def mentioned_temperatures(city_text: str) -> List[int]:
+    """All values following the word "температура" in a lowercased city summary."""
+    return [int(match.group(1)) for match in MENTIONED_TEMPERATURE.finditer(city_text)]
+
+def index_name(corpus_version: str, backend: str) -> str:
+    # Embeddings of different backends are not comparable, so each gets its own index
+    return f'{corpus_version}-{backend}'
+
+class CityIndex:
+    """Read-only, memory-mapped per-city features for one corpus version.
+
+    Row i of every array describes `cities[i]`:
+      embeddings       (n, dim)          float32 ruBert embedding of the normalized summary
+      unit_embeddings  (n, dim)          the same embeddings scaled to unit length
+      activity_scores  (n, activities)   ActivityMatcher.get_activity_score for each activity
+      season_boosts    (n, seasons)      seasonal ranking boost for each season
+      mentioned_temps  (n, 2)            (mean, max) of "температура N" mentions, NaN if none
+      climate          (n, 12, 4)        monthly avg/min/max/water temperatures from the
+                                         page's climate section (see climate.py), NaN if unknown
+    """
+
+    ARRAYS = ['embeddings', 'unit_embeddings', 'activity_scores', 'season_boosts', 'mentioned_temps', 'climate']
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        self.corpus_version: str = meta['corpus_version']
+        self.cities: List[str] = meta['cities']
+        self.summaries: List[str] = meta['summaries']
+        self.activities: List[str] = meta['activities']
+        self.seasons: List[str] = meta['seasons']
+
+        self.city_rows = {city: i for i, city in enumerate(self.cities)}
+        self._keyword_hits: Dict[str, KeywordHits] = {}
+        self.activity_cols = {activity: i for i, activity in enumerate(self.activities)}
+        self.season_cols = {season: i for i, season in enumerate(self.seasons)}
+
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(self.path / f'{name}.npy', mmap_mode='r'))
+
+    @classmethod
+    def load(cls, corpus_version: str, backend: str = 'fp32', index_dir: str = Config.CITY_INDEX_DIR) -> Optional['CityIndex']:
+        """Open the index for a corpus version and embedding backend, or return None if it was not built."""
+        path = Path(index_dir) / index_name(corpus_version, backend)
+        if not (path / 'meta.json').exists():
+            return None
+        with open(path / 'meta.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT or meta.get('backend') != backend:
+            return None
+        return cls(path)
+
+    def __contains__(self, city: str) -> bool:
+        return city in self.city_rows
+
+    def rows(self, cities: List[str]) -> np.ndarray:
+        return np.fromiter((self.city_rows[city] for city in cities), dtype=np.intp, count=len(cities))
+
+    def summary(self, city: str) -> str:
+        return self.summaries[self.city_rows[city]]
+
+    def keyword_hits(self, city: str) -> KeywordHits:
+        """KEYWORDS.scan of the city's summary, computed once per process."""
+        hits = self._keyword_hits.get(city)
+        if hits is None:
+            hits = self._keyword_hits[city] = KEYWORDS.scan(self.summary(city))
+        return hits
+
+    def features(self, city: str) -> CityFeatures:
+        """The precomputed columns of one city plus its keyword flags."""
+        row = self.city_rows[city]
+        hits = self.keyword_hits(city)
+        mentioned = self.mentioned_temps[row]
+        climate = self.climate[row]
+        return CityFeatures(
+            activity_scores={activity: float(self.activity_scores[row, col]) for activity, col in self.activity_cols.items()},
+            season_keyword_counts={season: hits.count(('season', season)) for season in self.seasons},
+            season_boosts={season: float(self.season_boosts[row, col]) for season, col in self.season_cols.items()},
+            mentioned_temps=None if np.isnan(mentioned[0]) else (float(mentioned[0]), float(mentioned[1])),
+            climate=None if np.all(np.isnan(climate)) else climate,
+            has_beach=hits.any(('city', 'beach')),
+            has_spa=hits.any(('city', 'spa')),
+            has_ski=hits.any(('city', 'ski')),
+            has_aquapark=hits.any(('city', 'aquapark')),
+            has_kids_infrastructure=hits.any(('city', 'kids_infrastructure')),
+            activity_infrastructure={
+                activity: hits.any(('activity_filter', activity))
+                for activity in self.activities
+                if ('activity_filter', activity) in KEYWORDS.groups
+            }
+        )
+
+    def embedding(self, city: str) -> np.ndarray:
+        return self.embeddings[self.city_rows[city]]
+
+    def activity_score(self, city: str, activity: str) -> float:
+        if activity not in self.activity_cols:
+            return 0.0
+        return float(self.activity_scores[self.city_rows[city], self.activity_cols[activity]])
+
+    def season_boost(self, city: str, season: str) -> float:
+        return float(self.season_boosts[self.city_rows[city], self.season_cols[season]])
+
+    def ranking_multipliers(self, rows: np.ndarray, season: Optional[str] = None, activity: Optional[str] = None) -> np.ndarray:
+        season_boosts = self.season_boosts[rows, self.season_cols[season]] if season in self.season_cols else None
+        activity_scores = None
+        if activity:
+            if activity in self.activity_cols:
+                activity_scores = self.activity_scores[rows, self.activity_cols[activity]]
+            else:
+                activity_scores = np.zeros(len(rows), dtype=np.float32)
+        return ranking_multipliers(len(rows), season_boosts, activity_scores)
+
+def build_index(wiki_service, embedding_service, index_dir: str = Config.CITY_INDEX_DIR) -> Path:
+    """Precompute the city index for the wiki corpus currently loaded by `wiki_service`."""
+    corpus_version = wiki_service.corpus_store.version
+    backend = embedding_service.embedding_backend
+    activity_matcher = ActivityMatcher()
+    activities = list(ACTIVITIES)
+    seasons = list(SEASONS)
+
+    cities = list(wiki_service.contents)
+    summaries = [normalize_temperature_text(wiki_service.contents[city].summary) for city in cities]
+    print(f"Building city index {corpus_version} for {len(cities)} cities")
+
+    activity_scores = np.zeros((len(cities), len(activities)), dtype=np.float32)
+    season_boosts = np.zeros((len(cities), len(seasons)), dtype=np.float32)
+    mentioned_temps = np.full((len(cities), 2), np.nan, dtype=np.float32)
+    climate = np.full((len(cities), 12, len(CLIMATE_COLUMNS)), np.nan, dtype=np.float32)
+
+    for i, summary in enumerate(summaries):
+        city_text = summary.lower()
+        hits = KEYWORDS.scan(city_text)
+        temps = mentioned_temperatures(city_text)
+        climate[i] = extract_climate(wiki_service.contents[cities[i]].full_text)
+        for j, activity in enumerate(activities):
+            activity_scores[i, j] = activity_matcher.get_activity_score(city_text, activity, hits)
+        for j, season in enumerate(seasons):
+            season_boosts[i, j] = season_boost(city_text, season, hits, temps, climate[i])
+
+        if temps:
+            mentioned_temps[i] = (sum(temps) / len(temps), max(temps))
+
+    summary_embeddings = embedding_service.get_embeddings_batch(summaries)
+    embeddings = np.stack([summary_embeddings[summary] for summary in summaries]).astype(np.float32)
+    unit_embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    # Write into a temporary directory and rename, so readers never see a partial index
+    path = Path(index_dir) / index_name(corpus_version, backend)
+    tmp_path = Path(index_dir) / f'{index_name(corpus_version, backend)}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    arrays = {
+        'embeddings': embeddings,
+        'unit_embeddings': unit_embeddings,
+        'activity_scores': activity_scores,
+        'season_boosts': season_boosts,
+        'mentioned_temps': mentioned_temps,
+        'climate': climate
+    }
+    for name, array in arrays.items():
+        np.save(tmp_path / f'{name}.npy', np.ascontiguousarray(array))
+
+    with open(tmp_path / 'meta.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'format': INDEX_FORMAT,
+            'corpus_version': corpus_version,
+            'backend': backend,
+            'cities': cities,
+            'summaries': summaries,
+            'activities': activities,
+            'seasons': seasons
+        }, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.rename(path)
+    print(f"City index saved to {path}")
+    return path
+
+def load_or_build_index(wiki_service, embedding_service, index_dir: str = Config.CITY_INDEX_DIR) -> CityIndex:
+    """Memory-map the index for the current corpus version, building it first if needed."""
+    corpus_version = wiki_service.corpus_store.version
+    index = CityIndex.load(corpus_version, embedding_service.embedding_backend, index_dir)
+    if index is None:
+        print(f"No city index for corpus {corpus_version} ({embedding_service.embedding_backend}), building it now (run `python city_index.py` offline)")
+        index = CityIndex(build_index(wiki_service, embedding_service, index_dir))
+    return index
+
+if __name__ == "__main__":
+    from wiki import WikiService
+    from embeddings import EmbeddingService
+
+    build_index(WikiService(), EmbeddingService())
@@ -0,0 +1,155 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from seasons import SEASONS
+from temperature import MONTH_NUMBERS, normalize_temp_value
+
+# Columns of a city's climate table, one row per month (January first); NaN where unknown
+CLIMATE_COLUMNS = ('avg', 'min', 'max', 'water')
+AVG, MIN, MAX, WATER = range(len(CLIMATE_COLUMNS))
+
+MONTH_NAMES = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+               'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+
+# Word stems naming a month or a whole season in a climate sentence
+# May only in its own forms ("май", "мая", "мае"), not as the start of "маяк"
+MONTH_WORD = re.compile(r'\b(?:(январ|феврал|март|апрел|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*|(ма[йяе])\b)')
+SEASON_WORDS = {
+    'зим': 'winter',
+    'весн': 'spring',
+    'весен': 'spring',
+    'лет': 'summer',
+    'осен': 'fall'
+}
+# Season words only in their seasonal forms ("летом", "летние"), not "лет" as in "100 лет"
+SEASON_WORD = re.compile(r'\b(зим|весн|весен|лет|осен)(?:а|ой|ы|у|е|н[а-я]*|ом|о|ью|ь)\b')
+
+# Whole word forms of water and sea, so that "заморозки" or "водопад" do not count
+WATER_WORD = re.compile(r'\b(?:вод(?:а|е|у|ы|ой|ою|ах|ам)|мор[еяю]|морем)\b')
+
+def month_number(match: re.Match) -> int:
+    """Month of a MONTH_WORD match."""
+    return 5 if match.group(2) else MONTH_NUMBERS[match.group(1)]
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+
+# A temperature with its sign ("−7 °C", "+19 °C", "минус 5 градусов"), optionally the upper
+# end of a range ("от 18 до 25 градусов")
+_NUMBER = r'[-−+]?\d+(?:[.,]\d+)?'
+TEMPERATURE = re.compile(
+    rf'(?:от\s*(?P<low>{_NUMBER})\s*(?:°\s*c?\s*)?до\s*)?(?P<word>минус|плюс)?\s*(?P<value>{_NUMBER})\s*(?:°|градус)'
+)
+
+def parse_temperature(number: str, negative: bool = False) -> Optional[float]:
+    temp = normalize_temp_value(number.replace('−', '-').lstrip('+'))
+    if temp is None:
+        return None
+    return -temp if negative else temp
+
+def climate_section(text: str) -> str:
+    """The "Климат" section of a Wikipedia page text, or the whole text if there is none.
+
+    Headings are lines of their own, so the section runs until the next short line
+    that does not end like a sentence.
+    """
+    lines = text.split('\n')
+    for start, line in enumerate(lines):
+        if line.strip().lower().startswith('климат') and len(line) < 60:
+            section = []
+            for line in lines[start + 1:]:
+                stripped = line.strip()
+                if stripped and len(stripped) < 60 and not stripped.endswith(('.', ':', ';')):
+                    break
+                section.append(line)
+            return '\n'.join(section)
+    return text
+
+def sentence_months(sentence: str) -> List[int]:
+    """Months a sentence talks about: named months, otherwise the months of named seasons."""
+    months = [month_number(match) for match in MONTH_WORD.finditer(sentence)]
+    if not months:
+        for match in SEASON_WORD.finditer(sentence):
+            months.extend(SEASONS[SEASON_WORDS[match.group(1)]]['months'])
+    return list(dict.fromkeys(months))
+
+def sentence_column(sentence: str) -> int:
+    if WATER_WORD.search(sentence):
+        return WATER
+    if 'миним' in sentence:
+        return MIN
+    if 'максим' in sentence:
+        return MAX
+    return AVG
+
+def extract_climate(text: str) -> np.ndarray:
+    """A (12, 4) float32 table of avg/min/max/water temperatures parsed from a page text.
+
+    A temperature belongs to the closest month named before it in its sentence, or to
+    every month the sentence names (or covers by a season word) otherwise. Values stated
+    for a month win over values stated for a whole season.
+    """
+    # (month, column) -> temperatures, per specificity: 0 for named months, 1 for seasons
+    values: Tuple[Dict[Tuple[int, int], List[float]], ...] = ({}, {})
+
+    def add(months: List[int], column: int, value: Optional[float], seasonal: bool):
+        if value is not None:
+            for month in months:
+                values[seasonal].setdefault((month - 1, column), []).append(value)
+
+    for sentence in SENTENCE_END.split(climate_section(text).lower()):
+        months = sentence_months(sentence)
+        if not months:
+            continue
+        column = sentence_column(sentence)
+        month_words = [(match.start(), month_number(match)) for match in MONTH_WORD.finditer(sentence)]
+
+        for match in TEMPERATURE.finditer(sentence):
+            preceding = [month for position, month in month_words if position < match.start()]
+            target = preceding[-1:] or months
+            seasonal = not month_words
+            value = parse_temperature(match.group('value'), match.group('word') == 'минус')
+            if match.group('low') is not None and column == AVG:
+                # A range gives the months' min and max, and its middle as the average
+                low = parse_temperature(match.group('low'))
+                add(target, MIN, low, seasonal)
+                add(target, MAX, value, seasonal)
+                if low is not None and value is not None:
+                    add(target, AVG, (low + value) / 2, seasonal)
+            else:
+                add(target, column, value, seasonal)
+
+    table = np.full((12, len(CLIMATE_COLUMNS)), np.nan, dtype=np.float32)
+    for (month, column), temps in {**values[1], **values[0]}.items():
+        table[month, column] = sum(temps) / len(temps)
+    return table
+
+def season_temperature(table: np.ndarray, season: str) -> Optional[Tuple[float, float]]:
+    """(mean, max) air temperature over the season's months, None if the table has no data for them."""
+    rows = table[[month - 1 for month in SEASONS[season]['months']]]
+    avg = rows[:, AVG]
+    if np.all(np.isnan(avg)):
+        return None
+    highs = np.where(np.isnan(rows[:, MAX]), avg, rows[:, MAX])
+    return float(np.nanmean(avg)), float(np.nanmax(highs))
+
+def format_temperature(value: float) -> str:
+    value = int(round(value))
+    return f"+{value}°C" if value > 0 else f"{value}°C"
+
+def describe_climate(table: np.ndarray, months: Optional[List[int]] = None) -> str:
+    """A short climate line such as "Январь: -5°C, Июль: +22°C, вода до +24°C"; empty without data."""
+    months = months or [1, 7]
+    parts = [
+        f"{MONTH_NAMES[month - 1]}: {format_temperature(table[month - 1, AVG])}"
+        for month in months
+        if not np.isnan(table[month - 1, AVG])
+    ]
+    if not parts:
+        # Fall back to any month with data
+        known = np.flatnonzero(~np.isnan(table[:, AVG]))
+        parts = [f"{MONTH_NAMES[month]}: {format_temperature(table[month, AVG])}" for month in known[:2]]
+    if not np.all(np.isnan(table[:, WATER])):
+        parts.append(f"вода до {format_temperature(np.nanmax(table[:, WATER]))}")
+    return ", ".join(parts)
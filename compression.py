@@ -0,0 +1,92 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+from vector_ops import normalize_rows
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+@dataclass
+class CompressionStats:
+    """What one RAG preparation spent on compression."""
+    chunks: int = 0
+    extractive: int = 0
+    llm_calls: int = 0
+    llm_input_tokens: int = 0
+    llm_output_tokens: int = 0
+    truncations: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    def __str__(self) -> str:
+        return (f"{self.chunks} chunks, {self.tokens_before} -> {self.tokens_after} tokens; "
+                f"{self.extractive} trimmed extractively, {self.llm_calls} LLM calls "
+                f"({self.llm_input_tokens} in / {self.llm_output_tokens} out), {self.truncations} truncated")
+
+class CompressionPlanner:
+    """Decides, once per chunk, how a text is brought under its token budget.
+
+    - within budget: kept as is
+    - up to `extractive_ratio` x budget: extractive trimming only, no LLM call
+    - larger: trimmed extractively to `abstractive_input_ratio` x budget, then one
+      abstractive LLM call, then hard truncation if the summary still overflows
+
+    Extractive trimming keeps the sentences most similar to the user's preferences
+    (in their original order) when an embedding function is given, otherwise the
+    leading sentences.
+    """
+
+    def __init__(
+        self,
+        context_manager,
+        embed_batch: Optional[Callable[[List[str]], Dict[str, np.ndarray]]] = None,
+        preferences: Optional[str] = None,
+        extractive_ratio: float = Config.EXTRACTIVE_ONLY_RATIO,
+        abstractive_input_ratio: float = Config.ABSTRACTIVE_INPUT_RATIO
+    ):
+        self.context_manager = context_manager
+        self.embed_batch = embed_batch
+        self.preference_embedding = None
+        if embed_batch is not None and preferences:
+            self.preference_embedding = normalize_rows(embed_batch([preferences])[preferences])
+        self.extractive_ratio = extractive_ratio
+        self.abstractive_input_ratio = abstractive_input_ratio
+
+    @staticmethod
+    def budgets(cities_chunks: Dict[str, List[str]], working_tokens: int) -> Dict[str, int]:
+        """Token budget of every chunk, splitting the working tokens evenly over cities and their chunks."""
+        tokens_per_city = working_tokens // (len(cities_chunks) or 1)
+        return {city: tokens_per_city // (len(chunks) or 1) for city, chunks in cities_chunks.items()}
+
+    def needs_llm(self, tokens: int, max_tokens: int) -> bool:
+        return tokens > max_tokens * self.extractive_ratio
+
+    def extractive_trim(self, text: str, max_tokens: int) -> str:
+        sentences = split_sentences(text)
+        if not sentences:
+            return text
+        counts = self.context_manager.count_tokens_batch(sentences)
+        if self.preference_embedding is not None:
+            embeddings = self.embed_batch(sentences)
+            scores = normalize_rows(np.stack([embeddings[sentence] for sentence in sentences])) @ self.preference_embedding
+            order = np.argsort(-scores, kind='stable')
+        else:
+            order = range(len(sentences))
+
+        kept, used = [], 0
+        for i in order:
+            if used + counts[i] <= max_tokens:
+                kept.append(i)
+                used += counts[i]
+        return " ".join(sentences[i] for i in sorted(kept))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokenizer = self.context_manager.tokenizer
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        return tokenizer.decode(ids[:max_tokens], skip_special_tokens=True)
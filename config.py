@@ -2,6 +2,41 @@ class Config:
     OPENAI_KEY = 'xxx'
     ENDPOINT = 'http://localhost:8000/v1'
     LLM_MODEL = 'Vikhrmodels/Vikhr-Nemo-12B-Instruct-R-21-09-24'
+    WIKI_CORPUS_FILE = 'wiki_corpus.json'
+    WIKI_CORPUS_TTL_DAYS = 30
+    CITY_INDEX_DIR = 'city_index'
+    FACTS_FILE = 'tourist_facts.json'
+    FACT_MATRIX_DIR = 'fact_matrix'
+    POI_CACHE_FILE = 'poi_cache.json'
+    # Columnar copy of the POI cache, see poi_store.py
+    POI_STORE_DIR = 'poi_store'
+    EMBEDDING_EXPORT_DIR = 'embedding_models'
+    # Unix socket path or host:port of embedding_server.py, used when USE_EMBEDDING_SERVER is set
+    EMBEDDING_SERVER = 'embedding_server.sock'
+    USE_EMBEDDING_SERVER = False
+    # Requests in flight to the LLM endpoint, shared by all users of one process. The
+    # scheduler is per process: under gunicorn the endpoint sees up to workers x this many
+    LLM_MAX_CONCURRENCY = 8
+    # New /ask requests are answered with 503 while this many interactive LLM calls wait,
+    # counted per worker process like LLM_MAX_CONCURRENCY
+    LLM_MAX_QUEUE_INTERACTIVE = 32
+    # Requests in flight from an offline batch job (extract_facts.py). Batch jobs run in
+    # their own process, so priorities do not reach the server's queue; this cap is what
+    # leaves endpoint capacity to interactive traffic
+    LLM_BATCH_MAX_CONCURRENCY = 2
+    LLM_RETRY_AFTER = 5  # seconds, sent with the 503
+    LLM_CACHE_FILE = 'llm_cache.sqlite'
+    # Events buffered between the LLM streams and a slow client before generation pauses
+    STREAM_QUEUE_SIZE = 64
+    # Seconds a streaming client may leave a full buffer unread before the request is dropped
+    STREAM_STALL_TIMEOUT = 60
+    TOKEN_COUNT_CACHE_SIZE = 16384
+    # Chunks up to this multiple of their token budget are trimmed extractively, without an LLM call
+    EXTRACTIVE_ONLY_RATIO = 1.5
+    # Larger chunks are trimmed to this multiple of the budget before their one abstractive LLM call
+    ABSTRACTIVE_INPUT_RATIO = 4.0
+    LLM_CACHE_MAX_ENTRIES = 50000
+    LLM_CACHE_MAX_BYTES = 256 * 1024 * 1024
     SYSTEM_PROMPT = """Кратко выдели только самые важные требования из запроса пользователя в таком формате:
 
 🎯 Главные требования:
@@ -13,6 +48,27 @@ class Config:
 💰 Бюджет: [сумма]
 
 Опусти пустые пункты. Для пляжного отдыха, если температура воды не указана явно, добавь "вода 22-26°C для купания"."""
+    # Extract preferences, activity, season, temperature and budget with one JSON-schema
+    # constrained call instead of separate preference/activity/season calls
+    STRUCTURED_EXTRACTION = True
+    STRUCTURED_SYSTEM_PROMPT = """Разбери запрос пользователя о путешествии и ответь JSON-объектом с полями:
+
+preferences — кратко выделенные самые важные требования в таком формате:
+
+🎯 Главные требования:
+• [тип отдыха, например "пляжный отдых"]
+• [основные условия через запятую]
+
+⏰ Время: [месяц/сезон]
+🌡️ Температура: [указанная температура]
+💰 Бюджет: [сумма]
+
+Опусти пустые пункты. Для пляжного отдыха, если температура воды не указана явно, добавь "вода 22-26°C для купания".
+
+activity — основной тип отдыха: winter_sports (зимние виды спорта, горные лыжи), beach_vacation (пляжный отдых, море), cultural_tourism (культурный туризм, музеи, достопримечательности), family_vacation (семейный отдых, развлечения для детей), spa_wellness (спа, оздоровительный отдых) или null.
+season — сезон поездки: winter, spring, summer, fall или null.
+temperature — желаемая температура воздуха в °C числом или null.
+budget — бюджет в рублях числом или null."""
     GROUNDED_SYSTEM_PROMPT = "Your task is to answer the user's questions..."
     RESORT_CITIES = {
         "море": [
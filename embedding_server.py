@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+# Wire format, in both directions: 4-byte big-endian length + JSON header. A request
+# header is {"texts": [...]}; a response header is {"rows": n, "dim": d, "backend": name}
+# followed by n * d float32 values in request order, or {"error": message} with no payload.
+HEADER = struct.Struct('>I')
+
+def parse_address(address: str) -> Tuple[str, object]:
+    """('tcp', (host, port)) for "host:port", otherwise ('unix', socket path)."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return 'tcp', (host or '127.0.0.1', int(port))
+    return 'unix', address
+
+def encode_header(header: dict) -> bytes:
+    body = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    return HEADER.pack(len(body)) + body
+
+class EmbeddingServer:
+    """Owns one EmbeddingService and serves it to other processes.
+
+    Requests that arrive within `batch_window` seconds of each other are coalesced
+    into a single get_embeddings_batch call (up to `max_batch_texts` texts), so
+    concurrent callers share one forward pass and the service's on-disk cache.
+    Inference runs on a single worker thread to keep the event loop responsive.
+    """
+
+    def __init__(self, embedding_service, address: str = Config.EMBEDDING_SERVER,
+                 batch_window: float = 0.01, max_batch_texts: int = 1024):
+        self.embedding_service = embedding_service
+        self.address = address
+        self.batch_window = batch_window
+        self.max_batch_texts = max_batch_texts
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue: Optional[asyncio.Queue] = None
+        self.batches = 0
+        self.requests = 0
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Queue texts for the next coalesced batch and wait for their embeddings."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            n_texts = len(pending[0][0])
+            deadline = loop.time() + self.batch_window
+            while n_texts < self.max_batch_texts:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                n_texts += len(pending[-1][0])
+
+            texts = list(dict.fromkeys(text for request_texts, _ in pending for text in request_texts))
+            try:
+                embeddings = await loop.run_in_executor(self.executor, self.embedding_service.get_embeddings_batch, texts)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.requests += len(pending)
+            for request_texts, future in pending:
+                if not future.done():
+                    future.set_result(np.stack([embeddings[text] for text in request_texts]).astype(np.float32))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    request = json.loads(await reader.readexactly(length))
+                except asyncio.IncompleteReadError:
+                    break
+
+                try:
+                    texts = request['texts']
+                    embeddings = await self.embed(texts) if texts else np.empty((0, 0), dtype=np.float32)
+                except Exception as e:
+                    writer.write(encode_header({'error': str(e)}))
+                else:
+                    writer.write(encode_header({
+                        'rows': embeddings.shape[0],
+                        'dim': embeddings.shape[1],
+                        'backend': self.embedding_service.backend
+                    }))
+                    writer.write(embeddings.tobytes())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batcher())
+        kind, target = parse_address(self.address)
+        if kind == 'tcp':
+            server = await asyncio.start_server(self._handle, *target)
+        else:
+            server = await asyncio.start_unix_server(self._handle, target)
+        print(f"Embedding server listening on {self.address}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if kind == 'unix' and os.path.exists(target):
+                os.unlink(target)
+
+class EmbeddingClient:
+    """Blocking client for EmbeddingServer over one persistent connection."""
+
+    def __init__(self, address: str = Config.EMBEDDING_SERVER, timeout: float = 300.0):
+        self.address = address
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._sock_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._lock_pid = os.getpid()
+        self._backend: Optional[str] = None
+
+    def _connect(self) -> socket.socket:
+        kind, target = parse_address(self.address)
+        if kind == 'tcp':
+            sock = socket.create_connection(target, timeout=self.timeout)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(target)
+        return sock
+
+    def _recv_exactly(self, n: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < n:
+            chunk = self._sock.recv(min(n - len(buffer), 1 << 20))
+            if not chunk:
+                raise ConnectionError(f"Embedding server at {self.address} closed the connection")
+            buffer.extend(chunk)
+        return bytes(buffer)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embeddings of `texts` as a (len(texts), dim) float32 array."""
+        if self._lock_pid != os.getpid():
+            # Forked from a pre-fork master: the lock may have been held at fork time
+            self._lock = threading.Lock()
+            self._lock_pid = os.getpid()
+        with self._lock:
+            # One connection per process: workers must not share the one inherited from the master
+            if self._sock is None or self._sock_pid != os.getpid():
+                self._sock = self._connect()
+                self._sock_pid = os.getpid()
+            try:
+                self._sock.sendall(encode_header({'texts': texts}))
+                (length,) = HEADER.unpack(self._recv_exactly(HEADER.size))
+                header = json.loads(self._recv_exactly(length))
+                if 'error' in header:
+                    raise RuntimeError(f"Embedding server error: {header['error']}")
+                payload = self._recv_exactly(header['rows'] * header['dim'] * 4)
+                self._backend = header.get('backend', 'fp32')
+            except (OSError, ConnectionError):
+                # Drop the connection so the next call reconnects
+                self.close()
+                raise
+        return np.frombuffer(payload, dtype=np.float32).reshape(header['rows'], header['dim'])
+
+    @property
+    def backend(self) -> str:
+        """The server's embedding backend, asked for with an empty request if no reply told it yet."""
+        if self._backend is None:
+            self.embed([])
+        return self._backend
+
+    def get_embeddings_batch(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        if not texts:
+            return {}
+        unique = list(dict.fromkeys(texts))
+        return dict(zip(unique, self.embed(unique)))
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+if __name__ == "__main__":
+    # Usage: python embedding_server.py [address] [backend]
+    from embeddings import EmbeddingService
+
+    address = sys.argv[1] if len(sys.argv) > 1 else Config.EMBEDDING_SERVER
+    backend = sys.argv[2] if len(sys.argv) > 2 else 'fp32'
+    server = EmbeddingServer(EmbeddingService(backend=backend), address)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print(f"Served {server.requests} requests in {server.batches} batches")
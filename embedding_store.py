@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+class EmbeddingStore:
+    """Append-only on-disk key -> float32 vector store with an in-memory dict index.
+
+    Layout for a store at `emb_service_cache`:
+      emb_service_cache.json          {"dim": 768, "generation": 3}
+      emb_service_cache.3.f32         raw float32 rows, appended in write order
+      emb_service_cache.3.keys        one line per row with its key; "-key" lines delete a key
+
+    Lookups are a dict access plus a row read from a memory-mapped file. Writes are
+    buffered and appended on `flush`. Overwritten and deleted keys leave dead rows
+    behind; once they exceed `compact_ratio` of the file, `flush` rewrites the live
+    rows into a new generation and switches to it by replacing the meta file.
+
+    A `read_only` store never writes: flushed vectors stay in memory (at most
+    `max_pending` of them), so several forked workers can share one store safely.
+
+    All methods take one lock, so threads of a process can share the store; a flush
+    never interleaves with another flush or with a put.
+    """
+
+    def __init__(self, path: str, compact_ratio: float = 0.25, read_only: bool = False, max_pending: int = 10000):
+        self.path = Path(path)
+        self.meta_path = self.path.with_name(self.path.name + '.json')
+        self.compact_ratio = compact_ratio
+        self.read_only = read_only
+        self.max_pending = max_pending
+        self.dim: Optional[int] = None
+        self.generation = 0
+        self.index: Dict[str, int] = {}
+        self.total_rows = 0
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._pending: Dict[str, np.ndarray] = {}
+        self._pending_deletes: List[str] = []
+        self._lock = threading.RLock()
+        self._open()
+
+    def _data_path(self, generation: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{generation}.f32")
+
+    def _keys_path(self, generation: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{generation}.keys")
+
+    def _open(self):
+        if not self.meta_path.exists():
+            return
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+        self.generation = meta['generation']
+
+        data_path = self._data_path(self.generation)
+        keys_path = self._keys_path(self.generation)
+        data_rows = data_path.stat().st_size // (self.dim * 4) if data_path.exists() else 0
+
+        self.index = {}
+        row = 0
+        consistent_offset = 0
+        if keys_path.exists():
+            with open(keys_path, 'rb') as f:
+                for line in f:
+                    # Stop at a key whose vector was not fully written (interrupted flush)
+                    if not line.endswith(b'\n') or (not line.startswith(b'-') and row >= data_rows):
+                        break
+                    key = line[:-1].decode('utf-8')
+                    if key.startswith('-'):
+                        self.index.pop(key[1:], None)
+                    else:
+                        self.index[key] = row
+                        row += 1
+                    consistent_offset += len(line)
+
+            # Drop the torn tail so later appends line up with the data file again
+            if consistent_offset < keys_path.stat().st_size:
+                os.truncate(keys_path, consistent_offset)
+        if data_path.exists() and data_path.stat().st_size != row * self.dim * 4:
+            os.truncate(data_path, row * self.dim * 4)
+        self.total_rows = row
+        self._map()
+
+    def _map(self):
+        if self.total_rows:
+            self._matrix = np.memmap(
+                self._data_path(self.generation), dtype=np.float32, mode='r',
+                shape=(self.total_rows, self.dim)
+            )
+        else:
+            self._matrix = np.empty((0, self.dim or 0), dtype=np.float32)
+
+    def _write_meta(self):
+        tmp_path = self.meta_path.with_name(self.meta_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'generation': self.generation}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.index) + sum(1 for key in self._pending if key not in self.index)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._pending or key in self.index
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            row = self.index.get(key)
+            if row is None:
+                return None
+            return self._matrix[row]
+
+    def put(self, key: str, embedding: np.ndarray):
+        """Queue a vector for the next flush."""
+        with self._lock:
+            embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+            if self.dim is None:
+                self.dim = embedding.shape[0]
+            elif embedding.shape[0] != self.dim:
+                raise ValueError(f"Expected embedding of size {self.dim}, got {embedding.shape[0]}")
+            self._pending[key] = embedding
+
+    def delete(self, key: str):
+        with self._lock:
+            self._pending.pop(key, None)
+            if key in self.index:
+                self._pending_deletes.append(key)
+
+    @property
+    def dead_rows(self) -> int:
+        return self.total_rows - len(self.index)
+
+    def flush(self):
+        """Append pending writes and deletes to disk, compacting if too many rows are dead."""
+        with self._lock:
+            if not self._pending and not self._pending_deletes:
+                return
+
+            if self.read_only:
+                # Keep the newest vectors in memory only
+                for key in list(self._pending)[:max(0, len(self._pending) - self.max_pending)]:
+                    del self._pending[key]
+                return
+
+            if not self.meta_path.exists():
+                self._write_meta()
+
+            keys = list(self._pending)
+            with open(self._data_path(self.generation), 'ab') as f:
+                if keys:
+                    f.write(np.stack([self._pending[key] for key in keys]).tobytes())
+            with open(self._keys_path(self.generation), 'a', encoding='utf-8') as f:
+                for key in self._pending_deletes:
+                    f.write(f"-{key}\n")
+                for key in keys:
+                    f.write(f"{key}\n")
+
+            for key in self._pending_deletes:
+                self.index.pop(key, None)
+            for i, key in enumerate(keys):
+                self.index[key] = self.total_rows + i
+            self.total_rows += len(keys)
+            self._pending = {}
+            self._pending_deletes = []
+            self._map()
+
+            if self.dead_rows > self.compact_ratio * self.total_rows:
+                self.compact()
+
+    def compact(self):
+        """Rewrite only the live rows into a new generation of files."""
+        with self._lock:
+            keys = list(self.index)
+            rows = np.fromiter((self.index[key] for key in keys), dtype=np.intp, count=len(keys))
+            old_generation = self.generation
+            new_generation = old_generation + 1
+
+            with open(self._data_path(new_generation), 'wb') as f:
+                if len(keys):
+                    # Copy in slices so a large store is never fully materialized in memory
+                    for start in range(0, len(keys), 65536):
+                        f.write(np.ascontiguousarray(self._matrix[rows[start:start + 65536]]).tobytes())
+            with open(self._keys_path(new_generation), 'w', encoding='utf-8') as f:
+                for key in keys:
+                    f.write(f"{key}\n")
+
+            # Switching the meta file is the commit point; until then readers see the old generation
+            self.generation = new_generation
+            self._write_meta()
+            self.index = {key: row for row, key in enumerate(keys)}
+            self.total_rows = len(keys)
+            self._map()
+
+            for path in (self._data_path(old_generation), self._keys_path(old_generation)):
+                path.unlink(missing_ok=True)
+            print(f"Compacted embedding store to {self.total_rows} rows")
+
+    def clear(self):
+        with self._lock:
+            for path in (self._data_path(self.generation), self._keys_path(self.generation), self.meta_path):
+                path.unlink(missing_ok=True)
+            self.dim = None
+            self.generation = 0
+            self.index = {}
+            self.total_rows = 0
+            self._pending = {}
+            self._pending_deletes = []
+            self._map()
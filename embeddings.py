@@ -1,3 +1,5 @@
+import contextlib
+import threading
 import torch
 from typing import Dict, List, Tuple, Optional
 from transformers import AutoTokenizer, AutoModel
@@ -5,69 +7,215 @@ from sklearn.metrics.pairwise import cosine_similarity
 from seasons import SEASONS
 import numpy as np
 import mmh3
-import pandas as pd
 from pathlib import Path
 from tqdm import tqdm
 
+from config import Config
+from embedding_store import EmbeddingStore
+from city_index import season_boost, ranking_multipliers
+from wiki import CityFeatures
+from vector_ops import normalize_rows, top_k_indices
+
+MODEL_NAME = "sberbank-ai/ruBert-base"
+EMBEDDING_DIM = 768  # hidden size of ruBert-base
+
+# fp32: the plain HF model; int8: dynamic int8 quantization of the Linear layers;
+# torchscript / onnx: a traced graph exported once to Config.EMBEDDING_EXPORT_DIR
+BACKENDS = ('fp32', 'int8', 'torchscript', 'onnx')
+
 class EmbeddingService:
-    def __init__(self, cache_file: str = "emb_service_cache.parquet", batch_size: int = 128):
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        print(f"Using device: {self.device}")
+    def __init__(
+        self,
+        cache_file: str = "emb_service_cache",
+        batch_size: int = 256,
+        max_batch_tokens: int = 16384,
+        device: Optional[str] = None,
+        backend: str = 'fp32',
+        num_threads: Optional[int] = None,
+        server_address: Optional[str] = None
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        if backend != 'fp32' and self.device.type != 'cpu':
+            raise ValueError(f"The {backend} backend runs on CPU only")
+        self.backend = backend
+        self.num_threads = num_threads
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        print(f"Using device: {self.device}, backend: {backend}, {torch.get_num_threads()} threads")
         
-        # Load tokenizer and model with optimizations
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "sberbank-ai/ruBert-base",
-            use_fast=True,  # Use fast tokenizer
-            model_max_length=512  # Set max length upfront
-        )
-        self.model = AutoModel.from_pretrained(
-            "sberbank-ai/ruBert-base",
-            return_dict=True  # Changed to True to get structured output
-        ).to(self.device).eval()  # Set to eval mode
+        # The model is loaded on first use, so a warm start served from caches never loads it
+        self._tokenizer = None
+        self._model = None
+        # The advisor embeds from several threads; only one of them may load the model
+        self._load_lock = threading.RLock()
         
+        # Batches hold at most batch_size texts and max_batch_tokens tokens after padding
         self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
         self.cache_file = Path(cache_file)
-        self.cache_df = self._load_cache()
-        self._pending_cache_updates = []
 
-    def _load_cache(self) -> pd.DataFrame:
-        """Load cache from parquet file or create new cache."""
-        if self.cache_file.exists():
-            return pd.read_parquet(self.cache_file)
-        return pd.DataFrame(columns=['text_hash', 'text', 'embedding'])
+        # In client mode embedding_server.py owns the model and the cache
+        self.client = None
+        if server_address:
+            from embedding_server import EmbeddingClient
+            self.client = EmbeddingClient(server_address)
+            self.cache = None
+            print(f"Using embedding server at {server_address}")
+        else:
+            self.cache = self._load_cache()
+
+    @property
+    def embedding_backend(self) -> str:
+        """Backend that produces this service's vectors: the server's one in client mode.
+
+        Matrices built from the vectors (FactMatrix, CityIndex) are keyed by it, since
+        vectors of different backends must not be compared with each other.
+        """
+        return self.client.backend if self.client is not None else self.backend
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            with self._load_lock:
+                if self._tokenizer is None:
+                    self._tokenizer = AutoTokenizer.from_pretrained(
+                        MODEL_NAME,
+                        use_fast=True,  # Use fast tokenizer
+                        model_max_length=512  # Set max length upfront
+                    )
+        return self._tokenizer
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    print(f"Loading ruBert model ({self.backend})...")
+                    if self.backend == 'int8':
+                        self._model = torch.quantization.quantize_dynamic(
+                            self._load_fp32_model(), {torch.nn.Linear}, dtype=torch.qint8
+                        )
+                    elif self.backend == 'torchscript':
+                        self._model = self._load_torchscript()
+                    elif self.backend == 'onnx':
+                        self._model = self._load_onnx()
+                    else:
+                        self._model = self._load_fp32_model()
+        return self._model
+
+    def load_model(self):
+        """Load the tokenizer and the model now instead of on first use.
+
+        Tracing or exporting a backend runs the model, which must happen outside
+        inference mode, so _embed_batch calls this before entering it.
+        """
+        self.tokenizer
+        self.model
+
+    def _load_fp32_model(self, torchscript: bool = False):
+        return AutoModel.from_pretrained(
+            MODEL_NAME,
+            return_dict=not torchscript,  # Traced graphs return plain tuples
+            torchscript=torchscript
+        ).to(self.device).eval()  # Set to eval mode
+
+    def _example_input(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """A small padded batch to trace the model with; sequence and batch size stay dynamic."""
+        encoded = self.tokenizer(
+            ["Пример текста для трассировки модели", "Короткий"],
+            padding=True, return_tensors='pt'
+        )
+        return encoded['input_ids'], encoded['attention_mask']
+
+    def _export_path(self, suffix: str) -> Path:
+        return Path(Config.EMBEDDING_EXPORT_DIR) / (MODEL_NAME.split('/')[-1] + suffix)
+
+    def _load_torchscript(self):
+        path = self._export_path('.torchscript.pt')
+        if not path.exists():
+            print(f"Tracing model to {path}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with torch.no_grad():
+                traced = torch.jit.trace(self._load_fp32_model(torchscript=True), self._example_input())
+            tmp_path = path.with_suffix('.tmp')
+            torch.jit.save(traced, str(tmp_path))
+            tmp_path.replace(path)
+        return torch.jit.optimize_for_inference(torch.jit.load(str(path), map_location='cpu').eval())
+
+    def _load_onnx(self):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx backend needs onnxruntime: pip install onnxruntime") from e
+
+        path = self._export_path('.onnx')
+        if not path.exists():
+            print(f"Exporting model to {path}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            with torch.no_grad():
+                torch.onnx.export(
+                    self._load_fp32_model(torchscript=True),
+                    self._example_input(),
+                    str(tmp_path),
+                    input_names=['input_ids', 'attention_mask'],
+                    output_names=['last_hidden_state'],
+                    dynamic_axes={
+                        'input_ids': {0: 'batch', 1: 'sequence'},
+                        'attention_mask': {0: 'batch', 1: 'sequence'},
+                        'last_hidden_state': {0: 'batch', 1: 'sequence'}
+                    },
+                    opset_version=14
+                )
+            tmp_path.replace(path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.num_threads or torch.get_num_threads()
+        return onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+
+    def _load_cache(self) -> EmbeddingStore:
+        """Open the embedding store, importing the legacy parquet cache on first use."""
+        cache = EmbeddingStore(str(self.cache_file))
+        legacy_file = self.cache_file.with_suffix('.parquet')
+        if len(cache) == 0 and legacy_file.exists():
+            import pandas as pd
+            legacy_df = pd.read_parquet(legacy_file)
+            print(f"Importing {len(legacy_df)} embeddings from {legacy_file}")
+            for text_hash, embedding in zip(legacy_df['text_hash'], legacy_df['embedding']):
+                cache.put(text_hash, embedding)
+            cache.flush()
+        return cache
 
     def _compute_hash(self, text: str) -> str:
-        """Compute MurmurHash3 hash of input text."""
+        """Compute MurmurHash3 hash of input text.
+
+        Embeddings from non-fp32 backends drift slightly, so they are cached under
+        their own keys instead of being mixed with fp32 ones.
+        """
+        if self.backend != 'fp32':
+            text = f"{self.backend}:{text}"
         return str(mmh3.hash128(text))
 
     def _save_to_cache(self, text: str, embedding: np.ndarray):
         """Queue embedding for batch cache update."""
         text_hash = self._compute_hash(text)
-        if text_hash not in self.cache_df['text_hash'].values:
-            self._pending_cache_updates.append({
-                'text_hash': text_hash,
-                'text': text,
-                'embedding': embedding
-            })
+        if text_hash not in self.cache:
+            self.cache.put(text_hash, embedding)
 
     def _flush_cache_updates(self):
-        """Write all pending cache updates to disk."""
-        if self._pending_cache_updates:
-            new_rows = pd.DataFrame(self._pending_cache_updates)
-            self.cache_df = pd.concat([self.cache_df, new_rows], ignore_index=True)
-            self.cache_df.to_parquet(self.cache_file)
-            self._pending_cache_updates = []
+        """Append all pending cache updates to disk."""
+        self.cache.flush()
 
     def _load_from_cache(self, text: str) -> np.ndarray:
         """Load embedding from cache if it exists."""
-        text_hash = self._compute_hash(text)
-        cached_item = self.cache_df[self.cache_df['text_hash'] == text_hash]
-        if not cached_item.empty:
-            return cached_item.iloc[0]['embedding']
-        return None
+        if self.cache is None:
+            return None
+        return self.cache.get(self._compute_hash(text))
 
-    def mean_pooling(self, model_output, attention_mask):
-        token_embeddings = model_output.last_hidden_state
+    def mean_pooling(self, token_embeddings, attention_mask):
         input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
         sum_embeddings = torch.sum(token_embeddings * input_mask_expanded, 1)
         sum_mask = torch.clamp(input_mask_expanded.sum(1), min=1e-9)
@@ -80,6 +228,28 @@ class EmbeddingService:
             return cached_embedding
         return self.get_embeddings_batch([text])[text]
 
+    def rank_cities(
+        self,
+        preferences_embedding: np.ndarray,
+        unit_city_matrix: np.ndarray,
+        cities: List[str],
+        multipliers: Optional[np.ndarray] = None,
+        top_n: int = 2
+    ) -> List[Tuple[str, float]]:
+        """Rank cities by cosine similarity with one matrix-vector product.
+
+        `unit_city_matrix` holds one unit-length embedding per city (row i is cities[i]),
+        `multipliers` the per-city seasonal/activity factors (see city_index.ranking_multipliers).
+        """
+        if not cities:
+            return []
+
+        scores = unit_city_matrix @ normalize_rows(preferences_embedding.reshape(-1))
+        if multipliers is not None:
+            scores = scores * multipliers
+
+        return [(cities[i], float(scores[i])) for i in top_k_indices(scores, top_n)]
+
     def get_top_cities(
         self, 
         preferences_embedding: np.ndarray,
@@ -88,137 +258,163 @@ class EmbeddingService:
         top_n: int = 2,
         season: Optional[str] = None,
         activity: Optional[str] = None,
-        activity_matcher = None
+        activity_matcher = None,
+        season_boosts: Optional[Dict[str, float]] = None,
+        activity_scores: Optional[Dict[str, float]] = None,
+        city_features: Optional[Dict[str, CityFeatures]] = None
     ) -> List[Tuple[str, float]]:
-        """Get top cities based on similarity with user preferences."""
+        """Get top cities based on similarity with user preferences.
+
+        Precomputed `season_boosts` / `activity_scores`, or the cities' CityFeatures
+        (WikiContent.features), skip rescanning the city descriptions.
+        """
+        if city_features is not None:
+            if season:
+                season_boosts = {city: features.season_boosts.get(season, 0.0) for city, features in city_features.items()}
+            if activity:
+                activity_scores = {city: features.activity_score(activity) for city, features in city_features.items()}
         print(f"Computing similarities for {len(cities_embeddings)} cities")
-        similarities = {}
-
-        # Convert to tensors for batch processing
-        pref_tensor = torch.from_numpy(preferences_embedding).to(self.device)
-        city_tensors = {
-            city: torch.from_numpy(emb).to(self.device)
-            for city, emb in cities_embeddings.items()
-        }
-
-        # Batch compute similarities
-        for city, city_tensor in city_tensors.items():
-            similarity = torch.cosine_similarity(
-                pref_tensor.reshape(1, -1),
-                city_tensor.reshape(1, -1)
-            ).item()
-
-            city_text = cities_descriptions[city].lower()
-            
-            if season and season in SEASONS:
-                season_data = SEASONS[season]
-                seasonal_boost = 0.0
-                
-                keyword_matches = sum(1 for keyword in season_data['keywords'] 
-                                   if keyword in city_text)
-                seasonal_boost += 0.05 * keyword_matches
-                
-                import re
-                temp_matches = re.finditer(r'температура.*?(-?\d+)', city_text)
-                for match in temp_matches:
-                    temp = int(match.group(1))
-                    if season_data['temp_range'][0] <= temp <= season_data['temp_range'][1]:
-                        seasonal_boost += 0.1
-                        break
-                
-                similarity *= (1 + seasonal_boost)
-            
-            if activity and activity_matcher:
-                activity_score = activity_matcher.get_activity_score(city_text, activity)
-                if activity_score > 0:
-                    activity_boost = 0.5 * activity_score
-                    similarity *= (1 + activity_boost)
-                else:
-                    similarity *= 0.5
-
-            similarities[city] = similarity
-
-        top_cities = sorted(
-            similarities.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )[:top_n]
+        cities = list(cities_embeddings)
+        if not cities:
+            return []
+        unit_city_matrix = normalize_rows(np.stack([cities_embeddings[city] for city in cities]))
+
+        seasonal = None
+        if season and season in SEASONS:
+            seasonal = np.array([
+                season_boosts[city] if season_boosts is not None
+                else season_boost(cities_descriptions[city].lower(), season)
+                for city in cities
+            ], dtype=np.float32)
+
+        activity_vector = None
+        if activity and (activity_scores is not None or activity_matcher):
+            activity_vector = np.array([
+                activity_scores[city] if activity_scores is not None
+                else activity_matcher.get_activity_score(cities_descriptions[city], activity)
+                for city in cities
+            ], dtype=np.float32)
+
+        top_cities = self.rank_cities(
+            preferences_embedding,
+            unit_city_matrix,
+            cities,
+            ranking_multipliers(len(cities), seasonal, activity_vector),
+            top_n
+        )
 
         print(f"Selected top {top_n} cities: {[city for city, score in top_cities]}")
         return top_cities
 
     def clear_cache(self):
         """Clear the embedding cache."""
-        if self.cache_file.exists():
-            self.cache_file.unlink()
-        self.cache_df = pd.DataFrame(columns=['text_hash', 'text', 'embedding'])
-        self._pending_cache_updates = []
+        if self.cache is None:
+            raise RuntimeError("The embedding cache is owned by the embedding server")
+        self.cache.clear()
 
     def cosine_similarity(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
         """Calculate cosine similarity between two vectors."""
         return cosine_similarity(a, b)
 
+    def _plan_batches(self, lengths: List[int]) -> List[List[int]]:
+        """Group text indices into length-sorted batches of at most max_batch_tokens padded tokens."""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+        batches = []
+        current = []
+        for i in order:
+            # Longest first, so the first text of a batch sets its padded length
+            if current and (
+                (len(current) + 1) * lengths[current[0]] > self.max_batch_tokens
+                or len(current) >= self.batch_size
+            ):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _forward(self, batch_input: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """Last hidden state of the selected backend."""
+        if self.backend == 'onnx':
+            outputs = self.model.run(
+                ['last_hidden_state'],
+                {name: tensor.numpy() for name, tensor in batch_input.items()}
+            )
+            return torch.from_numpy(outputs[0])
+        if self.backend == 'torchscript':
+            return self.model(batch_input['input_ids'], batch_input['attention_mask'])[0]
+        return self.model(**batch_input).last_hidden_state
+
+    def _embed_batch(self, batch_input: Dict[str, torch.Tensor]) -> np.ndarray:
+        # Mixed precision only pays off on GPU, on CPU autocast would be a no-op
+        autocast = torch.cuda.amp.autocast() if self.device.type == 'cuda' else contextlib.nullcontext()
+        self.load_model()
+        with torch.inference_mode(), autocast:
+            token_embeddings = self._forward(batch_input)
+            return self.mean_pooling(token_embeddings, batch_input['attention_mask']).float().cpu().numpy()
+
+    def compute_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Embed texts without the cache; rows of the result follow the input order.
+
+        Texts are tokenized without padding, sorted by length and grouped so that each
+        batch is only padded to its own longest text and holds at most max_batch_tokens
+        padded tokens.
+        """
+        if not texts:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        encoded = self.tokenizer(texts, truncation=True, max_length=512)
+        lengths = [len(input_ids) for input_ids in encoded['input_ids']]
+        embeddings = None
+
+        with tqdm(total=len(texts), desc="Computing embeddings", unit="text") as pbar:
+            for batch in self._plan_batches(lengths):
+                batch_input = self.tokenizer.pad(
+                    {
+                        'input_ids': [encoded['input_ids'][i] for i in batch],
+                        'attention_mask': [encoded['attention_mask'][i] for i in batch]
+                    },
+                    return_tensors='pt'
+                )
+                batch_input = {name: tensor.to(self.device) for name, tensor in batch_input.items()}
+                batch_embeddings = self._embed_batch(batch_input)
+
+                if embeddings is None:
+                    embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+                embeddings[batch] = batch_embeddings
+                pbar.update(len(batch))
+
+                # Clear GPU cache periodically
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+
+        return embeddings
+
     def get_embeddings_batch(self, texts: List[str]) -> Dict[str, np.ndarray]:
         """Get embeddings for multiple texts efficiently using batching."""
-        text_to_hash = {text: self._compute_hash(text) for text in texts}
-        hash_to_text = {h: t for t, h in text_to_hash.items()}
-
-        all_hashes = set(text_to_hash.values())
-        cached_mask = self.cache_df['text_hash'].isin(all_hashes)
-        cached_entries = self.cache_df[cached_mask]
+        if self.client is not None:
+            result = self.client.get_embeddings_batch(texts)
+            return {text: result[text] for text in texts}
 
         result = {}
-        for _, row in cached_entries.iterrows():
-            text = hash_to_text[row['text_hash']]
-            result[text] = row['embedding']
+        for text in texts:
+            embedding = self._load_from_cache(text)
+            if embedding is not None:
+                result[text] = embedding
 
-        texts_to_compute = [text for text in texts if text not in result]
+        texts_to_compute = list(dict.fromkeys(text for text in texts if text not in result))
         
         if texts_to_compute:
-            print("Pre-tokenizing all texts...")
-            # Pre-tokenize all texts with padding
-            all_encoded = self.tokenizer(
-                texts_to_compute,
-                padding=True,
-                truncation=True,
-                max_length=512,
-                return_tensors='pt'
-            )
-            
-            # Process in batches with progress bar
-            total_batches = (len(texts_to_compute) + self.batch_size - 1) // self.batch_size
-            with tqdm(total=total_batches, desc="Computing embeddings") as pbar:
-                for i in range(0, len(texts_to_compute), self.batch_size):
-                    batch_end = min(i + self.batch_size, len(texts_to_compute))
-                    batch_texts = texts_to_compute[i:batch_end]
-                    
-                    # Extract batch tensors
-                    batch_input = {
-                        'input_ids': all_encoded['input_ids'][i:batch_end].to(self.device),
-                        'attention_mask': all_encoded['attention_mask'][i:batch_end].to(self.device),
-                    }
-
-                    with torch.no_grad(), torch.cuda.amp.autocast():  # Enable automatic mixed precision
-                        model_output = self.model(**batch_input)
-
-                    embeddings = self.mean_pooling(
-                        model_output,
-                        batch_input['attention_mask']
-                    ).cpu().numpy()
-
-                    # Queue embeddings for cache update
-                    for text, embedding in zip(batch_texts, embeddings):
-                        self._save_to_cache(text, embedding)
-                        result[text] = embedding
-                    
-                    pbar.update(1)
-                    
-                    # Clear GPU cache periodically
-                    if torch.cuda.is_available():
-                        torch.cuda.empty_cache()
+            embeddings = self.compute_embeddings(texts_to_compute)
+
+            # Queue embeddings for cache update
+            for text, embedding in zip(texts_to_compute, embeddings):
+                self._save_to_cache(text, embedding)
+                result[text] = embedding
             
             # Flush all cache updates at once
             print("Saving to cache...")
             self._flush_cache_updates()
 
-        return result
+        # Return in input order
+        return {text: result[text] for text in texts}
@@ -2,7 +2,7 @@ import asyncio
 import json
 from typing import List, Dict
 from wiki import WikiService
-from llm import LLMService
+from llm import LLMService, LLMScheduler, BATCH
 from config import Config
 from tqdm.asyncio import tqdm_asyncio
 from tqdm import tqdm
@@ -33,16 +33,11 @@ async def extract_tourist_facts(text: str, llm_service: LLMService) -> List[str]
         {"role": "user", "content": text}
     ]
     
-    response = await llm_service.client.chat.completions.create(
-        model=Config.LLM_MODEL,
-        messages=messages,
-        temperature=0.0,
-        max_tokens=512
-    )
+    response = await llm_service.complete(messages, 512)
     
     # Split response into individual facts and clean them up
     facts = []
-    for fact in response.choices[0].message.content.split('\n'):
+    for fact in response.split('\n'):
         fact = fact.strip()
         if fact and fact.startswith('-'):
             # Remove the leading dash and clean up the text
@@ -79,14 +74,9 @@ async def categorize_single_fact(fact: str, llm_service: LLMService) -> tuple[st
         {"role": "user", "content": fact}
     ]
     
-    response = await llm_service.client.chat.completions.create(
-        model=Config.LLM_MODEL,
-        messages=messages,
-        temperature=0.0,
-        max_tokens=64
-    )
+    response = await llm_service.complete(messages, 64)
     
-    category = response.choices[0].message.content.strip()
+    category = response.strip()
     return fact, category
 
 async def categorize_facts(facts: List[str], llm_service: LLMService) -> Dict[str, List[str]]:
@@ -115,10 +105,14 @@ async def categorize_facts(facts: List[str], llm_service: LLMService) -> Dict[st
     
     return categories
 
+# This job runs in its own process, so BATCH priority only orders its own calls; the
+# small concurrency cap is what keeps it from crowding out the web workers' requests
+BATCH_SCHEDULER = LLMScheduler(Config.LLM_BATCH_MAX_CONCURRENCY)
+
 async def process_city(city: str) -> Dict[str, Dict[str, List[str]]]:
     """Process a city and extract tourist facts."""
     wiki_service = WikiService()
-    llm_service = LLMService()
+    llm_service = LLMService(scheduler=BATCH_SCHEDULER, priority=BATCH)
     
     # Get Wikipedia content
     wiki_content = await wiki_service.get_wiki_content(city)
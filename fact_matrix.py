@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from vector_ops import normalize_rows
+
+class FactMatrix:
+    """Tourist facts with a prebuilt unit-length embedding matrix.
+
+    The matrix is stored as fact_matrix/<content hash of the facts file>-<embedding
+    backend>.npy together with a .json listing the facts in row order. Facts of one city occupy a
+    contiguous row range. A warm start only hashes the facts file and memory-maps
+    the matrix; when the file changed, rows of unchanged facts are copied from the
+    previous matrix and only new facts are embedded.
+    """
+
+    def __init__(self, path: Path, content_hash: str):
+        self.content_hash = content_hash
+        with open(path.with_suffix('.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.texts: List[str] = meta['texts']
+        self.cities: List[str] = meta['cities']
+        self.categories: List[str] = meta['categories']
+        self.city_ranges: Dict[str, Tuple[int, int]] = {city: tuple(r) for city, r in meta['city_ranges'].items()}
+        self.matrix = np.load(path.with_suffix('.npy'), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @classmethod
+    def load(cls, embedding_service, facts_file: str = Config.FACTS_FILE, cache_dir: str = Config.FACT_MATRIX_DIR) -> 'FactMatrix':
+        with open(facts_file, 'rb') as f:
+            raw = f.read()
+        # Vectors of another backend are not comparable with the query vectors
+        content_hash = f"{hashlib.sha1(raw).hexdigest()[:16]}-{embedding_service.embedding_backend}"
+        cache_dir = Path(cache_dir)
+        path = cache_dir / content_hash
+
+        if not path.with_suffix('.npy').exists() or not path.with_suffix('.json').exists():
+            cls._build(json.loads(raw.decode('utf-8')), embedding_service, cache_dir, content_hash)
+        return cls(path, content_hash)
+
+    @staticmethod
+    def _previous(cache_dir: Path, content_hash: str) -> Optional['FactMatrix']:
+        """The most recently built matrix for another version of the facts file, from the same backend."""
+        backend = content_hash.split('-', 1)[1]
+        candidates = sorted(
+            (
+                p for p in cache_dir.glob(f'*-{backend}.npy')
+                if p.stem != content_hash and p.with_suffix('.json').exists()
+            ),
+            key=lambda p: p.stat().st_mtime
+        )
+        return FactMatrix(candidates[-1], candidates[-1].stem) if candidates else None
+
+    @classmethod
+    def _build(cls, tourist_facts: dict, embedding_service, cache_dir: Path, content_hash: str):
+        texts, cities, categories, city_ranges = [], [], [], {}
+        seen = set()
+        for city, city_categories in tourist_facts.items():
+            start = len(texts)
+            for category, facts in city_categories.items():
+                for fact in facts:
+                    if fact in seen:
+                        continue
+                    seen.add(fact)
+                    texts.append(fact)
+                    cities.append(city)
+                    categories.append(category)
+            if len(texts) > start:
+                city_ranges[city] = (start, len(texts))
+        print(f"Found {len(texts)} facts")
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        previous = cls._previous(cache_dir, content_hash)
+        previous_rows = {text: i for i, text in enumerate(previous.texts)} if previous else {}
+        missing = [text for text in texts if text not in previous_rows]
+        print(f"Reusing {len(texts) - len(missing)} fact embeddings, computing {len(missing)}")
+        computed = embedding_service.get_embeddings_batch(missing) if missing else {}
+
+        if computed:
+            dim = len(next(iter(computed.values())))
+        else:
+            dim = previous.matrix.shape[1] if previous else 0
+        matrix = np.empty((len(texts), dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            if text in previous_rows:
+                matrix[i] = previous.matrix[previous_rows[text]]
+            else:
+                matrix[i] = normalize_rows(computed[text])
+
+        # Write both files under temporary names first, the .npy rename makes the version visible
+        path = cache_dir / content_hash
+        with open(path.with_suffix('.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'texts': texts,
+                'cities': cities,
+                'categories': categories,
+                'city_ranges': city_ranges
+            }, f, ensure_ascii=False)
+        with open(path.with_suffix('.npy.tmp'), 'wb') as f:
+            np.save(f, matrix)
+        os.replace(path.with_suffix('.json.tmp'), path.with_suffix('.json'))
+        os.replace(path.with_suffix('.npy.tmp'), path.with_suffix('.npy'))
+
+        if previous:
+            for suffix in ('.npy', '.json'):
+                (cache_dir / previous.content_hash).with_suffix(suffix).unlink(missing_ok=True)
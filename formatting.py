@@ -0,0 +1,102 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+from climate import describe_climate
+
+MONTHS = ['январ', 'феврал', 'март', 'апрел', 'май', 'июн', 'июл', 'август', 'сентябр', 'октябр', 'ноябр', 'декабр']
+
+def format_preferences(preferences: str) -> str:
+    return f"<h3>📋 Анализ запроса:</h3><p>{preferences}</p>"
+
+def format_facts(facts) -> str:
+    facts_text = "📚 Интересные факты:"
+    for fact, _ in facts:
+        facts_text += f"<br>• {fact}"
+    return facts_text
+
+def format_climate(chunks) -> str:
+    """The first sentence mentioning a month together with a temperature, or an empty string."""
+    all_text = " ".join(chunks)
+    if 'температура' in all_text.lower() or any(month in all_text.lower() for month in MONTHS):
+        climate_info = "🌡️ "
+        for sentence in all_text.split('.'):
+            if any(month in sentence.lower() for month in MONTHS) and ('температура' in sentence.lower() or 'градус' in sentence.lower()):
+                climate_info += sentence.strip() + ". "
+                break
+        if climate_info != "🌡️ ":
+            return climate_info.strip().replace(",", ".")
+    return ""
+
+def format_city(city: str, score: float, cities_chunks, climates: Optional[Dict[str, np.ndarray]] = None) -> dict:
+    """Score and climate details of a recommended city; facts are added separately.
+
+    The climate line comes from the city's climate table when there is one, otherwise
+    from a sentence of its chunks.
+    """
+    climate = describe_climate(climates[city]) if climates and city in climates else ""
+    if climate:
+        climate = f"🌡️ {climate}"
+    elif city in cities_chunks:
+        climate = format_climate(cities_chunks[city])
+    return {
+        'name': city,
+        'score': f"Релевантность: {score:.3f}",
+        'climate': climate
+    }
+
+def format_response(
+    cities_chunks,
+    top_cities,
+    preferences: str,
+    relevant_facts,
+    climates: Optional[Dict[str, np.ndarray]] = None
+) -> dict:
+    """The JSON body of /ask for a finished process_request result."""
+    if not cities_chunks:
+        return {
+            'preferences': 'Не удалось обработать запрос',
+            'recommendations': []
+        }
+
+    # Format recommendations
+    recommendations = []
+    for city, score in top_cities:
+        city_data = format_city(city, score, cities_chunks, climates)
+        details = [city_data['score']]
+
+        # Add relevant facts
+        if city in relevant_facts and relevant_facts[city]:
+            details.append(format_facts(relevant_facts[city]))
+
+        # Add climate information if available
+        if city_data['climate']:
+            details.append(city_data['climate'])
+
+        recommendations.append({
+            'name': city,
+            'details': details
+        })
+
+    return {
+        'preferences': format_preferences(preferences),
+        'recommendations': recommendations
+    }
+
+def format_event(event: dict) -> Optional[dict]:
+    """The client-facing NDJSON event for a process_request_stream event, or None to skip it."""
+    if event['type'] == 'preferences':
+        return {'type': 'preferences', 'html': format_preferences(event['preferences'])}
+    if event['type'] == 'cities':
+        return {
+            'type': 'cities',
+            'cities': [
+                format_city(city, score, event['cities_chunks'], event.get('climates'))
+                for city, score in event['top_cities']
+            ]
+        }
+    if event['type'] == 'facts_delta':
+        return {'type': 'facts_delta', 'city': event['city'], 'text': event['text']}
+    if event['type'] == 'facts' and event['facts']:
+        return {'type': 'facts', 'city': event['city'], 'html': format_facts(event['facts'])}
+    return None
@@ -0,0 +1,30 @@
+# Pre-fork serving of asgi_app: gunicorn -c gunicorn.conf.py
+#
+# With preload_app the master imports the app once, building TravelAdvisor with the
+# model, city index, fact matrix, ANN index and POI data before forking, so every
+# worker shares that memory copy-on-write. Memory-mapped .npy files are shared
+# through the page cache as well. Per-process state (LLM client, SQLite connection,
+# aiohttp session, event loop) is created lazily inside each worker.
+#
+# The LLM scheduler is per process too: Config.LLM_MAX_CONCURRENCY and
+# LLM_MAX_QUEUE_INTERACTIVE apply to every worker, so the LLM endpoint sees up to
+# `workers` times those limits.
+#
+# Build the indexes beforehand (`python city_index.py`, one start of TravelAdvisor) so
+# the master does not run the model before forking, or set Config.USE_EMBEDDING_SERVER
+# to keep the model in embedding_server.py entirely.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count())))
+worker_class = 'uvicorn.workers.UvicornWorker'
+wsgi_app = 'asgi_app:create_preloaded_app()'
+preload_app = True
+timeout = 300
+graceful_timeout = 30
+
+def post_fork(server, worker):
+    # Split the cores between workers instead of every worker using all of them
+    import torch
+    torch.set_num_threads(max(1, multiprocessing.cpu_count() // workers))
@@ -0,0 +1,109 @@
+import re
+from typing import Dict, Hashable, Iterable, List
+
+import numpy as np
+
+class KeywordHits:
+    """Which keywords of a KeywordMatcher occur in one text."""
+
+    def __init__(self, group_rows: Dict[Hashable, int], membership: np.ndarray, present: np.ndarray):
+        self.group_rows = group_rows
+        self.membership = membership
+        self.present = present
+        self._counts = None
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Hit count of every group, in the matcher's group order."""
+        if self._counts is None:
+            self._counts = self.membership @ self.present.astype(np.int32)
+        return self._counts
+
+    def count(self, group: Hashable) -> int:
+        """How many of the group's keywords occur in the text, like sum(kw in text for kw in group)."""
+        return int(self.counts[self.group_rows[group]])
+
+    def any(self, group: Hashable) -> bool:
+        return self.count(group) > 0
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """A regex alternation of `words` nested by common prefix, preferring the longest word.
+
+    Nesting keeps the engine from trying every word at every position: after the
+    first character only the words continuing it are left to try.
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in node.items() if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Longer continuations are tried first, a word ending here is the fallback
+        return f'(?:{pattern})?' if '' in node else pattern
+
+    return build(trie)
+
+class KeywordMatcher:
+    """One compiled regex over named groups of substring keywords.
+
+    Groups are registered at import time by the modules that own the keyword lists
+    (activities, seasons, the advisor's filters) and compiled into one pattern on
+    the first scan, so a single pass over a text answers every `keyword in text` question
+    those modules ask. Matching is case-insensitive and, like `in`, finds
+    keywords anywhere in the text, including inside longer words and overlapping
+    each other: the pattern is a lookahead that reports the longest keyword starting
+    at every position, and each reported keyword stands for all keywords it contains.
+    """
+
+    def __init__(self):
+        self.groups: Dict[Hashable, List[str]] = {}
+        self._compiled = False
+
+    def add_group(self, name: Hashable, keywords: Iterable[str]):
+        # A group added after the first scan triggers a recompile; earlier hits keep their own groups
+        self.groups[name] = [keyword.lower() for keyword in keywords]
+        self._compiled = False
+
+    def add_groups(self, groups: Dict[Hashable, Iterable[str]]):
+        for name, keywords in groups.items():
+            self.add_group(name, keywords)
+
+    def size(self, group: Hashable) -> int:
+        return len(self.groups[group])
+
+    def compile(self):
+        if self._compiled:
+            return
+        self.keywords = list(dict.fromkeys(keyword for keywords in self.groups.values() for keyword in keywords))
+        self.group_rows = {name: i for i, name in enumerate(self.groups)}
+        # Duplicates within a group count twice, as they did in the original scans
+        keyword_ids = {keyword: i for i, keyword in enumerate(self.keywords)}
+        self.membership = np.zeros((len(self.groups), len(self.keywords)), dtype=np.int32)
+        for name, keywords in self.groups.items():
+            for keyword in keywords:
+                self.membership[self.group_rows[name], keyword_ids[keyword]] += 1
+
+        self._pattern = re.compile(f'(?=({trie_pattern(self.keywords)}))')
+        # Keywords found whenever a keyword is: itself and every keyword inside it
+        self._contained = {
+            keyword: [i for i, other in enumerate(self.keywords) if other in keyword]
+            for keyword in self.keywords
+        }
+        self._compiled = True
+
+    def scan(self, text: str) -> KeywordHits:
+        """One pass over `text` marking every keyword that occurs in it."""
+        self.compile()
+        present = np.zeros(len(self.keywords), dtype=bool)
+        for keyword in set(self._pattern.findall(text.lower())):
+            present[self._contained[keyword]] = True
+        return KeywordHits(self.group_rows, self.membership, present)
+
+# The process-wide matcher shared by activities, seasons and the advisor filters
+KEYWORDS = KeywordMatcher()
@@ -1,45 +1,472 @@
 from openai import AsyncOpenAI
 from transformers import AutoTokenizer
-from typing import List, Dict, Tuple, Optional
+from typing import AsyncIterator, List, Dict, Tuple, Optional
 import tiktoken
 import json
+import os
 import asyncio
+import threading
+import time
+import contextlib
+import heapq
+import itertools
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
 from seasons import SEASONS, get_season_from_text
+from activities import ACTIVITIES
 
 from config import Config
+from llm_cache import LLMResponseCache
+from compression import CompressionPlanner, CompressionStats
+
+
+
+# Priority classes of the LLM scheduler, lower values are served first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+class LLMOverloaded(Exception):
+    """Too many requests of this priority are already waiting for the LLM endpoint."""
+
+class LLMScheduler:
+    """Admits requests to the LLM endpoint by priority, within one process.
+
+    At most `limit` calls are in flight. Waiting calls form one priority queue
+    (FIFO within a priority class), so interactive requests overtake queued batch
+    work. The queue is not bound to one event loop: Flask runs every async view in
+    its own loop, so waiters from different loops and threads share the queue and
+    a released slot is handed over with call_soon_threadsafe.
+
+    `admit` implements load shedding: a new request of a priority with a
+    `max_queue` limit is rejected with LLMOverloaded while that many calls of the
+    same or higher priority are already waiting. Queue wait and generation time
+    are recorded per priority class.
+
+    Priorities only order calls of the same process. Each pre-fork worker and each
+    offline job (extract_facts.py) has its own scheduler, so their limits add up at
+    the endpoint and a batch job competes with the web workers on equal terms.
+    """
+
+    def __init__(self, limit: int, max_queue: Optional[Dict[int, Optional[int]]] = None):
+        self.limit = limit
+        self.max_queue = max_queue or {}
+        self.active = 0
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.metrics = {
+            priority: {
+                'calls': 0, 'shed': 0,
+                'queue_wait': 0.0, 'max_queue_wait': 0.0,
+                'generation': 0.0, 'max_generation': 0.0
+            }
+            for priority in PRIORITY_NAMES
+        }
+
+    def waiting(self, priority: Optional[int] = None) -> int:
+        """Calls waiting for a slot, only those of `priority` or higher when given."""
+        return sum(1 for waiter in self._waiters if priority is None or waiter[0] <= priority)
+
+    def admit(self, priority: int = INTERACTIVE):
+        """Raise LLMOverloaded when a new request of this priority should be shed."""
+        max_queue = self.max_queue.get(priority)
+        with self._lock:
+            if max_queue is not None and self.active >= self.limit and self.waiting(priority) >= max_queue:
+                self.metrics[priority]['shed'] += 1
+                raise LLMOverloaded(
+                    f"{self.waiting(priority)} {PRIORITY_NAMES[priority]} LLM calls are already queued"
+                )
 
-
+    async def acquire(self, priority: int = INTERACTIVE):
+        start = time.perf_counter()
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                self._record(priority, 'queue_wait', 0.0)
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            waiter = (priority, next(self._sequence), loop, future)
+            heapq.heappush(self._waiters, waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+                    raise
+            # The slot was already handed to us, pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        with self._lock:
+            self._record(priority, 'queue_wait', time.perf_counter() - start)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                _, _, loop, future = heapq.heappop(self._waiters)
+                if loop.is_closed():
+                    continue
+                # The slot moves to the waiter, so `active` stays the same
+                loop.call_soon_threadsafe(self._wake, future)
+                return
+            self.active -= 1
+
+    def _wake(self, future: asyncio.Future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def _record(self, priority: int, name: str, seconds: float):
+        metrics = self.metrics[priority]
+        if name == 'queue_wait':
+            metrics['calls'] += 1
+        metrics[name] += seconds
+        metrics[f'max_{name}'] = max(metrics[f'max_{name}'], seconds)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE):
+        """Hold one in-flight slot for the duration of a call and time it."""
+        await self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release()
+            with self._lock:
+                self._record(priority, 'generation', time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, dict]:
+        """In-flight and queued calls plus mean/max queue wait and generation time per priority."""
+        with self._lock:
+            stats = {'active': self.active, 'limit': self.limit, 'waiting': self.waiting()}
+            for priority, name in PRIORITY_NAMES.items():
+                metrics = self.metrics[priority]
+                calls = metrics['calls'] or 1
+                stats[name] = {
+                    'calls': metrics['calls'],
+                    'shed': metrics['shed'],
+                    'waiting': sum(1 for waiter in self._waiters if waiter[0] == priority),
+                    'mean_queue_wait': metrics['queue_wait'] / calls,
+                    'max_queue_wait': metrics['max_queue_wait'],
+                    'mean_generation': metrics['generation'] / calls,
+                    'max_generation': metrics['max_generation']
+                }
+        return stats
+
+# Shared by every LLMService in the process, so all of the process's requests to the
+# endpoint are scheduled together (not those of other workers or processes)
+LLM_SCHEDULER = LLMScheduler(
+    Config.LLM_MAX_CONCURRENCY,
+    {INTERACTIVE: Config.LLM_MAX_QUEUE_INTERACTIVE, BATCH: None}
+)
+
+REQUEST_PROFILE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "preferences": {"type": "string"},
+        "activity": {"enum": list(ACTIVITIES) + [None]},
+        "season": {"enum": list(SEASONS) + [None]},
+        "temperature": {"type": ["number", "null"]},
+        "budget": {"type": ["number", "null"]}
+    },
+    "required": ["preferences", "activity", "season", "temperature", "budget"],
+    "additionalProperties": False
+}
+
+@dataclass
+class RequestProfile:
+    preferences: str
+    activity: Optional[str] = None
+    season: Optional[str] = None
+    temperature: Optional[float] = None
+    budget: Optional[float] = None
 
 class ContextManager:
-    def __init__(self, model_context_length: int = 10000):
+    """Token accounting against the model context.
+
+    Token counts are memoized in a bounded LRU keyed by a hash of the text, so the
+    same chunk, summary or preference string is encoded once however often the
+    budgeting code asks for it.
+    """
+
+    def __init__(self, model_context_length: int = 10000, cache_size: int = Config.TOKEN_COUNT_CACHE_SIZE):
         self.model_context_length = model_context_length
         self.tokenizer = AutoTokenizer.from_pretrained("Vikhrmodels/Vikhr-Nemo-12B-Instruct-R-21-09-24")
-        self.system_prompt_tokens = len(self.tokenizer.encode(Config.SYSTEM_PROMPT))
-        self.rag_prompt_tokens = len(self.tokenizer.encode(Config.GROUNDED_SYSTEM_PROMPT))
+        self.cache_size = cache_size
+        self._token_counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.system_prompt_tokens = self.count_tokens(Config.SYSTEM_PROMPT)
+        self.rag_prompt_tokens = self.count_tokens(Config.GROUNDED_SYSTEM_PROMPT)
         self.expected_output_tokens = 2048
 
+    @staticmethod
+    def _text_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def _cached_count(self, key: bytes) -> Optional[int]:
+        with self._lock:
+            count = self._token_counts.get(key)
+            if count is not None:
+                self._token_counts.move_to_end(key)
+            return count
+
+    def _store_count(self, key: bytes, count: int):
+        with self._lock:
+            self._token_counts[key] = count
+            self._token_counts.move_to_end(key)
+            while len(self._token_counts) > self.cache_size:
+                self._token_counts.popitem(last=False)
+
     def count_tokens(self, text: str) -> int:
-        return len(self.tokenizer.encode(text))
+        key = self._text_key(text)
+        count = self._cached_count(key)
+        if count is None:
+            count = len(self.tokenizer.encode(text))
+            self._store_count(key, count)
+        return count
+
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Token counts of `texts`, encoding all uncached ones in one fast-tokenizer call."""
+        keys = [self._text_key(text) for text in texts]
+        counts = [self._cached_count(key) for key in keys]
+        missing = list(dict.fromkeys(text for text, count in zip(texts, counts) if count is None))
+        if missing:
+            encoded = self.tokenizer(missing, add_special_tokens=True)['input_ids']
+            fresh = {text: len(ids) for text, ids in zip(missing, encoded)}
+            for i, (text, key) in enumerate(zip(texts, keys)):
+                if counts[i] is None:
+                    counts[i] = fresh[text]
+                    self._store_count(key, counts[i])
+        return counts
 
     def get_available_tokens(self, user_preferences: str, is_rag: bool = False) -> int:
         base_prompt = self.rag_prompt_tokens if is_rag else self.system_prompt_tokens
         user_tokens = self.count_tokens(user_preferences)
         return self.model_context_length - base_prompt - user_tokens - self.expected_output_tokens
 
-class LLMService:
-    def __init__(self, model_context_length: int = 10000):
-        self.client = AsyncOpenAI(
-            api_key=Config.OPENAI_KEY,
-            base_url=Config.ENDPOINT
+class DocumentBudget:
+    """RAG documents together with running token totals.
+
+    `content_tokens` is the sum over the documents' contents and `json_tokens`
+    estimates the documents as serialized into the prompt (each document's JSON
+    plus one token per separator). Both are updated as documents are added or
+    replaced instead of being recounted over the whole set.
+    """
+
+    def __init__(self, context_manager: ContextManager, documents: Optional[List[dict]] = None):
+        self.context_manager = context_manager
+        self.documents: List[dict] = []
+        self._content_tokens: List[int] = []
+        self._json_tokens: List[int] = []
+        self.content_tokens = 0
+        self.json_tokens = 1  # The enclosing brackets
+        if documents:
+            self.extend(documents)
+
+    def _serialized(self, document: dict) -> str:
+        return json.dumps(document, ensure_ascii=False)
+
+    def extend(self, documents: List[dict]):
+        counts = self.context_manager.count_tokens_batch(
+            [doc["content"] for doc in documents] + [self._serialized(doc) for doc in documents]
         )
+        for doc, content_tokens, json_tokens in zip(documents, counts[:len(documents)], counts[len(documents):]):
+            self.documents.append(doc)
+            self._content_tokens.append(content_tokens)
+            self._json_tokens.append(json_tokens + 1)
+            self.content_tokens += content_tokens
+            self.json_tokens += json_tokens + 1
+
+    def add(self, document: dict):
+        self.extend([document])
+
+    def replace_content(self, index: int, content: str):
+        document = dict(self.documents[index], content=content)
+        content_tokens, json_tokens = self.context_manager.count_tokens_batch([content, self._serialized(document)])
+        self.content_tokens += content_tokens - self._content_tokens[index]
+        self.json_tokens += json_tokens + 1 - self._json_tokens[index]
+        self.documents[index] = document
+        self._content_tokens[index] = content_tokens
+        self._json_tokens[index] = json_tokens + 1
+
+    def content_tokens_of(self, index: int) -> int:
+        return self._content_tokens[index]
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+class LLMService:
+    def __init__(
+        self,
+        model_context_length: int = 10000,
+        scheduler: Optional[LLMScheduler] = None,
+        priority: int = INTERACTIVE
+    ):
+        self._client = None
+        self._client_pid = None
         self.context_manager = ContextManager(model_context_length)
         self.max_summary_tokens = 512
         self.max_final_response_tokens = 1024
-
-    async def compress_chunk(self, chunk: str, max_tokens: int) -> str:
-        while self.context_manager.count_tokens(chunk) > max_tokens:
-            messages = [
-            {"role": "system", "content": """Кратко обобщите ключевую туристическую информацию, включая:
+        self.response_cache = LLMResponseCache()
+        self.scheduler = scheduler or LLM_SCHEDULER
+        self.priority = priority
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        # Created lazily per process, so a client built before a pre-fork never
+        # shares its connection pool with the workers
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = AsyncOpenAI(
+                api_key=Config.OPENAI_KEY,
+                base_url=Config.ENDPOINT
+            )
+            self._client_pid = os.getpid()
+        return self._client
+
+    async def aclose(self):
+        """Close the HTTP connection pool of the OpenAI client."""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def complete(
+        self,
+        messages: List[dict],
+        max_tokens: int,
+        temperature: float = 0.0,
+        cache: Optional[bool] = None,
+        priority: Optional[int] = None,
+        **params
+    ) -> str:
+        """Run a chat completion and return the message text.
+
+        Deterministic (temperature 0) calls are served from the response cache by
+        default; sampled calls always reach the model unless `cache=True`. Calls are
+        scheduled with the service's priority unless `priority` is given.
+        """
+        if cache is None:
+            cache = temperature == 0.0
+        key = None
+        if cache:
+            key = LLMResponseCache.make_key(Config.LLM_MODEL, messages, temperature, max_tokens, **params)
+            # SQLite work runs off the event loop so a cache write never stalls other requests
+            cached = await asyncio.to_thread(self.response_cache.get, key)
+            if cached is not None:
+                return cached
+
+        async with self.scheduler.slot(self.priority if priority is None else priority):
+            response = await self.client.chat.completions.create(
+                model=Config.LLM_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **params
+            )
+        content = response.choices[0].message.content
+        if key is not None and content is not None:
+            await asyncio.to_thread(self.response_cache.put, key, Config.LLM_MODEL, content)
+        return content
+
+
+    async def complete_stream(
+        self,
+        messages: List[dict],
+        max_tokens: int,
+        temperature: float = 0.0,
+        cache: Optional[bool] = None,
+        priority: Optional[int] = None,
+        **params
+    ) -> AsyncIterator[str]:
+        """Like complete(), but yield the message text piece by piece as the model generates it.
+
+        A cached response is yielded in one piece. Closing the generator early closes
+        the HTTP stream, which makes the server abort the generation; only complete
+        responses are stored in the cache.
+
+        The stream is read by a separate task into an unbounded buffer (at most
+        `max_tokens` pieces), so the scheduler slot is held only while the model
+        generates, never while a slow consumer has not taken the pieces yet.
+        """
+        if cache is None:
+            cache = temperature == 0.0
+        key = None
+        if cache:
+            key = LLMResponseCache.make_key(Config.LLM_MODEL, messages, temperature, max_tokens, **params)
+            cached = await asyncio.to_thread(self.response_cache.get, key)
+            if cached is not None:
+                yield cached
+                return
+
+        deltas = asyncio.Queue()
+        done = object()
+
+        async def read_stream():
+            async with self.scheduler.slot(self.priority if priority is None else priority):
+                stream = await self.client.chat.completions.create(
+                    model=Config.LLM_MODEL,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    **params
+                )
+                try:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            deltas.put_nowait(delta)
+                finally:
+                    await stream.close()
+
+        reader = asyncio.create_task(read_stream())
+        reader.add_done_callback(lambda _: deltas.put_nowait(done))
+        parts = []
+        try:
+            while (delta := await deltas.get()) is not done:
+                parts.append(delta)
+                yield delta
+            # Raises the reader's error, if any
+            await reader
+        finally:
+            if not reader.done():
+                reader.cancel()
+
+        if key is not None:
+            await asyncio.to_thread(self.response_cache.put, key, Config.LLM_MODEL, "".join(parts))
+
+    async def compress_chunk(
+        self,
+        chunk: str,
+        max_tokens: int,
+        planner: Optional[CompressionPlanner] = None,
+        stats: Optional[CompressionStats] = None
+    ) -> str:
+        """Bring `chunk` under `max_tokens` with at most one LLM call (see CompressionPlanner)."""
+        planner = planner or CompressionPlanner(self.context_manager)
+        stats = stats if stats is not None else CompressionStats()
+        max_tokens = int(max_tokens)
+        tokens = self.context_manager.count_tokens(chunk)
+        stats.chunks += 1
+        stats.tokens_before += tokens
+        if tokens > max_tokens:
+            if not planner.needs_llm(tokens, max_tokens):
+                chunk = await asyncio.to_thread(planner.extractive_trim, chunk, max_tokens)
+                stats.extractive += 1
+            else:
+                input_tokens = int(max_tokens * planner.abstractive_input_ratio)
+                if tokens > input_tokens:
+                    chunk = await asyncio.to_thread(planner.extractive_trim, chunk, input_tokens)
+                    stats.extractive += 1
+                messages = [
+                    {"role": "system", "content": """Кратко обобщите ключевую туристическую информацию, включая:
 - климат и погодные условия
 - экологическую обстановку
 - температуру воды (если есть водоемы)
@@ -47,73 +474,58 @@ class LLMService:
 - исторические объекты
 - транспортную доступность
 Сохраняйте только самую важную информацию для туристов."""},
-            {"role": "user", "content": chunk}
-        ]
-            response = await self.client.chat.completions.create(
-                model=Config.LLM_MODEL,
-                messages=messages,
-                temperature=0.0,
-                max_tokens=max_tokens
-            )
-            chunk = response.choices[0].message.content
+                    {"role": "user", "content": chunk}
+                ]
+                stats.llm_calls += 1
+                stats.llm_input_tokens += self.context_manager.count_tokens(chunk)
+                chunk = await self.complete(messages, max_tokens)
+                stats.llm_output_tokens += self.context_manager.count_tokens(chunk)
+            if self.context_manager.count_tokens(chunk) > max_tokens:
+                chunk = planner.truncate(chunk, max_tokens)
+                stats.truncations += 1
+        stats.tokens_after += self.context_manager.count_tokens(chunk)
         return chunk
 
-    async def merge_summaries(self, summaries: List[str], city: str, max_tokens: int) -> str:
-        combined = f"Информация о {city}:\n" + "\n".join(summaries)
-
-        if self.context_manager.count_tokens(combined) <= max_tokens:
-            return combined
-
-        messages = [
-            {"role": "system", "content": """Объедините информацию в связное описание места, фокусируясь на:
-    - главных достопримечательностях
-    - климате и сезонности посещения
-    - транспортной инфраструктуре
-    - уникальных особенностях места
-    - практических советах для туристов
-    Информация должна быть полезной для планирования поездки."""},
-            {"role": "user", "content": combined}
-        ]
-        response = await self.client.chat.completions.create(
-            model=Config.LLM_MODEL,
-            messages=messages,
-            temperature=0.0,
-            max_tokens=max_tokens
-        )
-        return response.choices[0].message.content
-
-    async def prepare_rag_documents(self, 
-                                  cities_chunks: Dict[str, List[str]], 
-                                  user_preferences: str) -> List[dict]:
+    async def prepare_rag_documents(self,
+                                  cities_chunks: Dict[str, List[str]],
+                                  user_preferences: str,
+                                  embed_batch=None,
+                                  stats: Optional[CompressionStats] = None) -> List[dict]:
+        """Compress every city's chunks into one document per city within the context budget.
+
+        Budgets are computed once up front and each chunk gets at most one LLM call;
+        with `embed_batch` (e.g. EmbeddingService.get_embeddings_batch) extractive
+        trimming keeps the sentences closest to the preferences. The calls and tokens
+        spent are accumulated into `stats` and printed.
+        """
+        stats = stats if stats is not None else CompressionStats()
         available_tokens = self.context_manager.get_available_tokens(user_preferences, is_rag=True)
 
         # Reserve tokens for system messages and final response
         working_tokens = available_tokens - self.max_final_response_tokens
         tokens_per_city = working_tokens // len(cities_chunks)
+        chunk_budgets = CompressionPlanner.budgets(cities_chunks, working_tokens)
+        planner = await asyncio.to_thread(CompressionPlanner, self.context_manager, embed_batch, user_preferences)
+
+        # Count every chunk in one tokenizer call; compress_chunk then hits the cache
+        self.context_manager.count_tokens_batch([chunk for chunks in cities_chunks.values() for chunk in chunks])
 
-        final_documents = []
+        budget = DocumentBudget(self.context_manager)
         doc_id = 0
 
         for city, chunks in cities_chunks.items():
             try:
-                # First stage: compress individual chunks
-                tokens_per_chunk = tokens_per_city // (len(chunks) or 1)
                 compressed_chunks = await asyncio.gather(
-                    *[self.compress_chunk(chunk, tokens_per_chunk) for chunk in chunks]
+                    *[self.compress_chunk(chunk, chunk_budgets[city], planner, stats) for chunk in chunks]
                 )
 
-                # Second stage: merge compressed chunks for each city
-                city_summary = await self.merge_summaries(
-                    compressed_chunks, 
-                    city, 
-                    tokens_per_city
-                )
-
-                # Final compression if still needed
+                # The chunks fit their budgets, so the merged text only overflows by the header
+                city_summary = f"Информация о {city}:\n" + "\n".join(compressed_chunks)
                 if self.context_manager.count_tokens(city_summary) > tokens_per_city:
-                    city_summary = await self.compress_chunk(city_summary, tokens_per_city)
+                    city_summary = planner.truncate(city_summary, tokens_per_city)
+                    stats.truncations += 1
 
-                final_documents.append({
+                budget.add({
                     "doc_id": doc_id,
                     "title": city,
                     "content": city_summary
@@ -124,41 +536,60 @@ class LLMService:
                 print(f"Error processing city {city}: {e}")
                 continue
 
-        # Final safety check
-        total_tokens = sum(self.context_manager.count_tokens(doc["content"]) 
-                          for doc in final_documents)
-
-        if total_tokens > working_tokens:
-            # Emergency compression of all documents
-            compressed_docs = []
-            new_tokens_per_city = working_tokens // len(final_documents)
-
-            for doc in final_documents:
-                compressed_content = await self.compress_chunk(
-                    doc["content"], 
-                    new_tokens_per_city
-                )
-                compressed_docs.append({
-                    "doc_id": doc["doc_id"],
-                    "title": doc["title"],
-                    "content": compressed_content
-                })
-            final_documents = compressed_docs
-
-        return final_documents
+        print(f"RAG compression: {stats}")
+        return budget.documents
 
     async def get_preferences(self, user_input: str) -> str:
         max_tokens = self.max_summary_tokens
-        response = await self.client.chat.completions.create(
-            model=Config.LLM_MODEL,
-            messages=[
-                {"role": "system", "content": Config.SYSTEM_PROMPT},
+        return await self.complete([
+            {"role": "system", "content": Config.SYSTEM_PROMPT},
+            {"role": "user", "content": user_input}
+        ], max_tokens)
+
+    async def extract_request_profile(
+        self,
+        user_input: str,
+        activity_hint: Optional[str] = None,
+        season_hint: Optional[str] = None
+    ) -> RequestProfile:
+        """Extract preferences, activity, season, temperature and budget in one schema-constrained call.
+
+        Hints come from the rule-based extractors and are only suggestions to the model.
+        Raises ValueError when the response does not match the schema.
+        """
+        system_prompt = Config.STRUCTURED_SYSTEM_PROMPT
+        hints = [f"{name}: {value}" for name, value in (('activity', activity_hint), ('season', season_hint)) if value]
+        if hints:
+            system_prompt += "\n\nПо ключевым словам запроса предварительно определено: " + ", ".join(hints)
+
+        response = await self.complete(
+            [
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_input}
             ],
-            temperature=0.0,
-            max_tokens=max_tokens
+            self.max_summary_tokens,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "request_profile", "schema": REQUEST_PROFILE_SCHEMA, "strict": True}
+            }
+        )
+        try:
+            data = json.loads(response)
+        except (TypeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Structured extraction returned invalid JSON: {response!r}") from e
+        if not isinstance(data, dict) or not isinstance(data.get("preferences"), str) or not data["preferences"].strip():
+            raise ValueError(f"Structured extraction returned no preferences: {response!r}")
+
+        def number(value) -> Optional[float]:
+            return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+        return RequestProfile(
+            preferences=data["preferences"].strip(),
+            activity=data.get("activity") if data.get("activity") in ACTIVITIES else None,
+            season=data.get("season") if data.get("season") in SEASONS else None,
+            temperature=number(data.get("temperature")),
+            budget=number(data.get("budget"))
         )
-        return response.choices[0].message.content
 
     async def extract_season_llm(self, text: str) -> Optional[str]:
         """Extract season using LLM when rule-based methods fail"""
@@ -168,16 +599,11 @@ class LLMService:
         Отвечайте одним словом - названием сезона на английском или null."""
         
         try:
-            response = await self.client.chat.completions.create(
-                model=Config.LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": text}
-                ],
-                temperature=0.0,
-                max_tokens=10
-            )
-            season = response.choices[0].message.content.strip().lower()
+            response = await self.complete([
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": text}
+            ], max_tokens=10)
+            season = response.strip().lower()
             return season if season in SEASONS else None
         except Exception as e:
             print(f"Error in LLM season extraction: {e}")
@@ -196,16 +622,10 @@ class LLMService:
     async def extract_activity_llm(self, text: str, prompt: str) -> str:
         """Extract activity type using LLM"""
         try:
-            response = await self.client.chat.completions.create(
-                model=Config.LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": text}
-                ],
-                temperature=0.0,
-                max_tokens=10
-            )
-            return response.choices[0].message.content
+            return await self.complete([
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": text}
+            ], max_tokens=10)
         except Exception as e:
             print(f"Error in LLM activity extraction: {e}")
             return "null"
@@ -213,25 +633,16 @@ class LLMService:
     async def get_rag_response(self, user_preferences: str, documents: List[dict]) -> Tuple[str, str]:
         # Calculate available tokens for responses
         available_tokens = self.context_manager.get_available_tokens(user_preferences, is_rag=True)
-        docs_content = json.dumps(documents, ensure_ascii=False)
-        docs_tokens = self.context_manager.count_tokens(docs_content)
+        budget = DocumentBudget(self.context_manager, documents)
 
-        if docs_tokens > available_tokens * 0.7:  # Leave 30% for responses
+        if budget.json_tokens > available_tokens * 0.7:  # Leave 30% for responses
             # Emergency compression of all documents
-            compressed_docs = []
-            max_tokens_per_doc = (available_tokens * 0.7) // len(documents)
+            max_tokens_per_doc = (available_tokens * 0.7) // len(budget)
 
-            for doc in documents:
-                compressed_content = await self.compress_chunk(
-                    doc["content"], 
-                    max_tokens_per_doc
-                )
-                compressed_docs.append({
-                    "doc_id": doc["doc_id"],
-                    "title": doc["title"],
-                    "content": compressed_content
-                })
-            documents = compressed_docs
+            for i, doc in enumerate(budget.documents):
+                if budget.content_tokens_of(i) > max_tokens_per_doc:
+                    budget.replace_content(i, await self.compress_chunk(doc["content"], max_tokens_per_doc))
+            documents = budget.documents
 
         messages = [
             {'role': 'system', 'content': Config.GROUNDED_SYSTEM_PROMPT},
@@ -241,19 +652,13 @@ class LLMService:
         doc_message = {'role': 'user', 'content': f"Available information:\n{json.dumps(documents, ensure_ascii=False)}"}
 
         # Get relevant docs with limited tokens
-        response = await self.client.chat.completions.create(
-            model=Config.LLM_MODEL,
-            messages=messages + [doc_message],
-            temperature=0.0,
-            max_tokens=self.max_summary_tokens
-        )
-        relevant_docs = response.choices[0].message.content
+        relevant_docs = await self.complete(messages + [doc_message], self.max_summary_tokens)
 
         # Get final answer with remaining tokens
-        final_response = await self.client.chat.completions.create(
-            model=Config.LLM_MODEL,
-            messages=messages + [doc_message, {'role': 'assistant', 'content': relevant_docs}],
-            temperature=0.3,
-            max_tokens=self.max_final_response_tokens
+        # Sampled at temperature 0.3, so it bypasses the response cache
+        final_response = await self.complete(
+            messages + [doc_message, {'role': 'assistant', 'content': relevant_docs}],
+            self.max_final_response_tokens,
+            temperature=0.3
         )
-        return relevant_docs, final_response.choices[0].message.content
+        return relevant_docs, final_response
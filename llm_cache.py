@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import Config
+
+class LLMResponseCache:
+    """Persistent cache of chat completion responses in SQLite.
+
+    Entries are content-addressed by a sha256 over the model, messages, temperature,
+    max_tokens and any other sampling parameters, so a changed prompt never hits a
+    stale answer. Each hit refreshes the entry's last-used time; when the cache grows
+    past `max_entries` or `max_bytes` the least recently used entries are evicted,
+    down to `EVICT_TO` of both limits so that eviction runs rarely.
+    Hit/miss counters are kept per process and accumulated in the database.
+
+    Entry count and size are tracked in memory, so a put costs a couple of primary
+    key lookups. Last-used times and counters of hits are buffered and written with
+    the next put, every `FLUSH_EVERY` lookups, or on stats(). All methods block on
+    SQLite; async callers run them in a thread (see LLMService.complete).
+    """
+
+    EVICT_TO = 0.9
+    FLUSH_EVERY = 64
+
+    def __init__(
+        self,
+        path: str = Config.LLM_CACHE_FILE,
+        max_entries: int = Config.LLM_CACHE_MAX_ENTRIES,
+        max_bytes: int = Config.LLM_CACHE_MAX_BYTES
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        # Buffered writes: key -> last_used, and counter deltas
+        self._touched: Dict[str, float] = {}
+        self._pending_counts = {'hits': 0, 'misses': 0}
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._load_totals()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # One connection per process: SQLite connections must not be used across a fork
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _load_totals(self):
+        # Other processes write to the same file, so the totals are re-read before evicting
+        self._entries, self._bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    @staticmethod
+    def make_key(model: str, messages: List[dict], temperature: float, max_tokens: int, **params) -> str:
+        payload = json.dumps(
+            {
+                'model': model,
+                'messages': messages,
+                'temperature': temperature,
+                'max_tokens': max_tokens,
+                'params': params
+            },
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _flush(self):
+        """Write the buffered last-used times and counter deltas in one transaction."""
+        if not self._touched and not any(self._pending_counts.values()):
+            return
+        db = self._db
+        db.execute("BEGIN")
+        try:
+            db.executemany(
+                "UPDATE responses SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._touched.items()]
+            )
+            db.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                [(name, value) for name, value in self._pending_counts.items() if value]
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        self._touched.clear()
+        self._pending_counts = {'hits': 0, 'misses': 0}
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                self._pending_counts['misses'] += 1
+            else:
+                self.hits += 1
+                self._pending_counts['hits'] += 1
+                self._touched[key] = time.time()
+            if sum(self._pending_counts.values()) >= self.FLUSH_EVERY:
+                self._flush()
+            return None if row is None else row[0]
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._touched.pop(key, None)
+            previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now)
+            )
+            if previous is None:
+                self._entries += 1
+                self._bytes += size
+            else:
+                self._bytes += size - previous[0]
+            self._flush()
+            if self._entries > self.max_entries or self._bytes > self.max_bytes:
+                self._load_totals()
+                if self._entries > self.max_entries or self._bytes > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until both limits are EVICT_TO below their maximum."""
+        excess_entries = max(0, self._entries - int(self.max_entries * self.EVICT_TO))
+        excess_bytes = max(0, self._bytes - int(self.max_bytes * self.EVICT_TO))
+        evicted, evicted_bytes = [], 0
+        # Walks the last_used index from the oldest entry, reading only the rows it drops
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if len(evicted) >= excess_entries and evicted_bytes >= excess_bytes:
+                break
+            evicted.append((key,))
+            evicted_bytes += size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._entries -= len(evicted)
+        self._bytes -= evicted_bytes
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """Process and cumulative hit rates together with the current cache size."""
+        with self._lock:
+            self._flush()
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            counters = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+        total_hits, total_misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {
+            'entries': entries,
+            'bytes': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'total_hits': total_hits,
+            'total_misses': total_misses,
+            'total_hit_rate': total_hits / (total_hits + total_misses) if total_hits + total_misses else 0.0
+        }
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.execute("DELETE FROM counters")
+            self._touched.clear()
+            self._pending_counts = {'hits': 0, 'misses': 0}
+            self._entries = self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+if __name__ == "__main__":
+    # Usage: python llm_cache.py [stats|clear]
+    cache = LLMResponseCache()
+    if len(sys.argv) > 1 and sys.argv[1] == 'clear':
+        cache.clear()
+        print(f"Cleared {cache.path}")
+    else:
+        stats = cache.stats()
+        print(f"{stats['entries']} responses, {stats['bytes'] / 1024:.1f} KiB in {cache.path}")
+        print(f"hit rate: {stats['total_hit_rate']:.1%} "
+              f"({stats['total_hits']} hits, {stats['total_misses']} misses)")
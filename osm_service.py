@@ -23,6 +23,7 @@ class OSMService:
     def __init__(self, use_cache=True):
         self.use_cache = use_cache
         self.cache = {}
+        self.session: Optional[aiohttp.ClientSession] = None
         self.overpass_url = "https://overpass-api.de/api/interpreter"
         self.categories = {
             "tourist_attractions": [
@@ -52,34 +53,16 @@ class OSMService:
             self._load_cache()
 
     def _load_cache(self):
-        """Load POI data from cache file if it exists"""
+        """Use the process-wide POI store built from the cache file, if there is one"""
+        # Imported here because poi_store builds the POIData / CityPOIs defined above
+        from poi_store import POIStore
         try:
-            with open('poi_cache.json', 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-                
-            # Convert cached data back to POIData objects
-            for city, data in cache_data.items():
-                self.cache[city] = CityPOIs(
-                    tourist_attractions=[
-                        POIData(**poi_data)
-                        for poi_data in data['tourist_attractions']
-                    ],
-                    beaches=[
-                        POIData(**poi_data)
-                        for poi_data in data['beaches']
-                    ],
-                    entertainment=[
-                        POIData(**poi_data)
-                        for poi_data in data['entertainment']
-                    ],
-                    sports_facilities=[
-                        POIData(**poi_data)
-                        for poi_data in data['sports_facilities']
-                    ]
-                )
+            store = POIStore.shared()
+            if store is None:
+                print("Cache file not found. Will fetch data from API.")
+                return
+            self.cache = store
             print(f"Loaded POI cache with data for {len(self.cache)} cities")
-        except FileNotFoundError:
-            print("Cache file not found. Will fetch data from API.")
         except Exception as e:
             print(f"Error loading cache: {str(e)}")
 
@@ -133,25 +116,48 @@ class OSMService:
             print(f"Exception fetching {category} POIs for {city}: {str(e)}")
             return []
 
+    def get_cached_pois(self, city: str) -> Optional[CityPOIs]:
+        """Get POIs for a city from the cache only, without touching the API"""
+        return self.cache.get(city)
+
+    async def start(self):
+        """Keep one HTTP session and its connection pool for all requests.
+
+        Only call this from a long-lived event loop; without it every API lookup
+        opens its own short-lived session.
+        """
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
     async def get_city_pois(self, city: str) -> CityPOIs:
         """Get all POIs for a city"""
         if self.use_cache and city in self.cache:
             return self.cache[city]
         
         # Fallback to API if cache is not available or not being used
+        if self.session is not None:
+            return await self._fetch_city_pois(self.session, city)
         async with aiohttp.ClientSession() as session:
-            tasks = []
-            for category in self.categories.keys():
-                tasks.append(self._fetch_pois(session, city, category))
-            
-            results = await asyncio.gather(*tasks)
-            
-            return CityPOIs(
-                tourist_attractions=results[0],
-                beaches=results[1],
-                entertainment=results[2],
-                sports_facilities=results[3]
-            )
+            return await self._fetch_city_pois(session, city)
+
+    async def _fetch_city_pois(self, session: aiohttp.ClientSession, city: str) -> CityPOIs:
+        tasks = []
+        for category in self.categories.keys():
+            tasks.append(self._fetch_pois(session, city, category))
+        
+        results = await asyncio.gather(*tasks)
+        
+        return CityPOIs(
+            tourist_attractions=results[0],
+            beaches=results[1],
+            entertainment=results[2],
+            sports_facilities=results[3]
+        )
 
     def format_poi_description(self, pois: CityPOIs) -> str:
         """Format POIs into a readable description"""
@@ -0,0 +1,165 @@
+import functools
+import hashlib
+import json
+import os
+import sys
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from config import Config
+from osm_service import CityPOIs, POIData
+
+# CityPOIs fields, in the column order of the offsets table
+CATEGORIES = ['tourist_attractions', 'beaches', 'entertainment', 'sports_facilities']
+# Columns of the records table; each holds a string id, -1 for None
+NAME, TYPE, CATEGORY, DESCRIPTION = range(4)
+
+class StringTable:
+    """Unique strings stored as one UTF-8 blob with end offsets, decoded on first use."""
+
+    def __init__(self, data: np.ndarray, ends: np.ndarray):
+        self.data = data
+        self.ends = ends
+        self._decoded: List[Optional[str]] = [None] * len(ends)
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if i < 0:
+            return None
+        text = self._decoded[i]
+        if text is None:
+            start = self.ends[i - 1] if i else 0
+            text = self._decoded[i] = self.data[start:self.ends[i]].tobytes().decode('utf-8')
+        return text
+
+    @staticmethod
+    def encode(strings: List[str]) -> Dict[str, np.ndarray]:
+        encoded = [text.encode('utf-8') for text in strings]
+        return {
+            'string_data': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            'string_ends': np.cumsum([len(text) for text in encoded], dtype=np.int64)
+        }
+
+class POIStore(Mapping):
+    """Columnar copy of poi_cache.json: a string table plus int32 arrays.
+
+    Stored as poi_store/<content hash of the cache file>.npz with
+      records       (n, 4)                  string ids of name, type, category, description
+      city_offsets  (cities, categories+1)  row ranges of each city's categories in `records`
+      string_data / string_ends             the string table
+    and a .json listing the cities. Cities behave like the dict of CityPOIs that
+    OSMService used to build; each city's CityPOIs is materialized on first access
+    and then shared by every OSMService of the process (see `shared`).
+    """
+
+    def __init__(self, path: Path, content_hash: str):
+        self.content_hash = content_hash
+        with open(path.with_suffix('.json'), 'r', encoding='utf-8') as f:
+            self.cities: List[str] = json.load(f)['cities']
+        with np.load(path.with_suffix('.npz')) as arrays:
+            self.records = arrays['records']
+            self.city_offsets = arrays['city_offsets']
+            self.strings = StringTable(arrays['string_data'], arrays['string_ends'])
+        self.city_rows = {city: i for i, city in enumerate(self.cities)}
+        self._materialized: Dict[str, CityPOIs] = {}
+
+    def __getitem__(self, city: str) -> CityPOIs:
+        pois = self._materialized.get(city)
+        if pois is None:
+            pois = self._materialized[city] = self._materialize(self.city_rows[city])
+        return pois
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.cities)
+
+    def __len__(self) -> int:
+        return len(self.cities)
+
+    def _materialize(self, row: int) -> CityPOIs:
+        offsets = self.city_offsets[row]
+        strings = self.strings
+        return CityPOIs(**{
+            category: [
+                POIData(strings[name], strings[poi_type], strings[poi_category], strings[description])
+                for name, poi_type, poi_category, description in self.records[offsets[i]:offsets[i + 1]].tolist()
+            ]
+            for i, category in enumerate(CATEGORIES)
+        })
+
+    @classmethod
+    def load(cls, cache_file: str = Config.POI_CACHE_FILE, store_dir: str = Config.POI_STORE_DIR) -> Optional['POIStore']:
+        """Open the store for the current cache file, converting it first if needed; None without a cache file."""
+        try:
+            with open(cache_file, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        content_hash = hashlib.sha1(raw).hexdigest()[:16]
+        store_dir = Path(store_dir)
+        path = store_dir / content_hash
+
+        if not path.with_suffix('.npz').exists() or not path.with_suffix('.json').exists():
+            cls._build(json.loads(raw.decode('utf-8')), store_dir, content_hash)
+        return cls(path, content_hash)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def shared(cache_file: str = Config.POI_CACHE_FILE, store_dir: str = Config.POI_STORE_DIR) -> Optional['POIStore']:
+        """The store of the process, loaded by the first caller."""
+        return POIStore.load(cache_file, store_dir)
+
+    @staticmethod
+    def _build(poi_cache: dict, store_dir: Path, content_hash: str):
+        string_ids: Dict[str, int] = {}
+
+        def string_id(text: Optional[str]) -> int:
+            return -1 if text is None else string_ids.setdefault(text, len(string_ids))
+
+        records, city_offsets = [], []
+        for data in poi_cache.values():
+            offsets = [len(records)]
+            for category in CATEGORIES:
+                for poi in data[category]:
+                    records.append((
+                        string_id(poi['name']),
+                        string_id(poi['type']),
+                        string_id(poi['category']),
+                        string_id(poi.get('description'))
+                    ))
+                offsets.append(len(records))
+            city_offsets.append(offsets)
+        print(f"Converting POI cache: {len(poi_cache)} cities, {len(records)} POIs, {len(string_ids)} strings")
+
+        # Write both files under temporary names first, the .npz rename makes the version visible
+        store_dir.mkdir(parents=True, exist_ok=True)
+        path = store_dir / content_hash
+        with open(path.with_suffix('.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump({'cities': list(poi_cache)}, f, ensure_ascii=False)
+        with open(path.with_suffix('.npz.tmp'), 'wb') as f:
+            np.savez(
+                f,
+                records=np.array(records, dtype=np.int32).reshape(-1, 4),
+                city_offsets=np.array(city_offsets, dtype=np.int32).reshape(-1, len(CATEGORIES) + 1),
+                **StringTable.encode(list(string_ids))
+            )
+        os.replace(path.with_suffix('.json.tmp'), path.with_suffix('.json'))
+        os.replace(path.with_suffix('.npz.tmp'), path.with_suffix('.npz'))
+
+        # Versions of older cache files are not needed anymore
+        for old in store_dir.glob('*.npz'):
+            if old.stem != content_hash:
+                old.unlink(missing_ok=True)
+                old.with_suffix('.json').unlink(missing_ok=True)
+
+if __name__ == "__main__":
+    # Usage: python poi_store.py [poi_cache.json]  (after fetch_pois.py; otherwise done on first load)
+    store = POIStore.load(*sys.argv[1:2])
+    if store is None:
+        print("POI cache file not found")
+    else:
+        print(f"POI store {store.content_hash}: {len(store)} cities, {len(store.records)} POIs, {len(store.strings)} strings")
@@ -1,5 +1,7 @@
 from typing import Dict, List, Tuple, Optional
 
+from keyword_matcher import KEYWORDS, KeywordHits
+
 SEASONS = {
     'winter': {
         'months': [12, 1, 2],
@@ -29,6 +31,9 @@ MONTH_MAPPING = {
     'сентябр': 9, 'октябр': 10, 'ноябр': 11, 'декабр': 12
 }
 
+KEYWORDS.add_groups({('season', season): data['keywords'] for season, data in SEASONS.items()})
+KEYWORDS.add_groups({('month', month_key): [month_key] for month_key in MONTH_MAPPING})
+
 def get_season_from_month(month: int) -> Optional[str]:
     """Get season name from month number"""
     for season, data in SEASONS.items():
@@ -36,23 +41,23 @@ def get_season_from_month(month: int) -> Optional[str]:
             return season
     return None
 
-def get_season_from_keywords(text: str) -> Optional[str]:
+def get_season_from_keywords(text: str, hits: Optional[KeywordHits] = None) -> Optional[str]:
     """Get season from seasonal keywords in text"""
-    text = text.lower()
-    for season, data in SEASONS.items():
-        if any(keyword in text for keyword in data['keywords']):
+    hits = hits or KEYWORDS.scan(text)
+    for season in SEASONS:
+        if hits.any(('season', season)):
             return season
     return None
 
-def get_season_from_text(text: str) -> Optional[str]:
+def get_season_from_text(text: str, hits: Optional[KeywordHits] = None) -> Optional[str]:
     """Try to determine season from text using month names or keywords"""
+    hits = hits or KEYWORDS.scan(text)
     # First try to find month
-    text = text.lower()
     for month_key, month_num in MONTH_MAPPING.items():
-        if month_key in text:
+        if hits.any(('month', month_key)):
             season = get_season_from_month(month_num)
             if season:
                 return season
     
     # If no month found, try keywords
-    return get_season_from_keywords(text)
+    return get_season_from_keywords(text, hits)
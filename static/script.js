@@ -46,6 +46,68 @@ document.addEventListener('DOMContentLoaded', function() {
         return loadingDiv;
     }
 
+    function createCityCard(city) {
+        const cityDiv = document.createElement('div');
+        cityDiv.className = 'city-recommendation';
+        cityDiv.innerHTML = `
+            <div class="city-header">
+                <h3>🏆 ${city.name}</h3>
+            </div>
+            <div class="city-content">
+                <p>${city.score}</p>
+                <p class="city-facts pending">📚 Подбираем интересные факты...</p>
+                ${city.climate ? `<p>${city.climate}</p>` : ''}
+            </div>
+        `;
+        return cityDiv;
+    }
+
+    // Render one NDJSON event from /ask/stream into the response message
+    function renderEvent(event, view) {
+        if (event.type === 'preferences') {
+            const preferencesDiv = document.createElement('div');
+            preferencesDiv.className = 'preferences';
+            preferencesDiv.innerHTML = event.html;
+            view.message.appendChild(preferencesDiv);
+        } else if (event.type === 'cities') {
+            event.cities.forEach(city => {
+                const cityDiv = createCityCard(city);
+                view.cities[city.name] = cityDiv;
+                view.message.appendChild(cityDiv);
+            });
+        } else if (event.type === 'facts_delta') {
+            // Show the summary while it is being generated, as plain text
+            const cityDiv = view.cities[event.city];
+            if (cityDiv) {
+                const factsP = cityDiv.querySelector('.city-facts');
+                if (factsP.classList.contains('pending')) {
+                    factsP.classList.remove('pending');
+                    factsP.textContent = '📚 ';
+                }
+                factsP.textContent += event.text;
+            }
+        } else if (event.type === 'facts') {
+            const cityDiv = view.cities[event.city];
+            if (cityDiv) {
+                // The finished summary replaces the streamed text with the formatted list
+                const factsP = cityDiv.querySelector('.city-facts');
+                factsP.classList.remove('pending');
+                factsP.innerHTML = event.html;
+            }
+        } else if (event.type === 'done') {
+            // Cities without any facts keep no placeholder
+            view.message.querySelectorAll('.city-facts.pending').forEach(p => p.remove());
+            if (Object.keys(view.cities).length === 0) {
+                const emptyP = document.createElement('p');
+                emptyP.textContent = 'Не удалось обработать запрос';
+                view.message.appendChild(emptyP);
+            }
+        } else if (event.type === 'error') {
+            throw new Error(event.message);
+        }
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
     async function sendMessage() {
         const message = userInput.value.trim();
         if (!message) return;
@@ -58,10 +120,11 @@ document.addEventListener('DOMContentLoaded', function() {
         addMessage(message, 'user');
 
         // Add loading indicator
-        const loadingMessage = addLoadingMessage();
+        let loadingMessage = addLoadingMessage();
+        const view = { message: null, cities: {} };
 
         try {
-            const response = await fetch('/ask', {
+            const response = await fetch('/ask/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -69,20 +132,43 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({ message: message })
             });
 
-            // Remove loading indicator
-            loadingMessage.remove();
-
             if (!response.ok) {
                 throw new Error('Network response was not ok');
             }
 
-            const data = await response.json();
-            addMessage(data, 'response');
+            // Read NDJSON events as they arrive and render each one immediately
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    if (!view.message) {
+                        // First content replaces the loading indicator, which moves below it
+                        view.message = document.createElement('div');
+                        view.message.className = 'message response';
+                        chatMessages.insertBefore(view.message, loadingMessage);
+                    }
+                    const event = JSON.parse(line);
+                    renderEvent(event, view);
+                    if (event.type === 'done' && loadingMessage) {
+                        loadingMessage.remove();
+                        loadingMessage = null;
+                    }
+                }
+                if (done) break;
+            }
         } catch (error) {
-            loadingMessage.remove();
             addMessage('Произошла ошибка при обработке запроса. Пожалуйста, попробуйте еще раз.', 'error');
             console.error('Error:', error);
         } finally {
+            if (loadingMessage) loadingMessage.remove();
+
             // Clear and re-enable input
             userInput.value = '';
             userInput.disabled = false;
@@ -1,67 +1,70 @@
 import re
 from typing import Optional, Tuple
 
+def normalize_temp_value(temp_str: str) -> Optional[float]:
+    """Normalize temperature value handling various formats"""
+    temp_str = temp_str.replace(',', '.').strip()
+    try:
+        temp = float(temp_str)
+        # Handle common data entry errors
+        if temp > 100:  # Likely missing decimal point
+            temp = temp / 10
+        if temp > 50:  # Still too high after division
+            temp = temp / 10
+        if -60 <= temp <= 50:
+            return int(temp)  # Truncate decimal part
+        return None
+    except ValueError:
+        return None
+
+_NUMBER = r'-?\d+[.,]?\d*'
+_UNIT = r'\s*(?:°|градус|c°|°c)'
+_MONTHS = r'январ|феврал|март|апрел|май|июн|июл|август|сентябр|октябр|ноябр|декабр'
+
+# Patterns in priority order: the range comes from the first one that matches
+TEMPERATURE_PATTERNS = [re.compile(pattern) for pattern in [
+    # Range: "от -5 до +2°C"
+    rf'от\s*({_NUMBER})\s*до\s*({_NUMBER}){_UNIT}',
+    # Month: "в январе -5°C", "июля — +25,5°C"
+    rf'(?:{_MONTHS})[а-я]*\s*[-—]?\s*(?:плюс\s*)?({_NUMBER}){_UNIT}',
+    # Simple range: "-5...+2°C"
+    rf'({_NUMBER})\.\.\.({_NUMBER}){_UNIT}',
+    # Average temperature: "средняя температура +15°C"
+    rf'средн[а-я]*\s*температур[а-я]*\s*[-—]?\s*(?:плюс\s*)?({_NUMBER}){_UNIT}',
+    # Temperature with plus/minus: "температура +34,7°C"
+    rf'температур[а-я]*\s*[-—]?\s*(?:плюс\s*)?({_NUMBER}){_UNIT}',
+    # Explicit plus: "плюс 25 градусов"
+    rf'плюс\s*({_NUMBER}){_UNIT}',
+]]
+# Explicit minus: "минус 5 градусов", the value is negated
+MINUS_PATTERN = re.compile(rf'минус\s*(\d+[.,]?\d*){_UNIT}')
+
+# Every pattern requires a unit, texts without one are skipped without scanning
+_HAS_UNIT = re.compile(r'°|градус', re.IGNORECASE)
+
+MONTH_NUMBERS = {stem: i + 1 for i, stem in enumerate(_MONTHS.split('|'))}
+
+# Temperature values in free text, for normalize_temperature_text. Longer unit spellings
+# come first so "25°C" and "25 градусов" are replaced whole
+TEMPERATURE_VALUE = re.compile(r'(-?\d+)\s*(?:°\s*[cс]|[cс]°|градус[а-я]*|°)', re.IGNORECASE)
+
 def extract_and_normalize_temperature(text: str) -> Optional[Tuple[float, float]]:
     """
     Extract and normalize temperature values from text.
     Returns (min_temp, max_temp) if found, None otherwise.
     """
+    if not _HAS_UNIT.search(text):
+        return None
     text = text.lower()
-    
-    def normalize_temp_value(temp_str: str) -> Optional[float]:
-        """Normalize temperature value handling various formats"""
-        temp_str = temp_str.replace(',', '.').strip()
-        try:
-            temp = float(temp_str)
-            # Handle common data entry errors
-            if temp > 100:  # Likely missing decimal point
-                temp = temp / 10
-            if temp > 50:  # Still too high after division
-                temp = temp / 10
-            if -60 <= temp <= 50:
-                return int(temp)  # Truncate decimal part
-            return None
-        except ValueError:
-            return None
-    
-    # Common patterns for temperature ranges
-    patterns = [
-        # Range pattern: "от -5 до +2°C"
-        r'от\s*(-?\d+[.,]?\d*)\s*до\s*(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
-        # Single value with month: "в январе -5°C"
-        r'(?:январ|феврал|март|апрел|май|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*\s*[-—]?\s*(?:плюс\s*)?(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
-        # Simple range: "-5...+2°C"
-        r'(-?\d+[.,]?\d*)\.\.\.(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
-        # Average temperature: "средняя температура +15°C"
-        r'средн[а-я]*\s*температур[а-я]*\s*[-—]?\s*(?:плюс\s*)?(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
-        # Temperature with plus/minus: "температура +34,7°C"
-        r'температур[а-я]*\s*[-—]?\s*(?:плюс\s*)?(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
-        # Month temperature: "июля — +25,5°C"
-        r'(?:январ|феврал|март|апрел|май|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*\s*[-—]\s*(?:плюс\s*)?(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
-        # Temperature with explicit plus: "плюс 25 градусов"
-        r'плюс\s*(-?\d+[.,]?\d*)\s*(?:°|градус|c°|°c)',
-        # Temperature with minus: "минус 5 градусов"
-        r'минус\s*(\d+[.,]?\d*)\s*(?:°|градус|c°|°c)'
-    ]
-    
-    for pattern in patterns:
-        matches = re.finditer(pattern, text)
+    for pattern, sign in [(pattern, 1) for pattern in TEMPERATURE_PATTERNS] + [(MINUS_PATTERN, -1)]:
         temps = []
-        for match in matches:
-            groups = match.groups()
-            for temp_str in groups:
-                if temp_str:
-                    # Normalize temperature value
-                    if temp_str:
-                        if temp_str.startswith('минус'):
-                            temp_str = '-' + temp_str[5:]
-                        temp = normalize_temp_value(temp_str)
-                        if temp is not None:
-                            temps.append(temp)
-        
+        for match in pattern.finditer(text):
+            for temp_str in match.groups():
+                temp = normalize_temp_value(temp_str)
+                if temp is not None:
+                    temps.append(sign * temp)
         if temps:
             return min(temps), max(temps)
-    
     return None
 
 def normalize_temperature_text(text: str) -> str:
@@ -70,18 +73,13 @@ def normalize_temperature_text(text: str) -> str:
     and standardizing format.
     """
     def normalize_temp(match):
-        temp_str = match.group(1)
-        if temp_str.startswith('минус'):
-            temp_str = '-' + temp_str[5:]
-        temp = normalize_temp_value(temp_str)
+        temp = normalize_temp_value(match.group(1))
         if temp is not None:
             return f"{int(temp)}°C"  # Truncate decimal part
         return "N/A°C"
     
     # Replace temperature values
-    text = re.sub(r'(-?\d+)\s*(?:°|градус|c°|°c)', normalize_temp, text)
-    
-    return text
+    return TEMPERATURE_VALUE.sub(normalize_temp, text)
 
 def is_temperature_in_range(text: str, min_required: float, max_required: float) -> bool:
     """
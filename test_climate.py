@@ -0,0 +1,28 @@
+import numpy as np
+
+from climate import AVG, WATER, extract_climate, season_temperature
+
+def test_frost_is_not_water_temperature():
+    table = extract_climate("В январе заморозки до −5 °C.")
+    assert table[0, AVG] == -5
+    assert np.all(np.isnan(table[:, WATER]))
+
+def test_sea_sentence_is_water_temperature():
+    table = extract_climate("Температура воды в море в августе до 24 °C.")
+    assert table[7, WATER] == 24
+    assert np.isnan(table[7, AVG])
+
+def test_lighthouse_is_not_may():
+    table = extract_climate("Летом у маяка жара до +30 °C.")
+    assert season_temperature(table, 'spring') is None
+    assert season_temperature(table, 'summer') == (30.0, 30.0)
+
+def test_may_forms():
+    for sentence in ("В мае 15 °C.", "Средняя температура мая 15 °C."):
+        assert extract_climate(sentence)[4, AVG] == 15
+
+def test_water_forms():
+    table = extract_climate("В июле залив прогревается водой до +26 °C.")
+    assert table[6, WATER] == 26
+    table = extract_climate("В водах залива в августе 22 °C.")
+    assert table[7, WATER] == 22
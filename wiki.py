@@ -1,11 +1,34 @@
-import wikipediaapi
-import asyncio
-from dataclasses import dataclass
-from typing import Dict, List, Optional
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from config import Config
 from osm_service import OSMService, CityPOIs
+from wiki_store import WikiCorpusStore, configured_cities
+
+@dataclass(frozen=True, eq=False)
+class CityFeatures:
+    """Everything the request-time filters need to know about a city, computed once per corpus.
+
+    Built by CityIndex.features from the normalized summary; see TravelAdvisor for
+    where it is attached to WikiContent.
+    """
+    activity_scores: Dict[str, float]
+    season_keyword_counts: Dict[str, int]
+    season_boosts: Dict[str, float]
+    mentioned_temps: Optional[Tuple[float, float]]  # (mean, max) of "температура N" mentions
+    climate: Optional[np.ndarray]                   # (12, 4) table from climate.extract_climate
+    has_beach: bool
+    has_spa: bool
+    has_ski: bool
+    has_aquapark: bool
+    has_kids_infrastructure: bool
+    # Whether the summary mentions the infrastructure the advisor requires for each activity
+    activity_infrastructure: Dict[str, bool] = field(default_factory=dict)
+
+    def activity_score(self, activity: str) -> float:
+        return self.activity_scores.get(activity, 0.0)
 
 @dataclass
 class WikiContent:
@@ -13,6 +36,7 @@ class WikiContent:
     full_text: str
     chunks: List[str]
     pois: Optional[CityPOIs] = None
+    features: Optional[CityFeatures] = None
 
 class TextProcessor:
     def __init__(self, max_chunk_size: int = 4000):
@@ -40,47 +64,66 @@ class TextProcessor:
         return chunks
 
 class WikiService:
-    def __init__(self):
-        self.wiki = wikipediaapi.Wikipedia('torshitapp/1.0', language='ru')
+    def __init__(self, corpus_store: Optional[WikiCorpusStore] = None):
         self.text_processor = TextProcessor()
         self.osm_service = OSMService()
+        self.corpus_store = corpus_store or WikiCorpusStore()
+        self.contents: Dict[str, WikiContent] = {}
+        self._load_corpus()
 
-    async def get_wiki_content(self, city: str) -> WikiContent:
-        loop = asyncio.get_event_loop()
-        
-        # Fetch Wikipedia content
-        with ThreadPoolExecutor() as pool:
-            page = await loop.run_in_executor(pool, self.wiki.page, city)
-            if not page.exists():
-                return None
-            
-            chunks = self.text_processor.create_chunks(city, page.text)
-            
-            # Fetch POIs in parallel
-            pois = await self.osm_service.get_city_pois(city)
-            
-            # Add POI information to chunks
+    def _load_corpus(self):
+        """Load every configured city from the corpus store into memory once."""
+        cities = configured_cities()
+        missing = [city for city in cities if self.corpus_store.get(city) is None]
+        if missing:
+            # Only happens on the very first start: populate the store before serving
+            print(f"Wiki corpus is missing {len(missing)} cities, fetching them once")
+            self.corpus_store.refresh(missing)
+
+        stale = self.corpus_store.stale_cities(cities)
+        if stale:
+            print(f"Warning: {len(stale)} wiki pages are older than the TTL, run `python wiki_store.py refresh`")
+
+        for city in cities:
+            content = self._build_content(city)
+            if content:
+                self.contents[city] = content
+        print(f"Loaded wiki corpus {self.corpus_store.version} with {len(self.contents)} cities")
+
+    def _build_content(self, city: str) -> Optional[WikiContent]:
+        entry = self.corpus_store.get(city)
+        if entry is None:
+            return None
+
+        chunks = self.text_processor.create_chunks(city, entry.text)
+
+        # Add POI information to chunks
+        pois = self.osm_service.get_cached_pois(city)
+        if pois:
             poi_description = self.osm_service.format_poi_description(pois)
             if poi_description:
                 chunks.append(f"Title: {city}\n\nТуристическая информация:\n{poi_description}")
-            
-            return WikiContent(page.summary, page.text, chunks, pois)
+
+        return WikiContent(entry.summary, entry.text, chunks, pois)
+
+    async def get_wiki_content(self, city: str) -> Optional[WikiContent]:
+        if city not in self.contents:
+            content = self._build_content(city)
+            if content is None:
+                print(f"No stored wiki page for '{city}', run `python wiki_store.py refresh {city}`")
+                return None
+            self.contents[city] = content
+        return self.contents[city]
 
     async def get_cities_by_type(self, location_type: str) -> Dict[str, WikiContent]:
         """Get content for cities of a specific type (e.g., 'море', 'город')."""
         if location_type not in Config.RESORT_CITIES:
             print(f"Warning: Unknown location type '{location_type}', falling back to all cities")
-            cities = [city for sublist in Config.RESORT_CITIES.values() for city in sublist]
-        else:
-            cities = Config.RESORT_CITIES[location_type]
-        
-        tasks = [self.get_wiki_content(city) for city in cities]
-        results = await asyncio.gather(*tasks)
-        return {city: content for city, content in zip(cities, results) if content}
+            return await self.get_all_cities_content()
+
+        cities = Config.RESORT_CITIES[location_type]
+        return {city: self.contents[city] for city in cities if city in self.contents}
 
     async def get_all_cities_content(self) -> Dict[str, WikiContent]:
         """Get content for all cities (fallback method)."""
-        all_cities = [city for sublist in Config.RESORT_CITIES.values() for city in sublist]
-        tasks = [self.get_wiki_content(city) for city in all_cities]
-        results = await asyncio.gather(*tasks)
-        return {city: content for city, content in zip(all_cities, results) if content}
+        return dict(self.contents)
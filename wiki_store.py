@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import wikipediaapi
+
+from config import Config
+
+@dataclass
+class CorpusEntry:
+    city: str
+    revision_id: int
+    fetched_at: float
+    summary: str
+    text: str
+
+def configured_cities() -> List[str]:
+    """All cities from Config.RESORT_CITIES, deduplicated, in config order."""
+    return list(dict.fromkeys(city for sublist in Config.RESORT_CITIES.values() for city in sublist))
+
+class WikiCorpusStore:
+    """On-disk Wikipedia corpus keyed by city and revision id.
+
+    Pages are fetched only by `refresh`, never on the request path. Entries older
+    than the TTL are reported as stale and re-fetched on the next refresh; a page
+    whose revision did not change only gets its timestamp bumped.
+    """
+
+    def __init__(self, path: str = Config.WIKI_CORPUS_FILE, ttl_days: float = Config.WIKI_CORPUS_TTL_DAYS):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.entries: Dict[str, CorpusEntry] = self._load()
+        self._wiki = None
+
+    def _load(self) -> Dict[str, CorpusEntry]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return {city: CorpusEntry(**entry) for city, entry in data.get('cities', {}).items()}
+        except Exception as e:
+            print(f"Error loading wiki corpus {self.path}: {str(e)}")
+            return {}
+
+    def save(self):
+        """Atomically write the corpus to disk."""
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {'version': self.version, 'cities': {city: asdict(entry) for city, entry in self.entries.items()}},
+                f, ensure_ascii=False, indent=2
+            )
+        os.replace(tmp_path, self.path)
+
+    @property
+    def version(self) -> str:
+        """Content version of the corpus, derived from the revision of every page."""
+        digest = hashlib.sha1()
+        for city in sorted(self.entries):
+            digest.update(f"{city}:{self.entries[city].revision_id}\n".encode('utf-8'))
+        return digest.hexdigest()[:12]
+
+    @property
+    def wiki(self) -> wikipediaapi.Wikipedia:
+        if self._wiki is None:
+            self._wiki = wikipediaapi.Wikipedia('torshitapp/1.0', language='ru')
+        return self._wiki
+
+    def get(self, city: str) -> Optional[CorpusEntry]:
+        return self.entries.get(city)
+
+    def is_stale(self, city: str) -> bool:
+        entry = self.entries.get(city)
+        return entry is None or time.time() - entry.fetched_at > self.ttl_seconds
+
+    def stale_cities(self, cities: List[str]) -> List[str]:
+        return [city for city in cities if self.is_stale(city)]
+
+    def _fetch(self, city: str, force: bool = False) -> Optional[CorpusEntry]:
+        """Fetch a page, downloading its text only if the revision changed."""
+        page = self.wiki.page(city)
+        if not page.exists():
+            return None
+
+        revision_id = page.lastrevid
+        existing = self.entries.get(city)
+        if existing and existing.revision_id == revision_id and not force:
+            existing.fetched_at = time.time()
+            return existing
+
+        return CorpusEntry(
+            city=city,
+            revision_id=revision_id,
+            fetched_at=time.time(),
+            summary=page.summary,
+            text=page.text
+        )
+
+    def refresh(self, cities: List[str], force: bool = False, max_workers: int = 8) -> List[str]:
+        """Fetch missing or stale pages (all of `cities` if force) and persist the corpus.
+
+        Returns the cities whose stored revision changed.
+        """
+        to_fetch = cities if force else self.stale_cities(cities)
+        if not to_fetch:
+            return []
+
+        print(f"Fetching {len(to_fetch)} Wikipedia pages...")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(lambda city: self._fetch(city, force), to_fetch))
+
+        updated = []
+        for city, entry in zip(to_fetch, results):
+            if entry is None:
+                print(f"Warning: Wikipedia page not found for '{city}'")
+                continue
+            previous = self.entries.get(city)
+            if previous is None or previous.revision_id != entry.revision_id or force:
+                updated.append(city)
+            self.entries[city] = entry
+
+        self.save()
+        print(f"Wiki corpus {self.version}: {len(updated)} pages updated, {len(self.entries)} stored")
+        return updated
+
+if __name__ == "__main__":
+    # Usage: python wiki_store.py refresh [--force] [city ...]
+    if len(sys.argv) < 2 or sys.argv[1] != 'refresh':
+        print("Usage: python wiki_store.py refresh [--force] [city ...]")
+        sys.exit(1)
+
+    args = sys.argv[2:]
+    force = '--force' in args
+    cities = [arg for arg in args if arg != '--force'] or configured_cities()
+    WikiCorpusStore().refresh(cities, force=force)